@@ -1,8 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
 from sqlmodel import Session, select
+from app.core.config import settings
 from app.core.database import get_session
+from app.core.responses import FastJSONResponse
 from app.core.auth import get_current_admin
+from app.core.pagination import encode_cursor, estimated_count, invalidate_count, keyset_after, page_headers, parse_fields
 from app.models.models import License, User
+from app.services.generations import generation_registry
+from app.services import maintenance, similarity
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
@@ -53,23 +60,45 @@ def generate_license(
     session.add(new_license)
     session.commit()
     session.refresh(new_license)
+    invalidate_count("licenses")
     
     return {
         **new_license.dict(),
         "username": user.username
     }
 
+LICENSE_FIELDS = tuple(LicenseRead.model_fields)
+
 @router.get("/list", response_model=List[LicenseRead])
 def list_licenses(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    fields: Optional[str] = None,
     session: Session = Depends(get_session),
     admin: User = Depends(get_current_admin)
 ):
-    """管理员：查看所有授权码及使用情况"""
-    results = session.exec(select(License, User).join(User).order_by(License.created_at.desc())).all()
-    return [
-        {**lic.dict(), "username": user.username}
-        for lic, user in results
-    ]
+    """
+    管理员：查看授权码及使用情况，按创建时间倒序游标分页。
+    下一页游标见 X-Next-Cursor 响应头；fields 可指定返回字段；X-Total-Count 为总数估计。
+    """
+    columns = parse_fields(fields, LICENSE_FIELDS, required=("id", "created_at"))
+    selected = [User.username if c == "username" else getattr(License, c) for c in columns or LICENSE_FIELDS]
+    statement = select(*selected).join(User, User.id == License.user_id)
+    after = keyset_after(License.created_at, License.id, cursor)
+    if after is not None:
+        statement = statement.where(after)
+    rows = session.exec(statement.order_by(License.created_at.desc(), License.id.desc()).limit(limit + 1)).all()
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    total = estimated_count("licenses", lambda: session.exec(select(func.count()).select_from(License)).one())
+    headers = page_headers(next_cursor, total)
+    items = [dict(row._mapping) for row in rows]
+    if columns:
+        return FastJSONResponse(jsonable_encoder(items), headers=headers)
+    response.headers.update(headers)
+    return items
 
 @router.get("/check-me")
 def check_my_license(
@@ -93,3 +122,35 @@ def check_my_license(
         "is_expired": is_expired,
         "is_exhausted": is_exhausted
     }
+
+@router.get("/generation-metrics")
+def generation_metrics(admin: User = Depends(get_current_admin)):
+    """管理员：查看生成完成/失败/取消/断开的统计"""
+    return generation_registry.summary()
+
+@router.get("/near-duplicate-metrics")
+def near_duplicate_metrics(admin: User = Depends(get_current_admin)):
+    """管理员：近似重复输入的查找次数、热启动命中次数与命中率"""
+    return similarity.summary()
+
+@router.get("/maintenance")
+def maintenance_report(admin: User = Depends(get_current_admin)):
+    """最近一次后台维护的报告：清理的行数、文件数及回收的空间"""
+    return {"enabled": settings.MAINTENANCE_ENABLED, "running": maintenance.is_running(), "last_report": maintenance.last_report()}
+
+@router.post("/maintenance/run")
+async def run_maintenance_now(admin: User = Depends(get_current_admin)):
+    """立即执行一轮维护（不等待定时周期）"""
+    if maintenance.is_running():
+        raise HTTPException(status_code=409, detail="维护任务正在执行")
+    return await maintenance.run_maintenance()
+
+@router.post("/maintenance/vacuum")
+async def vacuum_database(admin: User = Depends(get_current_admin)):
+    """
+    完整 VACUUM 并把 auto_vacuum 切换为 INCREMENTAL（之后定时维护只做增量回收）。
+    会重写整个数据库并在执行期间阻塞写入，应在低峰期执行
+    """
+    if maintenance.is_running():
+        raise HTTPException(status_code=409, detail="维护任务正在执行")
+    return await maintenance.run_full_vacuum()
@@ -1,13 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
 from app.core.database import get_session
-from app.core.auth import create_access_token, get_password_hash, verify_password
+from app.core.auth import create_access_token, hash_password, verify_and_update_password
+from app.core.rate_limit import SlidingWindowLimiter, too_many_requests
 from app.models.models import User
 from pydantic import BaseModel
+from typing import Optional
 
 router = APIRouter()
 
+# 每个 IP 的登录/注册次数，以及每个用户名的连续失败次数
+ip_limiter = SlidingWindowLimiter("auth-ip", settings.LOGIN_RATE_LIMIT_PER_IP, settings.LOGIN_RATE_WINDOW_SECONDS)
+failure_limiter = SlidingWindowLimiter("auth-failures", settings.LOGIN_FAILURES_PER_USER, settings.LOGIN_RATE_WINDOW_SECONDS)
+
+def _client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def _check_rate(request: Request, username: Optional[str] = None) -> str:
+    """超限时返回 429；未超限则计入本次请求并返回客户端 IP"""
+    ip = _client_ip(request)
+    retry_after = ip_limiter.retry_after(ip)
+    if retry_after is None and username is not None:
+        retry_after = failure_limiter.retry_after(username)
+    if retry_after is not None:
+        print(f"DEBUG: Auth rate limited: ip={ip} user={username}")
+        raise too_many_requests(retry_after)
+    ip_limiter.hit(ip)
+    return ip
+
+# 注册/登录保持 async，以便在哈希专用线程池中排队（见 app.core.auth）；
+# 查询、提交以及共享状态中的限流计数都是同步 I/O，放到线程池执行，不阻塞事件循环
+def _find_user(session: Session, username: str) -> Optional[User]:
+    return session.exec(select(User).where(User.username == username)).first()
+
+def _save_user(session: Session, user: User):
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -19,21 +52,20 @@ class UserCreate(BaseModel):
     password: str
 
 @router.post("/register", response_model=Token)
-def register(user_in: UserCreate, session: Session = Depends(get_session)):
+async def register(user_in: UserCreate, request: Request, session: Session = Depends(get_session)):
     """用户注册接口"""
+    await run_in_threadpool(_check_rate, request)
     # 检查用户是否已存在
-    existing_user = session.exec(select(User).where(User.username == user_in.username)).first()
+    existing_user = await run_in_threadpool(_find_user, session, user_in.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
     # 创建新用户
     new_user = User(
         username=user_in.username,
-        hashed_password=get_password_hash(user_in.password)
+        hashed_password=await hash_password(user_in.password)
     )
-    session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    await run_in_threadpool(_save_user, session, new_user)
     
     # 自动登录并返回 Token
     access_token = create_access_token(data={"sub": new_user.username})
@@ -45,15 +77,25 @@ def register(user_in: UserCreate, session: Session = Depends(get_session)):
     }
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
     """用户登录接口（支持 OAuth2 标准）"""
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    await run_in_threadpool(_check_rate, request, form_data.username)
+    user = await run_in_threadpool(_find_user, session, form_data.username)
+    verified, new_hash = await verify_and_update_password(form_data.password, user.hashed_password if user else None)
+    if not verified:
+        await run_in_threadpool(failure_limiter.hit, form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    await run_in_threadpool(failure_limiter.reset, form_data.username)
+
+    if new_hash:
+        # 旧算法/旧参数的哈希在登录成功时透明升级
+        user.hashed_password = new_hash
+        await run_in_threadpool(_save_user, session, user)
+        print(f"DEBUG: Password hash upgraded for user {user.id}")
     
     access_token = create_access_token(data={"sub": user.username})
     return {
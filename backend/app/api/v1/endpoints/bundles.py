@@ -0,0 +1,84 @@
+import os
+import uuid
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+from app.core.auth import get_current_user
+from app.core.config import settings
+from app.core.database import get_session
+from app.core.pagination import invalidate_count
+from app.models.models import User
+from app.services import bundles
+from app.services.file_storage import append_stream, discard_file, tmp_dir
+from app.services.knowledge import ingest_file
+
+router = APIRouter()
+
+def _owner(session: Session, current_user: User, user_id: Optional[int]) -> int:
+    """默认为本人；管理员可指定 user_id 导出或导入其他用户的项目（整个租户迁移）"""
+    if user_id is None or user_id == current_user.id:
+        return current_user.id
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="只有管理员可以导出或导入其他用户的项目")
+    if not session.get(User, user_id):
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return user_id
+
+def _parse_ids(project_ids: Optional[str]) -> Optional[List[int]]:
+    if not project_ids:
+        return None
+    try:
+        return [int(value) for value in project_ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="project_ids 应为逗号分隔的项目 ID")
+
+@router.get("/export")
+def export_projects(
+    project_ids: Optional[str] = None,
+    user_id: Optional[int] = None,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    导出项目为 tar.gz（文档、对话记录、Demo 数据与附件），边读边压缩边发送。
+    project_ids=1,2,3 只导出指定项目，省略时导出全部。
+    """
+    owner = _owner(session, current_user, user_id)
+    ids = _parse_ids(project_ids)
+    filename = f"projects-{owner}-{datetime.now():%Y%m%d-%H%M%S}.tar.gz"
+    return StreamingResponse(
+        bundles.export_bundle(owner, ids),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.post("/import")
+async def import_projects(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    user_id: Optional[int] = None,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    导入 /export 生成的包（请求体即为 tar.gz 原文），全部作为新项目，不恢复发布状态。
+    请求体边接收边写入临时文件，再顺序读取导入；附件按内容哈希去重，已有的不重复写入。
+    包大小上限为 BUNDLE_IMPORT_MAX_BYTES，管理员为 BUNDLE_IMPORT_ADMIN_MAX_BYTES。
+    """
+    owner = await run_in_threadpool(_owner, session, current_user, user_id)
+    limit = settings.BUNDLE_IMPORT_ADMIN_MAX_BYTES if current_user.is_admin else settings.BUNDLE_IMPORT_MAX_BYTES
+    path = os.path.join(tmp_dir(), f"{uuid.uuid4().hex}.bundle")
+    try:
+        await append_stream(path, request.stream(), limit=limit)
+        with open(path, "rb") as source:
+            report = await run_in_threadpool(bundles.import_bundle, source, owner)
+    finally:
+        await discard_file(path)
+    invalidate_count(f"projects:{owner}")
+    # 附件的检索索引在后台重建
+    for file_id in report.pop("file_ids"):
+        background_tasks.add_task(ingest_file, file_id)
+    return report
@@ -1,13 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlmodel import Session, select
+from app.core.config import settings
 from app.core.database import get_session
-from app.models.models import DemoData, Project
-from typing import List, Any
-import json
+from app.core.responses import RawJSONResponse, raw_json_body
+from app.models.models import Project
+from app.services import demo_limits
+from app.services.demo_store import get_store
 
 router = APIRouter()
 
-@router.get("/{project_id}/data/{key}")
+# 限流依赖先于读取请求体执行：被拒绝的请求不读取、不解析请求体，也不占用数据库。
+# 检查只需几微秒，直接在事件循环中执行，不占用线程池
+async def throttle_read(request: Request, project_id: str):
+    demo_limits.throttle(request, project_id, settings.DEMO_READ_COST)
+
+async def throttle_write(request: Request, project_id: str):
+    demo_limits.throttle(request, project_id)
+
+@router.get("/{project_id}/data/{key}", dependencies=[Depends(throttle_read)])
 def get_demo_data(project_id: str, key: str, session: Session = Depends(get_session)):
     """获取 Demo 的模拟数据"""
     # 尝试将 project_id 转换为整数，如果失败则尝试查找默认项目或返回空数据
@@ -22,18 +32,15 @@ def get_demo_data(project_id: str, key: str, session: Session = Depends(get_sess
         else:
             return []
 
-    data = session.exec(select(DemoData).where(
-        DemoData.project_id == p_id,
-        DemoData.data_key == key
-    )).first()
-    
-    if not data:
+    content = get_store().get(p_id, key)
+    if content is None:
         return []
-    return json.loads(data.data_content)
+    # 存储的就是 JSON 文本，直接作为响应体，省去解析和重新编码
+    return RawJSONResponse(content)
 
-@router.post("/{project_id}/data/{key}")
-def save_demo_data(project_id: str, key: str, payload: Any = Body(...), session: Session = Depends(get_session)):
-    """保存/更新 Demo 的模拟数据"""
+@router.post("/{project_id}/data/{key}", dependencies=[Depends(throttle_write)])
+def save_demo_data(project_id: str, key: str, payload: str = Depends(raw_json_body), session: Session = Depends(get_session)):
+    """保存/更新 Demo 的模拟数据（校验为合法 JSON 后按原文存储）"""
     try:
         p_id = int(project_id)
     except ValueError:
@@ -42,33 +49,28 @@ def save_demo_data(project_id: str, key: str, payload: Any = Body(...), session:
             p_id = first_project.id
         else:
             raise HTTPException(status_code=400, detail="Invalid project ID and no projects exist")
+    if not demo_limits.project_exists(p_id):
+        raise HTTPException(status_code=404, detail="项目不存在")
 
-    data = session.exec(select(DemoData).where(
-        DemoData.project_id == p_id,
-        DemoData.data_key == key
-    )).first()
-    
-    if not data:
-        data = DemoData(project_id=p_id, data_key=key)
-    
-    data.data_content = json.dumps(payload)
-    session.add(data)
-    session.commit()
+    store = get_store()
+    old_size = store.size(p_id, key)
+    delta = demo_limits.check_quota(p_id, old_size, payload)
+    try:
+        store.put(p_id, key, payload)
+    except Exception:
+        demo_limits.record_write(p_id, -delta, -1 if old_size is None else 0)
+        raise
     return {"status": "success"}
 
-@router.delete("/{project_id}/data/{key}")
-def clear_demo_data(project_id: str, key: str, session: Session = Depends(get_session)):
+@router.delete("/{project_id}/data/{key}", dependencies=[Depends(throttle_write)])
+def clear_demo_data(project_id: str, key: str):
     """清除数据"""
     try:
         p_id = int(project_id)
     except ValueError:
         return {"status": "skipped", "reason": "invalid project id"}
 
-    data = session.exec(select(DemoData).where(
-        DemoData.project_id == p_id,
-        DemoData.data_key == key
-    )).first()
-    if data:
-        session.delete(data)
-        session.commit()
+    size = get_store().delete(p_id, key)
+    if size is not None:
+        demo_limits.record_write(p_id, -size, -1)
     return {"status": "cleared"}
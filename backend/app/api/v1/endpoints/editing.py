@@ -0,0 +1,15 @@
+from fastapi import APIRouter, WebSocket
+from app.services.edit_sessions import EditSession
+
+router = APIRouter()
+
+@router.websocket("/projects/{project_id}/ws")
+async def edit_session(websocket: WebSocket, project_id: int):
+    """
+    原型编辑会话（WebSocket）：连接后第一条消息为 {"type": "auth", "token": "..."}，
+    之后每次修改只需发送 {"type": "edit", "feedback": "...", "trace_ids": [...]}。
+    """
+    await websocket.accept()
+    session = EditSession(websocket, project_id)
+    if await session.open():
+        await session.run()
@@ -1,63 +1,261 @@
 import os
-import shutil
+import uuid
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, UploadFile, File, Form, Request
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
 from sqlmodel import Session, select
-from app.models.models import User, FileUpload
+from app.models.models import User, FileUpload, Project, UploadSession
+from app.core.config import settings
 from app.core.database import get_session
 from app.core.auth import get_current_user
+from app.services.file_serving import serve_file
+from app.services.knowledge import ingest_file
+from app.services.file_storage import (
+    discard_session, finalize_session, session_path, session_size, store_upload, truncate_session,
+    write_stream_at
+)
 from datetime import datetime
 
 router = APIRouter()
 
-UPLOAD_DIR = "uploads"
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
+# 上传目录由 file_storage 在首次写入时创建，导入模块时不访问文件系统
+
+def _upload_result(db_file: FileUpload, deduplicated: bool) -> dict:
+    return {
+        "id": db_file.id,
+        "filename": db_file.filename,
+        "size": db_file.size,
+        "content_hash": db_file.content_hash,
+        "deduplicated": deduplicated,
+        "url": f"/api/v1/files/download/{db_file.id}"
+    }
+
+def _check_project(session: Session, project_id: Optional[int], current_user: User):
+    """附件会进入项目的检索索引并拼入生成提示词，只能关联到本人的项目"""
+    if project_id is None:
+        return
+    project = session.get(Project, project_id)
+    if not project or project.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="项目不存在")
+
+# multipart 表单的边界与字段头部开销
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+class BoundedUploadRoute(APIRoute):
+    """
+    FastAPI 在进入接口函数（和依赖）之前就会把整个 multipart 请求体读完并落盘，接口内的大小检查为时已晚。
+    这里在读取请求体之前按 Content-Length 拦截：没有 Content-Length（分块传输）的请求无法预先限制大小，返回 411。
+    服务器会保证实际请求体不超过声明的 Content-Length。
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            length = request.headers.get("content-length")
+            if length is None or not length.isdigit():
+                raise HTTPException(status_code=411, detail="请求必须带 Content-Length；无法预知大小的文件请使用 /uploads 分片上传接口")
+            if int(length) > settings.UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+                raise HTTPException(status_code=413, detail="文件超过大小限制")
+            return await handler(request)
+
+        return route_handler
 
-@router.post("/upload")
 async def upload_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    project_id: Optional[int] = None,
+    project_id: Optional[int] = Form(None),
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
     """
     真正的文件上传接口：
-    1. 接收前端上传的文件
-    2. 保存到本地 uploads 文件夹
+    1. 接收前端上传的文件，分块写入磁盘（IO 在线程池中执行，不阻塞事件循环）
+    2. 按内容 SHA-256 寻址保存，相同内容只存一份
     3. 将文件元数据与用户绑定
+    4. 关联项目的附件在后台抽取文本、切片并建立检索索引
+    请求体大小在读取之前由 BoundedUploadRoute 按 Content-Length 检查。
+    大文件请使用 /uploads 分片上传接口，支持断点续传。
     """
+    await run_in_threadpool(_check_project, session, project_id, current_user)
     try:
-        # 生成唯一的文件名，防止冲突
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        safe_filename = f"{timestamp}_{file.filename}"
-        file_path = os.path.join(UPLOAD_DIR, safe_filename)
-        
-        # 保存文件到磁盘
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        content_hash, file_path, size, deduplicated = await store_upload(file)
             
         # 存入数据库，绑定当前用户
         db_file = FileUpload(
             filename=file.filename,
             file_path=file_path,
-            file_type=file.content_type,
+            file_type=file.content_type or "application/octet-stream",
             user_id=current_user.id,
-            project_id=project_id
+            project_id=project_id,
+            content_hash=content_hash,
+            size=size
         )
         session.add(db_file)
         session.commit()
         session.refresh(db_file)
+        if db_file.project_id:
+            background_tasks.add_task(ingest_file, db_file.id)
         
-        return {
-            "id": db_file.id,
-            "filename": db_file.filename,
-            "url": f"/api/v1/files/download/{db_file.id}"
-        }
+        return _upload_result(db_file, deduplicated)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
 
+router.add_api_route("/upload", upload_file, methods=["POST"], route_class_override=BoundedUploadRoute)
+
+class UploadInit(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+    project_id: Optional[int] = None
+
+def _get_upload_session(upload_id: str, current_user: User, session: Session) -> UploadSession:
+    upload = session.get(UploadSession, upload_id)
+    if not upload or upload.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="上传会话不存在")
+    return upload
+
+def _save_progress(session: Session, upload: UploadSession):
+    """以磁盘上的实际大小回写已接收字节数（在线程池中调用）"""
+    upload.received = session_size(upload.id)
+    upload.updated_at = datetime.utcnow()
+    session.add(upload)
+    session.commit()
+
+def _save_completed(session: Session, upload: UploadSession, db_file: FileUpload):
+    session.add(db_file)
+    session.delete(upload)
+    session.commit()
+    session.refresh(db_file)
+
+def _delete_upload(session: Session, upload: UploadSession):
+    session.delete(upload)
+    session.commit()
+
+def _session_status(upload: UploadSession) -> dict:
+    return {
+        "upload_id": upload.id,
+        "filename": upload.filename,
+        "size": upload.total_size,
+        "received": upload.received,
+        "chunk_size": settings.UPLOAD_CHUNK_BYTES,
+    }
+
+@router.post("/uploads")
+def create_upload_session(
+    data: UploadInit,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """分片上传：创建上传会话"""
+    if data.size > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="文件超过大小限制")
+    _check_project(session, data.project_id, current_user)
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id,
+        filename=data.filename,
+        content_type=data.content_type or "application/octet-stream",
+        project_id=data.project_id,
+        total_size=data.size
+    )
+    session.add(upload)
+    session.commit()
+    session.refresh(upload)
+    return _session_status(upload)
+
+@router.get("/uploads/{upload_id}")
+def get_upload_session(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """分片上传：查询已接收字节数，用于断点续传"""
+    upload = _get_upload_session(upload_id, current_user, session)
+    received = session_size(upload.id)
+    if received != upload.received:
+        upload.received = received
+        session.add(upload)
+        session.commit()
+    return _session_status(upload)
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """
+    分片上传：请求体为原始字节，offset 必须等于服务端已接收的字节数。
+    按 offset 定位写入而不是追加：客户端重试或多个 Worker 并发收到同一分片时，写的是同一段数据，不会重复拼接。
+    """
+    upload = await run_in_threadpool(_get_upload_session, upload_id, current_user, session)
+    received = await run_in_threadpool(session_size, upload.id)
+    if offset != received:
+        raise HTTPException(status_code=409, detail={"message": "偏移量不匹配", "received": received})
+
+    overflow = False
+    try:
+        await write_stream_at(session_path(upload.id), request.stream(), offset, upload.total_size)
+    except HTTPException as e:
+        if e.status_code != 413:
+            raise
+        overflow = True
+    finally:
+        # 以磁盘为准复核：并发写入或历史遗留的超长文件截回声明大小
+        if await run_in_threadpool(session_size, upload.id) > upload.total_size:
+            await truncate_session(upload.id, upload.total_size)
+        await run_in_threadpool(_save_progress, session, upload)
+    if overflow:
+        raise HTTPException(status_code=400, detail="上传内容超过声明的文件大小")
+    return _session_status(upload)
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """分片上传：全部分片到齐后归档文件并创建附件记录"""
+    upload = await run_in_threadpool(_get_upload_session, upload_id, current_user, session)
+    received = await run_in_threadpool(session_size, upload.id)
+    if received != upload.total_size:
+        raise HTTPException(status_code=409, detail={"message": "文件尚未上传完整", "received": received})
+
+    content_hash, file_path, deduplicated = await finalize_session(upload.id)
+    db_file = FileUpload(
+        filename=upload.filename,
+        file_path=file_path,
+        file_type=upload.content_type,
+        user_id=current_user.id,
+        project_id=upload.project_id,
+        content_hash=content_hash,
+        size=received
+    )
+    await run_in_threadpool(_save_completed, session, upload, db_file)
+    if db_file.project_id:
+        background_tasks.add_task(ingest_file, db_file.id)
+    return _upload_result(db_file, deduplicated)
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """分片上传：放弃上传并删除临时数据"""
+    upload = await run_in_threadpool(_get_upload_session, upload_id, current_user, session)
+    await discard_session(upload.id)
+    await run_in_threadpool(_delete_upload, session, upload)
+    return {"status": "aborted"}
+
 @router.get("/list/{project_id}", response_model=List[FileUpload])
 def list_project_files(project_id: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     """获取指定项目的所有附件（仅限本人）"""
@@ -67,14 +265,44 @@ def list_project_files(project_id: int, current_user: User = Depends(get_current
     )).all()
     return files
 
+@router.post("/reindex/{project_id}")
+def reindex_project_files(
+    project_id: int,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """重新为项目的全部附件建立检索索引（如早于检索功能上传的附件）"""
+    files = session.exec(select(FileUpload).where(
+        FileUpload.project_id == project_id,
+        FileUpload.user_id == current_user.id
+    )).all()
+    for db_file in files:
+        background_tasks.add_task(ingest_file, db_file.id)
+    return {"status": "scheduled", "files": len(files)}
+
 @router.get("/download/{file_id}")
-def download_file(file_id: int, session: Session = Depends(get_session)):
-    """下载/查看文件接口"""
-    db_file = session.get(FileUpload, file_id)
+async def download_file(file_id: int, request: Request, session: Session = Depends(get_session)):
+    """下载/查看文件接口：支持 ETag/Last-Modified 协商缓存、Range 断点续传和 gzip/br 压缩"""
+    db_file = await run_in_threadpool(session.get, FileUpload, file_id)
     if not db_file:
         raise HTTPException(status_code=404, detail="文件不存在")
-    
-    if not os.path.exists(db_file.file_path):
+
+    try:
+        stat_result = await run_in_threadpool(os.stat, db_file.file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="物理文件已丢失")
-        
-    return FileResponse(db_file.file_path, media_type=db_file.file_type)
+
+    media_type = db_file.file_type or "application/octet-stream"
+    if db_file.content_hash:
+        # 内容寻址的文件永不变化：强 ETag + 长期缓存
+        etag = f'"{db_file.content_hash}"'
+        cache_control = "private, max-age=31536000, immutable"
+    else:
+        # 旧数据没有内容哈希，退化为基于 mtime/size 的弱 ETag，每次协商
+        etag = f'W/"{int(stat_result.st_mtime)}-{stat_result.st_size}"'
+        cache_control = "private, no-cache"
+    return await serve_file(
+        request, db_file.file_path, media_type, etag,
+        stat_result.st_size, stat_result.st_mtime, cache_control, filename=db_file.filename
+    )
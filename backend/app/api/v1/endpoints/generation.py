@@ -1,19 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
 from sqlmodel import Session, select
 from app.services.llm_service import llm_service
 from app.models.schemas import (
     RequirementRequest, ProductDocRequest, TechDocRequest, DemoRequest, GenerationResponse, IterateRequest, PartialEditRequest, ReportRequest
 )
 from app.models.models import Project, ProjectCreate, ProjectUpdate, ProjectRead, User
+from app.core.config import settings
 from app.core.database import get_session
+from app.core.responses import FastJSONResponse
 from app.core.auth import get_current_user, verify_license
-from app.core.prompts import (
-    REQUIREMENTS_PROMPT, PRODUCT_DOC_PROMPT, TECHNICAL_DOC_PROMPT, DEMO_PROMPT,
-    REFINE_REQUIREMENTS_PROMPT, REFINE_PRODUCT_DOC_PROMPT, REFINE_TECHNICAL_DOC_PROMPT, ITERATION_PROMPT, PARTIAL_EDIT_PROMPT,
-    REPORT_PROMPT
-)
-from typing import List
+from app.core.pagination import encode_cursor, estimated_count, invalidate_count, keyset_after, page_headers, parse_fields
+from app.services.pipeline import WARM_START_FEEDBACK, build_generation_messages, build_partial_edit_messages
+from app.services.speculation import speculator
+from app.services.streaming import stream_response
+from app.services.generations import generation_registry
+from app.services.html_pipeline import process_html_stream
+from app.services.knowledge import retrieve_references
+from app.services import chat_history, digests, project_search, similarity
+from app.services.demo_snapshots import VERSION_CACHE_CONTROL, current_cache_control, ensure_snapshot, serve_snapshot, snapshot_path
+from app.core.prompt_builder import build_prompt
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
 
 router = APIRouter()
 
@@ -27,16 +38,62 @@ def create_project(project: ProjectCreate, session: Session = Depends(get_sessio
     session.add(db_project)
     session.commit()
     session.refresh(db_project)
+    invalidate_count(f"projects:{current_user.id}")
     return db_project
 
+# chat_history 为旧版遗留列，不再对外返回
+PROJECT_FIELDS = tuple(c for c in Project.__table__.columns.keys() if c != "chat_history")
+
 @router.get("/projects/", response_model=List[ProjectRead])
-def read_projects(offset: int = 0, limit: int = 100, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    projects = session.exec(select(Project).where(Project.user_id == current_user.id).offset(offset).limit(limit).order_by(Project.updated_at.desc())).all()
-    # 临时调试日志
-    print(f"DEBUG: User {current_user.id} ({current_user.username}) has {len(projects)} projects.")
-    for p in projects:
-        print(f" - Project ID: {p.id}, Name: {p.name}, Updated: {p.updated_at}")
-    return projects
+def read_projects(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=200),
+    fields: Optional[str] = None,
+    offset: int = Query(0, ge=0, deprecated=True),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    项目列表，按最近更新排序。
+    - 游标分页：下一页游标在 X-Next-Cursor 响应头中，传回 cursor 参数即可（offset 仅为兼容保留）
+    - fields=id,name,updated_at 只查询并返回指定字段，避免列表页加载全部文档内容
+    - X-Total-Count 为短时缓存的总数估计
+    """
+    columns = parse_fields(fields, PROJECT_FIELDS, required=("id", "updated_at"))
+    statement = select(*[getattr(Project, c) for c in columns]) if columns else select(Project)
+    statement = statement.where(Project.user_id == current_user.id)
+    after = keyset_after(Project.updated_at, Project.id, cursor)
+    if after is not None:
+        statement = statement.where(after)
+    elif offset:
+        statement = statement.offset(offset)
+    rows = session.exec(statement.order_by(Project.updated_at.desc(), Project.id.desc()).limit(limit + 1)).all()
+    next_cursor = encode_cursor(rows[limit - 1].updated_at, rows[limit - 1].id) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    total = estimated_count(
+        f"projects:{current_user.id}",
+        lambda: session.exec(select(func.count()).select_from(Project).where(Project.user_id == current_user.id)).one()
+    )
+    print(f"DEBUG: User {current_user.id} ({current_user.username}) listed {len(rows)} of ~{total} projects.")
+    headers = page_headers(next_cursor, total)
+    if columns:
+        return FastJSONResponse(jsonable_encoder([dict(row._mapping) for row in rows]), headers=headers)
+    response.headers.update(headers)
+    return rows
+
+@router.get("/projects/search")
+def search_projects(
+    q: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=50),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """全文检索本人项目（名称、描述及全部文档），按相关度排序并返回高亮片段；依赖 SQLite FTS5，其他数据库返回 501"""
+    total, items = project_search.search_projects(session, current_user.id, q, offset, limit)
+    return {"total": total, "offset": offset, "limit": limit, "items": items}
 
 @router.get("/projects/{project_id}", response_model=ProjectRead)
 def read_project(project_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
@@ -54,6 +111,7 @@ def update_project(project_id: int, project_update: ProjectUpdate, session: Sess
     project_data = project_update.dict(exclude_unset=True)
     for key, value in project_data.items():
         setattr(db_project, key, value)
+    db_project.updated_at = datetime.utcnow()
     
     session.add(db_project)
     session.commit()
@@ -67,10 +125,73 @@ def delete_project(project_id: int, session: Session = Depends(get_session), cur
     if not db_project or db_project.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="项目不存在")
     
+    chat_history.delete_history(session, project_id)
     session.delete(db_project)
     session.commit()
+    invalidate_count(f"projects:{current_user.id}")
     return {"status": "success", "message": "项目已删除"}
 
+class ChatMessageIn(BaseModel):
+    role: str
+    content: str
+
+class ChatAppendRequest(BaseModel):
+    messages: List[ChatMessageIn]
+
+def _owned_project(session: Session, project_id: int, user: User) -> Project:
+    project = session.get(Project, project_id)
+    if not project or project.user_id != user.id:
+        raise HTTPException(status_code=404, detail="项目不存在")
+    return project
+
+@router.post("/projects/{project_id}/messages")
+def append_chat_messages(
+    project_id: int,
+    request: ChatAppendRequest,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """追加对话消息（只写入新消息）；较早的消息超过阈值时在后台并入滚动摘要"""
+    if not request.messages or len(request.messages) > 50:
+        raise HTTPException(status_code=400, detail="每次追加 1-50 条消息")
+    if any(m.role not in chat_history.ROLES or not m.content for m in request.messages):
+        raise HTTPException(status_code=400, detail="消息角色须为 user/assistant 且内容不能为空")
+    _owned_project(session, project_id, current_user)
+    rows = chat_history.append_messages(session, project_id, [(m.role, m.content) for m in request.messages])
+    invalidate_count(f"chat:{project_id}")
+    if chat_history.needs_summary(session, project_id):
+        background_tasks.add_task(chat_history.summarize_project, project_id)
+    return {"ids": [row.id for row in rows]}
+
+@router.get("/projects/{project_id}/messages")
+def read_chat_messages(
+    project_id: int,
+    response: Response,
+    before: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    对话记录，从最新一页开始向前翻页，每页内按时间正序。
+    更早一页的游标在 X-Next-Cursor 响应头中，传回 before 参数即可。
+    """
+    _owned_project(session, project_id, current_user)
+    rows, next_before = chat_history.read_messages(session, project_id, before, limit)
+    total = estimated_count(f"chat:{project_id}", lambda: chat_history.count_messages(session, project_id))
+    response.headers.update(page_headers(str(next_before) if next_before else None, total))
+    return [{"id": row.id, "role": row.role, "content": row.content, "created_at": row.created_at} for row in rows]
+
+@router.get("/projects/{project_id}/messages/summary")
+def read_chat_summary(project_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+    """较早对话的滚动摘要（尚未生成时 content 为空）"""
+    _owned_project(session, project_id, current_user)
+    summary = chat_history.get_summary(session, project_id)
+    if not summary:
+        return {"content": "", "covered_until": 0, "message_count": 0, "updated_at": None}
+    return summary
+
 import uuid
 
 @router.post("/projects/{project_id}/publish")
@@ -86,7 +207,13 @@ def publish_project(project_id: int, session: Session = Depends(get_session), cu
         session.commit()
         session.refresh(project)
     
-    return {"share_token": project.share_token, "url": f"/preview/{project.share_token}"}
+    # 发布时即生成快照，首个访客无需等待构建
+    manifest = ensure_snapshot(project.share_token)
+    return {
+        "share_token": project.share_token,
+        "url": f"{settings.API_V1_STR}/generation/public/demo/{project.share_token}",
+        "snapshot_version": manifest["version"] if manifest else None,
+    }
 
 @router.get("/public/preview/{share_token}")
 def get_public_project(share_token: str, session: Session = Depends(get_session)):
@@ -101,9 +228,48 @@ def get_public_project(share_token: str, session: Session = Depends(get_session)
         "project_id": project.id
     }
 
+@router.get("/public/demo/{share_token}")
+async def get_public_demo(share_token: str, request: Request):
+    """公网免登录访问已发布 Demo：直接返回预生成的 HTML 快照（已注入 PROJECT_ID 和初始数据）"""
+    manifest = await run_in_threadpool(ensure_snapshot, share_token)
+    if not manifest:
+        raise HTTPException(status_code=404, detail="分享链接已失效")
+    path = snapshot_path(share_token, manifest["version"])
+    if not path:
+        raise HTTPException(status_code=404, detail="分享链接已失效")
+    return serve_snapshot(request, path, manifest["version"], current_cache_control())
+
+@router.get("/public/demo/{share_token}/{version}")
+def get_public_demo_version(share_token: str, version: str, request: Request):
+    """指定版本的快照，内容不变，可永久缓存"""
+    path = snapshot_path(share_token, version)
+    if not path:
+        raise HTTPException(status_code=404, detail="快照版本不存在")
+    return serve_snapshot(request, path, version, VERSION_CACHE_CONTROL)
+
+@router.get("/generations/{generation_id}")
+def read_generation(generation_id: str, current_user: User = Depends(get_current_user)):
+    """
+    查询生成状态；被取消/断开的生成也会返回已产出的部分内容。
+    在其他 worker 上运行中的生成只返回输出的末尾部分（output_truncated 为 true）
+    """
+    snapshot = generation_registry.lookup(generation_id)
+    if not snapshot or snapshot.pop("user_id") != current_user.id:
+        raise HTTPException(status_code=404, detail="生成任务不存在")
+    return snapshot
+
+@router.post("/generations/{generation_id}/cancel")
+def cancel_generation(generation_id: str, current_user: User = Depends(get_current_user)):
+    """取消进行中的生成，立即关闭上游流"""
+    snapshot = generation_registry.cancel(generation_id, current_user.id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="生成任务不存在或已结束")
+    return {"status": "cancelling", "generation_id": generation_id}
+
 @router.post("/stream/partial_edit")
 async def stream_partial_edit(
     request: PartialEditRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     licensed: bool = Depends(verify_license)
 ):
@@ -111,216 +277,235 @@ async def stream_partial_edit(
         print(f"DEBUG: Partial edit request for user {current_user.username}")
         print(f"DEBUG: Selected elements count: {len(request.selected_elements)}")
         
-        selected_info = []
-        for el in request.selected_elements:
-            info = []
-            if el.traceId:
-                info.append(f"Trace ID: {el.traceId}")
-            if el.selector:
-                info.append(f"Selector: {el.selector}")
-            info.append(f"Current HTML Snippet: {el.html}")
-            selected_info.append("\n".join(info))
-        
-        selected_info_str = "\n---\n".join(selected_info)
-        
-        prompt = PARTIAL_EDIT_PROMPT.replace("{selected_elements_info}", selected_info_str)\
-                                   .replace("{user_feedback}", request.user_feedback)\
-                                   .replace("{current_code}", request.current_code)
-        
-        messages = [
-            {"role": "system", "content": "你是一个精准的代码修改助手。"},
-            {"role": "user", "content": prompt}
-        ]
+        messages, prompt_stats = build_partial_edit_messages(
+            request.current_code, [el.dict() for el in request.selected_elements], request.user_feedback
+        )
         
-        return StreamingResponse(
+        generator = process_html_stream(
             llm_service.chat_completion_stream(messages, model=request.model),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            }
+            original_code=request.current_code
         )
+        return await stream_response(generator, http_request, current_user.id, "partial_edit", prompt_stats)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR in stream_partial_edit: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _similar(stage: str, request, current_user: User, source_text: Optional[str]) -> Optional[dict]:
+    """查找输入近似重复、且已有该阶段产物的历史项目（命中后以其产物为基础修改，而不是从零生成）"""
+    if not similarity.warm_start_enabled(request.warm_start):
+        return None
+    match = await run_in_threadpool(similarity.find_similar, stage, source_text, current_user.id, request.project_id)
+    if match:
+        print(f"DEBUG: Near-duplicate {stage} input for user {current_user.id}, reusing project {match['project_id']} ({match['similarity']})")
+    return match
+
+def _warm_start_messages(stage: str, match: dict, source_text: str):
+    """热启动提示词：相似项目的产物作为当前文档/代码，本次输入作为修改意见"""
+    feedback = WARM_START_FEEDBACK.format(source=source_text)
+    if stage == "demo":
+        messages, prompt_stats = build_prompt("iterate", conversation="", current_code=match["output"], user_feedback=feedback)
+    else:
+        messages, prompt_stats = build_prompt(f"refine_{stage}", conversation="", current_content=match["output"], feedback=feedback)
+    prompt_stats["warm_start"] = {key: match[key] for key in ("project_id", "name", "similarity")}
+    return messages, prompt_stats
+
+def _generation_stream(stage: str, request, current_user: User, docs: dict, warm_start: Optional[dict] = None):
+    """生成模式的输出流：命中预测结果时直接复用，其次是近似重复项目的热启动，完整交付后预测下一阶段"""
+    if warm_start:
+        messages, prompt_stats = _warm_start_messages(stage, warm_start, docs[similarity.STAGE_SOURCE[stage]])
+    else:
+        messages, prompt_stats = build_generation_messages(stage, docs)
+    if not speculator.enabled(request.speculate):
+        return llm_service.chat_completion_stream(messages, model=request.model), prompt_stats
+
+    source = None
+    if stage != "requirements":
+        source = speculator.claim(current_user.id, stage, request.model, docs)
+    if source is None:
+        source = llm_service.chat_completion_stream(messages, model=request.model)
+    else:
+        # 预测结果与本次输入完全一致，优先于热启动
+        prompt_stats = build_generation_messages(stage, docs)[1]
+        prompt_stats["speculation_hit"] = True
+    return speculator.track(current_user.id, stage, request.model, docs, source), prompt_stats
+
+async def _references(request, current_user: User, query: str):
+    """从项目附件中检索与本阶段输入相关的参考资料（只取 top-k，提示词大小有上界）"""
+    if not request.project_id:
+        return "", None
+    # 查询只取前若干字符即可覆盖主题，避免长文档产生过多查询词
+    return await run_in_threadpool(retrieve_references, request.project_id, current_user.id, query[:4000])
+
+async def _conversation(request, current_user: User) -> str:
+    """修改模式附带的对话背景：滚动摘要 + 最近几条用户意见"""
+    if not request.project_id:
+        return ""
+    return await run_in_threadpool(chat_history.conversation_context, request.project_id, current_user.id)
+
+def _refine_stream(stage: str, request, feedback: str, conversation: str):
+    """文档修改模式：静态指令在前，对话背景、当前文档与反馈在后"""
+    messages, prompt_stats = build_prompt(
+        f"refine_{stage}", conversation=conversation, current_content=request.current_content, feedback=feedback
+    )
+    return llm_service.chat_completion_stream(messages, model=request.model), prompt_stats
+
 @router.post("/stream/requirements")
 async def stream_requirements(
     request: RequirementRequest, 
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     licensed: bool = Depends(verify_license)
 ):
     # Usage tracking could go here
     if request.current_content:
         # Refinement Mode
-        content = REFINE_REQUIREMENTS_PROMPT.replace("{current_content}", request.current_content)\
-                                           .replace("{feedback}", request.raw_requirement)
-        messages = [
-            {"role": "system", "content": content}
-        ]
+        speculator.discard_from(current_user.id, "requirements")
+        conversation = await _conversation(request, current_user)
+        generator, prompt_stats = _refine_stream("requirements", request, request.raw_requirement, conversation)
     else:
         # Generation Mode
-        messages = [
-            {"role": "system", "content": REQUIREMENTS_PROMPT},
-            {"role": "user", "content": request.raw_requirement}
-        ]
+        references, reference_stats = await _references(request, current_user, request.raw_requirement)
+        # 检索到附件参考资料时，历史项目的需求文档不包含这些资料，不做热启动
+        warm_start = None if references else await _similar("requirements", request, current_user, request.raw_requirement)
+        generator, prompt_stats = _generation_stream("requirements", request, current_user, {
+            "raw_requirement": request.raw_requirement,
+            "references": references,
+        }, warm_start)
+        if reference_stats:
+            prompt_stats["references"] = reference_stats
         
-    return StreamingResponse(
-        llm_service.chat_completion_stream(messages, model=request.model),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
-    )
+    return await stream_response(generator, http_request, current_user.id, "requirements", prompt_stats)
 
 @router.post("/stream/product")
 async def stream_product_doc(
     request: ProductDocRequest, 
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     licensed: bool = Depends(verify_license)
 ):
     if request.current_content:
         # Refinement Mode
-        content = REFINE_PRODUCT_DOC_PROMPT.replace("{current_content}", request.current_content)\
-                                          .replace("{feedback}", request.feedback or "Please improve based on requirements.")
-        messages = [
-            {"role": "system", "content": content}
-        ]
+        speculator.discard_from(current_user.id, "product")
+        conversation = await _conversation(request, current_user)
+        generator, prompt_stats = _refine_stream("product", request, request.feedback or "Please improve based on requirements.", conversation)
     else:
         # Generation Mode
-        messages = [
-            {"role": "system", "content": PRODUCT_DOC_PROMPT},
-            {"role": "user", "content": f"基于以下需求文档生成PRD：\n\n{request.requirements_doc}"}
-        ]
-    return StreamingResponse(
-        llm_service.chat_completion_stream(messages, model=request.model),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
-    )
+        warm_start = await _similar("product", request, current_user, request.requirements_doc)
+        generator, prompt_stats = _generation_stream("product", request, current_user, {"requirements_doc": request.requirements_doc}, warm_start)
+    return await stream_response(generator, http_request, current_user.id, "product", prompt_stats)
 
 @router.post("/stream/technical")
 async def stream_tech_doc(
     request: TechDocRequest, 
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     licensed: bool = Depends(verify_license)
 ):
     if request.current_content:
         # Refinement Mode
-        content = REFINE_TECHNICAL_DOC_PROMPT.replace("{current_content}", request.current_content)\
-                                            .replace("{feedback}", request.feedback or "Please improve based on PRD.")
-        messages = [
-            {"role": "system", "content": content}
-        ]
+        speculator.discard_from(current_user.id, "technical")
+        conversation = await _conversation(request, current_user)
+        generator, prompt_stats = _refine_stream("technical", request, request.feedback or "Please improve based on PRD.", conversation)
     else:
         # Generation Mode
-        messages = [
-            {"role": "system", "content": TECHNICAL_DOC_PROMPT},
-            {"role": "user", "content": f"基于以下PRD生成技术方案：\n\n{request.product_doc}"}
-        ]
-    return StreamingResponse(
-        llm_service.chat_completion_stream(messages, model=request.model),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
-    )
+        warm_start = await _similar("technical", request, current_user, request.product_doc)
+        generator, prompt_stats = _generation_stream("technical", request, current_user, {"product_doc": request.product_doc}, warm_start)
+    return await stream_response(generator, http_request, current_user.id, "technical", prompt_stats)
 
 @router.post("/stream/demo")
 async def stream_demo(
     request: DemoRequest, 
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     licensed: bool = Depends(verify_license)
 ):
     if request.current_content:
         # Refinement Mode
-        content = ITERATION_PROMPT.replace("{current_code}", request.current_content)\
-                                 .replace("{user_feedback}", request.feedback or "优化现有代码")
-        messages = [
-            {"role": "system", "content": content}
-        ]
+        speculator.discard_from(current_user.id, "demo")
+        messages, prompt_stats = build_prompt(
+            "iterate",
+            conversation=await _conversation(request, current_user),
+            current_code=request.current_content,
+            user_feedback=request.feedback or "优化现有代码"
+        )
+        generator = process_html_stream(
+            llm_service.chat_completion_stream(messages, model=request.model),
+            original_code=request.current_content
+        )
     else:
-        # Construct a comprehensive prompt based on all available documents
-        context_parts = []
-        if request.requirements_doc:
-            context_parts.append(f"【需求文档 (PRD 背景)】：\n{request.requirements_doc}")
-        if request.product_doc:
-            context_parts.append(f"【UI/交互设计文档】：\n{request.product_doc}")
-        context_parts.append(f"【核心开发/技术文档】：\n{request.tech_doc}")
-        
-        full_context = "\n\n---\n\n".join(context_parts)
-        
-        messages = [
-            {"role": "system", "content": DEMO_PROMPT},
-            {"role": "user", "content": f"请结合以下全套设计文档，生成最终的高保真原型代码：\n\n{full_context}"}
-        ]
+        # Generation Mode: 结合全套设计文档生成原型
+        references, reference_stats = await _references(
+            request, current_user, f"{request.requirements_doc or ''}\n{request.tech_doc}"
+        )
+        warm_start = None if references else await _similar("demo", request, current_user, request.tech_doc)
+        source, prompt_stats = _generation_stream("demo", request, current_user, {
+            "requirements_doc": request.requirements_doc,
+            "product_doc": request.product_doc,
+            "tech_doc": request.tech_doc,
+            "references": references,
+        }, warm_start)
+        if reference_stats:
+            prompt_stats["references"] = reference_stats
+        # 热启动输出的是针对历史原型的修改，需要基于原代码合并
+        generator = process_html_stream(source, original_code=warm_start["output"] if "warm_start" in prompt_stats else None)
         
-    return StreamingResponse(
-        llm_service.chat_completion_stream(messages, model=request.model),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
-    )
+    return await stream_response(generator, http_request, current_user.id, "demo", prompt_stats)
 
 @router.post("/stream/report")
 async def stream_report(
     request: ReportRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     licensed: bool = Depends(verify_license)
 ):
-    """生成项目汇报报告"""
-    req_doc = request.requirements_doc or "暂无需求文档"
-    prod_doc = request.product_doc or "暂无设计文档"
-    t_doc = request.tech_doc or "暂无技术文档"
-    d_code = request.demo_code or "暂无原型代码"
-    
-    prompt = REPORT_PROMPT.replace("{requirements_doc}", req_doc)\
-                         .replace("{product_doc}", prod_doc)\
-                         .replace("{tech_doc}", t_doc)\
-                         .replace("{demo_code}", d_code[:4000] + "..." if len(d_code) > 4000 else d_code)
-    
-    if request.feedback:
-        prompt += f"\n\n用户的补充修改意见：{request.feedback}"
-        
-    messages = [
-        {"role": "system", "content": "你是一个顶级的战略咨询顾问和项目汇报专家。"},
-        {"role": "user", "content": prompt}
-    ]
+    """生成项目汇报报告（各文档以结构摘要发送，提示词大小与文档长度基本无关）"""
+    docs = {
+        "requirements_doc": request.requirements_doc,
+        "product_doc": request.product_doc,
+        "tech_doc": request.tech_doc,
+        "demo_code": request.demo_code,
+    }
+    digest_stats = None
+    if settings.ARTIFACT_DIGESTS:
+        docs, digest_stats = await run_in_threadpool(digests.digest_documents, docs, request.project_id, current_user.id)
+    elif request.demo_code and len(request.demo_code) > 4000:
+        docs["demo_code"] = request.demo_code[:4000] + "..."
+
+    messages, prompt_stats = build_prompt(
+        "report_digest" if settings.ARTIFACT_DIGESTS else "report",
+        requirements_doc=docs["requirements_doc"] or "暂无需求文档",
+        product_doc=docs["product_doc"] or "暂无设计文档",
+        tech_doc=docs["tech_doc"] or "暂无技术文档",
+        demo_code=docs["demo_code"] or "暂无原型代码",
+        feedback=f"\n\n用户的补充修改意见：{request.feedback}" if request.feedback else ""
+    )
+    if digest_stats:
+        prompt_stats["digests"] = digest_stats
     
-    return StreamingResponse(
+    return await stream_response(
         llm_service.chat_completion_stream(messages, model=request.model),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
+        http_request, current_user.id, "report", prompt_stats
     )
 
 @router.post("/stream/iterate")
 async def stream_iterate(
     request: IterateRequest, 
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     licensed: bool = Depends(verify_license)
 ):
-    messages = [
-        {"role": "system", "content": ITERATION_PROMPT},
-        {"role": "user", "content": f"当前代码：\n```html\n{request.current_code}\n```\n\n修改意见：{request.user_feedback}"}
-    ]
-    return StreamingResponse(
+    messages, prompt_stats = build_prompt(
+        "iterate",
+        conversation=await _conversation(request, current_user),
+        current_code=request.current_code,
+        user_feedback=request.user_feedback
+    )
+    generator = process_html_stream(
         llm_service.chat_completion_stream(messages, model=request.model),
-        media_type="text/event-stream"
+        original_code=request.current_code
     )
+    return await stream_response(generator, http_request, current_user.id, "iterate", prompt_stats)
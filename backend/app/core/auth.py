@@ -1,21 +1,54 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import partial
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from passlib.hash import argon2 as passlib_argon2
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import update
 from sqlmodel import Session, select
 from app.models.models import User, License
+from app.core.config import settings
 from app.core.database import get_session
+from app.core import tracing
 
 # 安全配置（实际生产环境应使用环境变量）
 SECRET_KEY = "your-secret-key-for-military-demo"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 令牌有效期 24 小时
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def _build_password_context() -> CryptContext:
+    """
+    默认算法由 PASSWORD_HASH_SCHEME 决定，其余算法仅用于校验旧哈希；
+    deprecated="auto" 使旧算法（或低于当前参数）的哈希在校验后被标记为需要升级。
+    """
+    scheme = settings.PASSWORD_HASH_SCHEME
+    if scheme == "argon2" and not passlib_argon2.has_backend():
+        print("DEBUG: argon2-cffi 未安装，密码哈希回退为 bcrypt")
+        scheme = "bcrypt"
+    return CryptContext(
+        schemes=[scheme] + [s for s in ("argon2", "bcrypt") if s != scheme],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__rounds=settings.BCRYPT_ROUNDS,
+        argon2__type="ID",
+        argon2__time_cost=settings.ARGON2_TIME_COST,
+        argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+        argon2__parallelism=settings.ARGON2_PARALLELISM,
+    )
+
+pwd_context = _build_password_context()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/auth/login")
 
+# 哈希是刻意设计得很慢的 CPU 计算，放在独立的小线程池中执行，
+# 登录高峰时只会在这里排队，不会占满处理其他请求的线程池
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending_hashes = 0
+_dummy_hash: Optional[str] = None
+
 def verify_password(plain_password, hashed_password):
     """验证明文密码和哈希值是否匹配"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -24,6 +57,38 @@ def get_password_hash(password):
     """生成密码哈希值"""
     return pwd_context.hash(password)
 
+async def _run_hash(func, *args):
+    global _pending_hashes
+    if _pending_hashes >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="登录请求繁忙，请稍后重试",
+            headers={"Retry-After": "1"}
+        )
+    _pending_hashes += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, partial(func, *args))
+    finally:
+        _pending_hashes -= 1
+
+async def hash_password(password: str) -> str:
+    """异步生成密码哈希（在哈希专用线程池中执行）"""
+    return await _run_hash(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """
+    异步校验密码，返回 (是否匹配, 新哈希)。
+    旧算法或旧参数的哈希校验通过时返回按当前配置重新计算的哈希，调用方保存即可完成升级。
+    hashed_password 为空（用户不存在）时仍做一次等价耗时的校验，避免通过响应时间探测用户名。
+    """
+    global _dummy_hash
+    if not hashed_password:
+        if _dummy_hash is None:
+            _dummy_hash = await _run_hash(pwd_context.hash, "dummy-password")
+        await _run_hash(pwd_context.verify, plain_password, _dummy_hash)
+        return False, None
+    return await _run_hash(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """创建 JWT 访问令牌"""
     to_encode = data.copy()
@@ -41,17 +106,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    with tracing.span("auth.current_user"):
+        user = user_from_token(session, token)
+        if user is None:
             raise credentials_exception
+        return user
+
+def user_from_token(session: Session, token: Optional[str]) -> Optional[User]:
+    """解析 JWT 并加载用户；令牌无效或用户不存在时返回 None"""
+    try:
+        payload = jwt.decode(token or "", SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        raise credentials_exception
-    user = session.exec(select(User).where(User.username == username)).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    return session.exec(select(User).where(User.username == username)).first()
+
+def token_expires_at(token: Optional[str]) -> Optional[float]:
+    """JWT 的过期时间（Unix 时间戳），用于长连接在令牌过期时断开；令牌须已由 user_from_token 校验"""
+    try:
+        expires = jwt.get_unverified_claims(token or "").get("exp")
+    except JWTError:
+        return None
+    return float(expires) if expires is not None else None
 
 async def get_current_admin(current_user: User = Depends(get_current_user)):
     """检查当前用户是否为管理员"""
@@ -67,9 +145,19 @@ async def verify_license(current_user: User = Depends(get_current_user), session
     # 管理员豁免校验
     if current_user.is_admin:
         return True
-        
+
+    with tracing.span("auth.verify_license"):
+        lic = check_license(session, current_user)
+        # 增加使用次数
+        lic.used_calls += 1
+        session.add(lic)
+        session.commit()
+        return True
+
+def check_license(session: Session, user: User) -> License:
+    """返回用户当前有效的 License，无效时抛出 402（不计次）"""
     lic = session.exec(select(License).where(
-        License.user_id == current_user.id, 
+        License.user_id == user.id, 
         License.is_active == True
     )).first()
     
@@ -81,9 +169,22 @@ async def verify_license(current_user: User = Depends(get_current_user), session
         
     if lic.used_calls >= lic.max_calls:
         raise HTTPException(status_code=402, detail="授权额度已耗尽")
-        
-    # 增加使用次数
-    lic.used_calls += 1
-    session.add(lic)
+    return lic
+
+def charge_license(session: Session, license_id: int) -> bool:
+    """
+    已校验过的 License 计一次调用：单条条件 UPDATE，仍有效且未超额时才成功。
+    供长连接（编辑会话）使用，不必每次重新解析令牌、查询用户和 License。
+    """
+    result = session.exec(
+        update(License)
+        .where(
+            License.id == license_id,
+            License.is_active == True,
+            License.expires_at >= datetime.now(),
+            License.used_calls < License.max_calls,
+        )
+        .values(used_calls=License.used_calls + 1)
+    )
     session.commit()
-    return True
+    return result.rowcount == 1
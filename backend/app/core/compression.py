@@ -0,0 +1,129 @@
+import gzip
+import zlib
+from typing import List, Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.config import settings
+from app.services.file_serving import HAS_BROTLI, is_compressible, variant_etag
+
+def _negotiate(headers: Headers) -> Optional[str]:
+    accepted = {part.split(";")[0].strip() for part in headers.get("accept-encoding", "").split(",")}
+    if HAS_BROTLI and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+class _StreamCompressor:
+    """流式压缩：每次 flush 都输出到当前位置为止的完整数据，客户端可以立即解压"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            import brotli
+            self._compressor = brotli.Compressor(quality=settings.API_BROTLI_QUALITY)
+        else:
+            # wbits=31：带 gzip 头的 deflate 流
+            self._compressor = zlib.compressobj(settings.API_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def flush(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH)
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        import brotli
+        return brotli.compress(data, quality=settings.API_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=settings.API_GZIP_LEVEL, mtime=0)
+
+class CompressionMiddleware:
+    """
+    API 响应的按需压缩（纯 ASGI 实现，不包装 StreamingResponse）：
+    - 一次性响应：小于 COMPRESS_MIN_BYTES 的原样返回，否则整体压缩；
+    - 流式响应（SSE 与纯文本生成流）：逐条压缩并立即 flush，不做任何缓冲，首字节时间不变；
+    - 已带 Content-Encoding 的响应（预压缩的静态资源、Demo 快照）、分段下载和不可压缩类型直接透传。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = _negotiate(Headers(scope=scope))
+        if encoding is None or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponder(encoding, send).run(self.app, scope, receive)
+
+class _CompressedResponder:
+    def __init__(self, encoding: str, send: Send):
+        self.encoding = encoding
+        self.send = send
+        self.start: Optional[Message] = None
+        self.eligible = False
+        self.streaming: Optional[_StreamCompressor] = None
+
+    async def run(self, app: ASGIApp, scope: Scope, receive: Receive):
+        await app(scope, receive, self.handle)
+
+    def _check(self, message: Message) -> bool:
+        headers = Headers(raw=message["headers"])
+        if message["status"] in (204, 206, 304) or "content-encoding" in headers:
+            return False
+        return is_compressible(headers.get("content-type"))
+
+    def _headers(self, length: Optional[int]) -> List[Tuple[bytes, bytes]]:
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        if "etag" in headers:
+            headers["ETag"] = variant_etag(headers["etag"], self.encoding)
+        if length is None:
+            del headers["content-length"]
+        else:
+            headers["Content-Length"] = str(length)
+        return headers.raw
+
+    async def handle(self, message: Message):
+        if message["type"] == "http.response.start":
+            # 先暂存响应头，根据第一段响应体决定是否压缩
+            self.start = message
+            self.eligible = self._check(message)
+            if self.eligible:
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+            else:
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or not self.eligible:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.streaming is not None:
+            data = self.streaming.flush(body) if more_body else self.streaming.finish(body)
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+        if not more_body:
+            # 一次性响应
+            if len(body) < settings.COMPRESS_MIN_BYTES:
+                await self.send(self.start)
+                await self.send(message)
+                return
+            body = _compress(body, self.encoding)
+            self.start["headers"] = self._headers(len(body))
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+        # 流式响应：长度未知，逐段压缩并 flush
+        self.streaming = _StreamCompressor(self.encoding)
+        self.start["headers"] = self._headers(None)
+        await self.send(self.start)
+        await self.send({"type": "http.response.body", "body": self.streaming.flush(body), "more_body": True})
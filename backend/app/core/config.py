@@ -9,7 +9,173 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: Optional[str] = None
     OPENAI_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
     DEFAULT_MODEL: str = "glm-4.7"
+
+    # 上游容错：首 Token 前重试、对冲请求、熔断
+    LLM_MAX_RETRIES: int = 2
+    LLM_RETRY_BASE_DELAY: float = 0.5
+    LLM_RETRY_MAX_DELAY: float = 8.0
+    LLM_HEDGE_DELAY_SECONDS: float = 10.0  # 0 表示不发对冲请求
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5
+    LLM_BREAKER_RESET_SECONDS: float = 30.0
     
+    # Speculative prefetch: 某阶段交付后后台预先生成下一阶段
+    SPECULATIVE_PREFETCH: bool = False
+    SPECULATION_MAX_INFLIGHT_PER_USER: int = 1
+    SPECULATION_MAX_ENTRIES_PER_USER: int = 2
+    SPECULATION_TTL_SECONDS: int = 1800
+
+    # 保留最近结束的生成记录（含部分输出）供查询
+    GENERATION_HISTORY_SIZE: int = 100
+
+    # 文件上传
+    UPLOAD_DIR: str = "uploads"
+    UPLOAD_MAX_BYTES: int = 100 * 1024 * 1024
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+
+    # 文件下发：文本类资源的预压缩副本缓存目录及最小压缩大小
+    COMPRESSED_CACHE_DIR: str = "cache/compressed"
+    COMPRESS_MIN_BYTES: int = 1024
+    BROTLI_QUALITY: int = 11
+    # API 响应的实时压缩（流式响应逐条 flush）：实时压缩使用较低的压缩级别
+    API_COMPRESSION: bool = True
+    API_GZIP_LEVEL: int = 6
+    API_BROTLI_QUALITY: int = 4
+
+    # 参考资料检索：切片大小、重叠，以及注入提示词的切片数和字符上限
+    KNOWLEDGE_CHUNK_CHARS: int = 800
+    KNOWLEDGE_CHUNK_OVERLAP: int = 100
+    KNOWLEDGE_TOP_K: int = 5
+    KNOWLEDGE_MAX_CHARS: int = 4000
+
+    # 密码哈希：新密码使用的算法（argon2 需要 argon2-cffi，缺失时回退 bcrypt），
+    # 旧算法的哈希在登录成功时自动升级
+    PASSWORD_HASH_SCHEME: str = "argon2"
+    BCRYPT_ROUNDS: int = 12
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 64 * 1024  # KiB
+    ARGON2_PARALLELISM: int = 1
+    # 哈希计算使用独立线程池，与请求线程池隔离；排队超过上限直接返回 503
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32
+
+    # 登录/注册限流（滑动窗口）
+    LOGIN_RATE_WINDOW_SECONDS: int = 60
+    LOGIN_RATE_LIMIT_PER_IP: int = 20
+    LOGIN_FAILURES_PER_USER: int = 5
+
+    # 跨进程共享状态（限流、计数缓存、生成任务快照）：memory / sqlite / redis
+    # 多 worker 部署时 gunicorn.conf.py 默认切换为 sqlite
+    SHARED_STATE_BACKEND: str = "memory"
+    SHARED_STATE_PATH: str = "data/shared_state.db"
+    REDIS_URL: str = "redis://localhost:6379/0"
+    # 多 worker 时生成快照同步及远程取消检查的间隔；运行中的快照只带最近 GENERATION_SYNC_TAIL_CHARS 个字符的输出，
+    # 结束时再写入完整输出
+    GENERATION_SYNC_INTERVAL: float = 1.0
+    GENERATION_SYNC_TAIL_CHARS: int = 4000
+
+    # 对话记录：逐条追加存储；未摘要的消息超过 CHAT_RECENT_MESSAGES + CHAT_SUMMARY_BATCH 条时，
+    # 除最近 CHAT_RECENT_MESSAGES 条外全部并入滚动摘要，修改类提示词只携带摘要和最近几条
+    CHAT_RECENT_MESSAGES: int = 12
+    CHAT_SUMMARY_BATCH: int = 20
+    CHAT_SUMMARY_MAX_CHARS: int = 2000
+    CHAT_MESSAGE_MAX_CHARS: int = 20000
+    CHAT_SUMMARY_MODEL: Optional[str] = None  # 为空时使用 DEFAULT_MODEL
+
+    # 近似重复输入复用：与历史项目的阶段输入足够相似（MinHash 估计的字符 shingle Jaccard 相似度）时，
+    # 以该项目的产物为起点走修改模式，而不是从零生成；NEAR_DUP_SCOPE 为 user 时只复用本人的项目。
+    # 会把历史项目的产物带入新项目，默认关闭，需要时显式开启
+    NEAR_DUP_ENABLED: bool = False
+    NEAR_DUP_THRESHOLD: float = 0.8
+    NEAR_DUP_SCOPE: str = "user"
+    NEAR_DUP_SHINGLE_CHARS: int = 3
+    NEAR_DUP_NUM_PERM: int = 64
+    NEAR_DUP_BANDS: int = 16
+    NEAR_DUP_MAX_CHARS: int = 20000
+    NEAR_DUP_MAX_CANDIDATES: int = 200
+
+    # 文档结构摘要：文档保存时提取大纲、关键实体和原型的 data-trace-id 模块列表，按内容哈希失效。
+    # 汇报报告使用摘要而不是整篇发送；原型生成仍发送完整的需求文档，功能点与验收标准不能丢
+    ARTIFACT_DIGESTS: bool = True
+    DIGEST_MAX_CHARS: int = 4000  # 单篇摘要上限
+    DIGEST_SECTION_CHARS: int = 160  # 每个章节保留的首段字数
+    DIGEST_SECTION_ITEMS: int = 3  # 每个章节保留的列表项数
+    DIGEST_MAX_ENTITIES: int = 40
+
+    # 原型编辑会话（WebSocket）：连接时认证一次，服务端持有当前代码，每次修改只上传意见和选中的 data-trace-id
+    EDIT_SESSION_AUTH_TIMEOUT: float = 10.0  # 连接后发送认证消息的时限
+    EDIT_SESSION_IDLE_SECONDS: int = 1800  # 无任何消息超过该时间关闭会话
+    EDIT_SESSION_MAX_CODE_CHARS: int = 1000000
+
+    # 后台维护：清理已删除项目遗留的数据和文件、过期的上传会话与缓存，回收数据库空间。
+    # 多 worker 时每个周期只由一个 worker 执行；修改时间在 MAINTENANCE_GRACE_SECONDS 内的文件不会被删除
+    MAINTENANCE_ENABLED: bool = True
+    MAINTENANCE_INTERVAL_SECONDS: int = 6 * 3600
+    MAINTENANCE_INITIAL_DELAY_SECONDS: int = 300
+    MAINTENANCE_BATCH_SIZE: int = 500
+    MAINTENANCE_MAX_BATCHES: int = 20
+    MAINTENANCE_BATCH_PAUSE: float = 0.05
+    MAINTENANCE_GRACE_SECONDS: int = 3600
+    MAINTENANCE_VACUUM_PAGES: int = 10000
+    UPLOAD_SESSION_TTL_HOURS: int = 72
+    COMPRESSED_CACHE_MAX_AGE_DAYS: int = 30
+    DEMO_DATA_TTL_DAYS: int = 0  # Demo 业务数据多少天未写入后删除，0 表示永久保留
+
+    # 已发布 Demo 的静态快照：发布时生成（含内联数据与压缩副本），项目或数据变化后下次访问时重建
+    SNAPSHOT_DIR: str = "data/snapshots"
+    SNAPSHOT_MAX_AGE: int = 60
+    SNAPSHOT_KEEP_VERSIONS: int = 3
+    SNAPSHOT_INLINE_MAX_BYTES: int = 1024 * 1024
+    # 快照在访问时构建，brotli 使用较低的质量；过期快照先照常下发，后台重建。
+    # Demo 数据频繁写入时，同一快照在 DEBOUNCE 秒内最多失效一次（窗口结束时补一次）
+    SNAPSHOT_BROTLI_QUALITY: int = 5
+    SNAPSHOT_INVALIDATE_DEBOUNCE_SECONDS: float = 1.0
+
+    # Demo 数据接口（无需登录）的令牌桶限流，按项目、分享 Token 和客户端 IP 分别计数，状态只在进程内存中。
+    # 每秒补充 RATE 个令牌、最多累积 BURST 个；写入消耗 1 个，读取消耗 DEMO_READ_COST 个
+    DEMO_RATE_LIMIT_ENABLED: bool = True
+    DEMO_RATE_PER_PROJECT: float = 5.0
+    DEMO_BURST_PER_PROJECT: float = 30.0
+    DEMO_RATE_PER_SHARE: float = 5.0
+    DEMO_BURST_PER_SHARE: float = 30.0
+    DEMO_RATE_PER_IP: float = 10.0
+    DEMO_BURST_PER_IP: float = 60.0
+    DEMO_READ_COST: float = 0.2
+    # 每个项目的 Demo 数据配额
+    DEMO_DATA_MAX_VALUE_BYTES: int = 1024 * 1024
+    DEMO_DATA_MAX_BYTES_PER_PROJECT: int = 5 * 1024 * 1024
+    DEMO_DATA_MAX_KEYS_PER_PROJECT: int = 200
+    DEMO_QUOTA_CACHE_SECONDS: int = 30  # 项目用量缓存的有效期（多 worker 时各进程定期从数据库刷新）
+
+    # Demo 数据存储引擎：table 为主数据库的 demodata 表；sharded 把各项目的数据放到 DEMO_STORE_DIR 下独立的
+    # SQLite 文件中（DEMO_STORE_SHARDS 为 0 时每个项目一个文件，否则按项目 ID 取模分到固定数量的文件），
+    # 不同项目的写入不再争用主库的写锁。每个进程最多同时打开 DEMO_STORE_MAX_OPEN 个分片，
+    # 主库中的历史数据由后台维护分批迁入分片（迁移完成前读取时合并主库数据，写入前先迁移该项目）。
+    # 已删除项目的分片文件在超过 DEMO_STORE_REMOVE_IDLE_SECONDS 没有写入后才删除（其他 worker 可能仍打开着）
+    DEMO_STORE_BACKEND: str = "sharded"
+    DEMO_STORE_DIR: str = "data/demo_store"
+    DEMO_STORE_SHARDS: int = 0
+    DEMO_STORE_MAX_OPEN: int = 64
+    DEMO_STORE_REMOVE_IDLE_SECONDS: int = 3600
+
+    # 项目导出/导入（备份与迁移）：tar.gz 流式写出和读入，内存占用与项目数、文件大小无关。
+    # 导入时每 BUNDLE_BATCH_ROWS 行提交一次；上传的导入包先落盘到上传临时目录，
+    # 普通用户大小上限 BUNDLE_IMPORT_MAX_BYTES，管理员（整个租户迁移）上限 BUNDLE_IMPORT_ADMIN_MAX_BYTES。
+    # BUNDLE_LINE_MAX_BYTES 为 JSONL 成员的单行上限，需容纳一条最大的 Demo 数据转义后的长度
+    BUNDLE_COMPRESS_LEVEL: int = 6
+    BUNDLE_BATCH_ROWS: int = 1000
+    BUNDLE_IMPORT_MAX_BYTES: int = 1024 * 1024 * 1024
+    BUNDLE_IMPORT_ADMIN_MAX_BYTES: int = 20 * 1024 * 1024 * 1024
+    BUNDLE_LINE_MAX_BYTES: int = 8 * 1024 * 1024
+
+    # 请求级追踪（默认关闭）：按比例采样请求记录各阶段耗时，写入 OTLP JSON 格式的本地日志；
+    # 超过 TRACE_SLOW_MS 的请求附带采样分析器的调用栈统计（TRACE_PROFILE_INTERVAL_MS 为 0 时不采样调用栈）
+    TRACE_ENABLED: bool = False
+    TRACE_SAMPLE_RATE: float = 0.05
+    TRACE_SLOW_MS: float = 2000.0
+    TRACE_PROFILE_INTERVAL_MS: float = 10.0
+    TRACE_LOG_PATH: str = "logs/traces.jsonl"
+    TRACE_SQL_MAX_CHARS: int = 500
+
     # CORS
     BACKEND_CORS_ORIGINS: list[str] = ["*"]
 
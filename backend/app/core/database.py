@@ -1,12 +1,44 @@
+from sqlalchemy import event, inspect, text
 from sqlmodel import SQLModel, create_engine, Session
 
 sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-engine = create_engine(sqlite_url, connect_args={"check_same_thread": False})
+engine = create_engine(sqlite_url, connect_args={"check_same_thread": False, "timeout": 15})
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL：多个 worker 进程并发读写时读不阻塞写；写锁冲突时等待而不是立即报 database is locked
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=15000")
+    cursor.close()
+
+def migrate_db():
+    """为已有的表补齐新增的可空列和索引（create_all 不会修改已存在的表）"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                print(f"--- 数据库迁移：{table.name}.{column.name} ---")
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn, checkfirst=True)
+                    print(f"--- 数据库迁移：索引 {index.name} ---")
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    migrate_db()
 
 def get_session():
     with Session(engine) as session:
@@ -0,0 +1,59 @@
+import base64
+import json
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from app.core.shared_state import get_shared_state
+
+# 估算总数的缓存：列表页每次翻页都 count(*) 没有必要，数十秒的误差可以接受
+COUNT_CACHE_TTL = 30.0
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """游标 = 最后一行的 (排序值, id)，base64 编码后对客户端不透明"""
+    raw = json.dumps([sort_value.isoformat(), row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+def keyset_after(sort_column, id_column, cursor: Optional[str]):
+    """按 (sort_column DESC, id DESC) 排序时，位于游标之后的行"""
+    if not cursor:
+        return None
+    sort_value, row_id = decode_cursor(cursor)
+    return or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < row_id))
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str], required: Sequence[str] = ("id",)) -> Optional[List[str]]:
+    """解析字段投影参数 fields=a,b,c；未指定时返回 None 表示全部字段"""
+    if not fields:
+        return None
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"不支持的字段: {', '.join(unknown)}")
+    # 生成游标所需的字段始终返回
+    return list(dict.fromkeys(list(required) + selected))
+
+def estimated_count(key: str, count: Callable[[], int]) -> int:
+    state = get_shared_state()
+    cached = state.get(f"count:{key}")
+    if cached is not None:
+        return int(cached)
+    value = count()
+    state.set(f"count:{key}", str(value), ttl=COUNT_CACHE_TTL)
+    return value
+
+def invalidate_count(key: str):
+    get_shared_state().delete(f"count:{key}")
+
+def page_headers(next_cursor: Optional[str], total: int) -> Dict[str, str]:
+    headers = {"X-Total-Count": str(total)}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return headers
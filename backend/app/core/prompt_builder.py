@@ -0,0 +1,115 @@
+import hashlib
+import re
+from typing import Dict, List, Tuple
+from app.core import tracing
+from app.core.prompts import (
+    REQUIREMENTS_PROMPT, PRODUCT_DOC_PROMPT, TECHNICAL_DOC_PROMPT, DEMO_PROMPT,
+    REFINE_REQUIREMENTS_PROMPT, REFINE_PRODUCT_DOC_PROMPT, REFINE_TECHNICAL_DOC_PROMPT,
+    ITERATION_PROMPT, PARTIAL_EDIT_PROMPT, REPORT_PROMPT, REPORT_DIGEST_PROMPT, CHAT_SUMMARY_PROMPT
+)
+
+class PromptTemplate:
+    """
+    预编译的上下文模板：启动时拆分为“字面量 / 变量”片段，渲染时一次拼接，
+    不再对多 KB 的字符串做链式 replace（也避免了变量值中的 {xxx} 被二次替换）。
+    只识别声明过的变量，DEMO_PROMPT 中的 ${key} 之类的字面量不受影响。
+    """
+
+    def __init__(self, template: str, variables: Tuple[str, ...]):
+        self.variables = variables
+        pattern = re.compile("{(" + "|".join(re.escape(v) for v in variables) + ")}")
+        self.parts: List[Tuple[bool, str]] = []
+        pos = 0
+        for match in pattern.finditer(template):
+            self.parts.append((False, template[pos:match.start()]))
+            self.parts.append((True, match.group(1)))
+            pos = match.end()
+        self.parts.append((False, template[pos:]))
+        missing = set(variables) - {name for is_var, name in self.parts if is_var}
+        if missing:
+            raise ValueError(f"Template does not use variables: {sorted(missing)}")
+
+    def render(self, values: Dict[str, str]) -> str:
+        return "".join(values.get(text) or "" if is_var else text for is_var, text in self.parts)
+
+class StagePrompt:
+    """
+    某一阶段的消息布局：静态指令固定为第一条 system 消息（所有请求完全相同的前缀），
+    变量内容统一放在其后的 user 消息中，按“越稳定越靠前”排列。
+    """
+
+    def __init__(self, name: str, instructions: str, context: str, variables: Tuple[str, ...]):
+        self.name = name
+        self.instructions = instructions.strip()
+        self.prefix_id = hashlib.sha1(self.instructions.encode("utf-8")).hexdigest()[:12]
+        self.context = PromptTemplate(context, variables)
+
+    def build(self, **values: str) -> Tuple[List[Dict[str, str]], dict]:
+        """返回 (messages, stats)，stats 记录各片段的字符数"""
+        content = self.context.render(values)
+        segments = {"instructions": len(self.instructions)}
+        for name in self.context.variables:
+            segments[name] = len(values.get(name) or "")
+        segments["template"] = len(content) - sum(segments[v] for v in self.context.variables)
+        stats = {
+            "prompt": self.name,
+            "prefix_id": self.prefix_id,
+            "segments": segments,
+            "total_chars": len(self.instructions) + len(content),
+        }
+        messages = [
+            {"role": "system", "content": self.instructions},
+            {"role": "user", "content": content}
+        ]
+        return messages, stats
+
+# 对话背景（摘要 + 最近几条）比当前文档更稳定，放在前面
+_REFINE_CONTEXT = "{conversation}当前文档：\n{current_content}\n\n用户反馈：\n{feedback}"
+
+# 启动时一次性编译
+PROMPTS: Dict[str, StagePrompt] = {
+    prompt.name: prompt for prompt in (
+        StagePrompt("requirements", REQUIREMENTS_PROMPT, "{references}{raw_requirement}", ("references", "raw_requirement")),
+        StagePrompt("product", PRODUCT_DOC_PROMPT, "基于以下需求文档生成PRD：\n\n{requirements_doc}", ("requirements_doc",)),
+        StagePrompt("technical", TECHNICAL_DOC_PROMPT, "基于以下PRD生成技术方案：\n\n{product_doc}", ("product_doc",)),
+        StagePrompt("demo", DEMO_PROMPT, "请结合以下全套设计文档，生成最终的高保真原型代码：\n\n{full_context}", ("full_context",)),
+        StagePrompt("refine_requirements", REFINE_REQUIREMENTS_PROMPT, _REFINE_CONTEXT, ("conversation", "current_content", "feedback")),
+        StagePrompt("refine_product", REFINE_PRODUCT_DOC_PROMPT, _REFINE_CONTEXT, ("conversation", "current_content", "feedback")),
+        StagePrompt("refine_technical", REFINE_TECHNICAL_DOC_PROMPT, _REFINE_CONTEXT, ("conversation", "current_content", "feedback")),
+        StagePrompt(
+            "iterate", ITERATION_PROMPT,
+            "{conversation}当前代码：\n```html\n{current_code}\n```\n\n修改意见：{user_feedback}",
+            ("conversation", "current_code", "user_feedback")
+        ),
+        # 当前代码在一次编辑会话中变化最小，放在选中元素和反馈之前
+        StagePrompt(
+            "partial_edit", PARTIAL_EDIT_PROMPT,
+            "【当前完整代码】：\n```html\n{current_code}\n```\n\n【选中的目标元素】：\n{selected_elements_info}\n\n【用户的改进意见】：\n{user_feedback}",
+            ("current_code", "selected_elements_info", "user_feedback")
+        ),
+        StagePrompt(
+            "report", REPORT_PROMPT,
+            "- **需求文档**：{requirements_doc}\n- **产品PRD**：{product_doc}\n- **技术架构**：{tech_doc}\n- **原型预览内容概要**：{demo_code}{feedback}",
+            ("requirements_doc", "product_doc", "tech_doc", "demo_code", "feedback")
+        ),
+        # ARTIFACT_DIGESTS 开启时各文档以结构摘要发送
+        StagePrompt(
+            "report_digest", REPORT_DIGEST_PROMPT,
+            "【需求文档】：\n{requirements_doc}\n\n【产品PRD】：\n{product_doc}\n\n【技术架构】：\n{tech_doc}\n\n【原型概要】：\n{demo_code}{feedback}",
+            ("requirements_doc", "product_doc", "tech_doc", "demo_code", "feedback")
+        ),
+        StagePrompt(
+            "chat_summary", CHAT_SUMMARY_PROMPT,
+            "【已有摘要】：\n{previous_summary}\n\n【新增对话】：\n{transcript}",
+            ("previous_summary", "transcript")
+        ),
+    )
+}
+
+def build_prompt(name: str, **values: str) -> Tuple[List[Dict[str, str]], dict]:
+    with tracing.span("prompt.build", **{"prompt.name": name}) as current:
+        messages, stats = PROMPTS[name].build(**values)
+        if current is not None:
+            current.set("prompt.chars", stats.get("total_chars"))
+    print(f"DEBUG: Prompt {name} [{stats['prefix_id']}] segments: {stats['segments']}")
+    return messages, stats
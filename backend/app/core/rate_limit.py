@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+from fastapi import HTTPException
+from app.core.shared_state import get_shared_state
+
+class SlidingWindowLimiter:
+    """
+    滑动窗口计数：window 秒内同一个 key 最多 limit 次。
+    计数保存在共享状态中（多 worker 时各进程共用同一份计数），
+    采用“当前窗口 + 上一窗口按剩余比例折算”的近似算法，每个 key 只需两个计数器。
+    """
+
+    def __init__(self, name: str, limit: int, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def _key(self, key: str, bucket: int) -> str:
+        return f"ratelimit:{self.name}:{key}:{bucket}"
+
+    def _estimate(self, key: str, now: float) -> float:
+        state = get_shared_state()
+        bucket = int(now // self.window)
+        current = int(state.get(self._key(key, bucket)) or 0)
+        previous = int(state.get(self._key(key, bucket - 1)) or 0)
+        elapsed = (now % self.window) / self.window
+        return previous * (1 - elapsed) + current
+
+    def retry_after(self, key: str) -> Optional[int]:
+        """已超限时返回需等待的秒数，否则返回 None（不计数）"""
+        now = time.time()
+        if self._estimate(key, now) < self.limit:
+            return None
+        return max(1, int(self.window - now % self.window) + 1)
+
+    def hit(self, key: str):
+        bucket = int(time.time() // self.window)
+        get_shared_state().incr(self._key(key, bucket), ttl=self.window * 2)
+
+    def reset(self, key: str):
+        bucket = int(time.time() // self.window)
+        state = get_shared_state()
+        state.delete(self._key(key, bucket))
+        state.delete(self._key(key, bucket - 1))
+
+class TokenBucketLimiter:
+    """
+    令牌桶：每个 key 容量 burst，每秒补充 rate 个令牌，允许短时突发但限制长期速率。
+    状态只保存在本进程内存中（检查耗时为微秒级，不访问共享状态），多 worker 时每个进程各自限流；
+    桶数量超过 max_keys 时淘汰最久未访问的（被淘汰的桶相当于已补满）。
+    同步接口在线程池中并发调用，桶的读写由锁保护。
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, max_keys: int = 100000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _bucket(self, key: str, now: float) -> List[float]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now, 0.0]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def retry_after(self, key: str, cost: float = 1.0) -> Optional[float]:
+        """令牌不足时返回需等待的秒数，否则返回 None（不扣减）"""
+        with self._lock:
+            bucket = self._bucket(key, time.monotonic())
+            if bucket[0] >= cost:
+                bucket[2] = 0.0
+                return None
+            self.rejected += 1
+            first = not bucket[2]
+            bucket[2] = 1.0
+            wait = (cost - bucket[0]) / self.rate
+        if first:
+            # 只在开始超限时记录一次，持续超限的客户端不会刷屏
+            print(f"DEBUG: Rate limited {self.name}:{key}")
+        return wait
+
+    def hit(self, key: str, cost: float = 1.0):
+        with self._lock:
+            bucket = self._bucket(key, time.monotonic())
+            bucket[0] -= cost
+
+# 多个桶的“全部检查、再一起扣减”需要整体原子，否则并发请求可能都通过检查
+_check_lock = threading.Lock()
+
+def check_buckets(checks: List[tuple], cost: float = 1.0):
+    """
+    同时检查多个 (limiter, key)：任何一个不足都返回 429 且不扣减任何桶，
+    全部通过时才一起扣减，避免被拒绝的请求消耗其他桶的额度。
+    """
+    with _check_lock:
+        waits = [limiter.retry_after(key, cost) for limiter, key in checks]
+        waits = [w for w in waits if w is not None]
+        if not waits:
+            for limiter, key in checks:
+                limiter.hit(key, cost)
+            return
+    raise too_many_requests(max(1, int(max(waits) + 0.999)))
+
+def too_many_requests(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"请求过于频繁，请 {retry_after} 秒后重试",
+        headers={"Retry-After": str(retry_after)}
+    )
@@ -0,0 +1,44 @@
+import json
+from typing import Any
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # 未安装时回退到标准库，接口行为一致，只是慢一些
+    orjson = None
+
+def dumps(value: Any) -> bytes:
+    """序列化为 UTF-8 JSON（中文不转义，比 \\uXXXX 小一半）"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONResponse(JSONResponse):
+    """全局默认响应类：用 orjson 编码（FastAPI 已先做过 jsonable_encoder 转换）"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class RawJSONResponse(Response):
+    """内容本身就是 JSON 文本（如数据库中存储的 Demo 数据），原样发送，不再解析和重新编码"""
+    media_type = "application/json"
+
+    def __init__(self, content, status_code: int = 200, headers=None):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        super().__init__(content=content, status_code=status_code, headers=headers)
+
+async def raw_json_body(request: Request) -> str:
+    """依赖项：读取请求体并校验为合法 JSON，返回原始文本，供直接存储"""
+    body = await request.body()
+    try:
+        loads(body)
+        return body.decode("utf-8")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="请求体不是合法的 JSON")
@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from app.core.config import settings
+
+class SharedState:
+    """
+    跨进程共享的键值状态（限流计数、缓存、生成任务快照等）。
+    memory：仅当前进程可见，单进程部署使用；
+    sqlite：本机文件，多 worker 部署无需额外服务；
+    redis：多机部署，需要安装 redis 包。
+    """
+
+    # 是否真正跨进程共享；为 False 时调用方可以跳过同步
+    shared = True
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """原子自增并返回新值；ttl 只在 key 新建（或已过期）时设置"""
+        raise NotImplementedError
+
+class MemoryState(SharedState):
+    shared = False
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+    def _live(self, key: str, now: float) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item[0]
+
+    def _purge(self, now: float):
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        for key in [k for k, (_, expires) in self._data.items() if expires is not None and expires <= now]:
+            del self._data[key]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key, time.monotonic())
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            self._data[key] = (value, now + ttl if ttl else None)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            current = self._live(key, now)
+            if current is None:
+                value = amount
+                expires = now + ttl if ttl else None
+            else:
+                value = int(current) + amount
+                expires = self._data[key][1]
+            self._data[key] = (str(value), expires)
+            return value
+
+class SQLiteState(SharedState):
+    """单机多进程共享：独立的 SQLite 文件（WAL 模式），每个线程一个连接"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _purge(self, conn: sqlite3.Connection, now: float):
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        now = time.time()
+        conn = self._connect()
+        self._purge(conn, now)
+        conn.execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, value, now + ttl if ttl else None)
+        )
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+            ).fetchone()
+            if row is None:
+                value = amount
+                conn.execute(
+                    "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, str(value), now + ttl if ttl else None)
+                )
+            else:
+                value = int(row[0]) + amount
+                conn.execute("UPDATE kv SET value = ? WHERE key = ?", (str(value), key))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+class RedisState(SharedState):
+    """多机部署：需要 pip install redis，并配置 REDIS_URL"""
+
+    def __init__(self, url: str):
+        import redis  # 可选依赖，仅在启用 redis 后端时导入
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        value = int(self.client.incrby(key, amount))
+        if ttl and value == amount:
+            # 新建的 key 才设置过期时间
+            self.client.pexpire(key, int(ttl * 1000))
+        return value
+
+_state: Optional[SharedState] = None
+_state_lock = threading.Lock()
+
+def get_shared_state() -> SharedState:
+    """按 SHARED_STATE_BACKEND 创建（每个进程一次），首次使用时才初始化"""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                backend = settings.SHARED_STATE_BACKEND
+                if backend == "sqlite":
+                    _state = SQLiteState(settings.SHARED_STATE_PATH)
+                elif backend == "redis":
+                    _state = RedisState(settings.REDIS_URL)
+                elif backend == "memory":
+                    _state = MemoryState()
+                else:
+                    raise ValueError(f"Unknown SHARED_STATE_BACKEND: {backend}")
+                print(f"DEBUG: Shared state backend: {backend}")
+    return _state
@@ -0,0 +1,58 @@
+import os
+from contextlib import contextmanager
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.core.database import create_db_and_tables, engine
+from app.models.models import User
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发：单进程运行，不需要文件锁
+    fcntl = None
+
+LOCK_PATH = "startup.lock"
+
+@contextmanager
+def _startup_lock():
+    """多个 worker 同时启动时，建表/迁移/初始化管理员串行执行"""
+    if fcntl is None:
+        yield
+        return
+    with open(LOCK_PATH, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def ensure_admin():
+    from app.core.auth import get_password_hash
+    with Session(engine) as session:
+        if session.exec(select(User).where(User.username == "admin")).first():
+            return
+        session.add(User(
+            username="admin",
+            hashed_password=get_password_hash("admin123"),
+            is_admin=True
+        ))
+        try:
+            session.commit()
+        except IntegrityError:
+            # 另一个进程已经创建
+            session.rollback()
+            return
+        print("--- 初始化管理员账号成功: admin / admin123 ---")
+
+def initialize():
+    """
+    启动初始化：建表、迁移（含旧版对话记录）、检索索引、管理员账号。可重复执行（已完成的步骤是空操作），
+    gunicorn 模式下由主进程在 fork worker 之前执行一次，各 worker 的 lifespan 中再执行时无需改动。
+    """
+    from app.services.chat_history import migrate_legacy_history
+    from app.services.project_search import ensure_search_index
+    with _startup_lock():
+        create_db_and_tables()
+        migrate_legacy_history()
+        ensure_search_index()
+        ensure_admin()
+    print(f"DEBUG: Startup initialized in process {os.getpid()}")
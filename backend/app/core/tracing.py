@@ -0,0 +1,409 @@
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from app.core.config import settings
+
+# 当前请求的追踪与当前 span；未采样的请求两者都是 None，埋点处只需一次 ContextVar 读取
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+# OTLP 约定的枚举值
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+# 采样分析时忽略的空闲栈：事件循环等待 IO、线程池等待任务
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py", "thread.py")
+PROFILE_MAX_DEPTH = 48
+PROFILE_TOP_STACKS = 30
+
+class Span:
+    __slots__ = ("name", "kind", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "events", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None):
+        self.name = name
+        self.kind = kind
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.events: List[Tuple[str, int, Dict[str, Any]]] = []
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.events.append((name, time.time_ns(), attributes or {}))
+
+    def fail(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+class Trace:
+    """一次被采样请求的全部 span；请求结束后关闭，之后（如后台预测任务）产生的 span 被丢弃"""
+
+    def __init__(self, trace_id: Optional[str] = None, parent_span_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.parent_span_id = parent_span_id
+        self.spans: List[Span] = []
+        self.closed = False
+
+    def add(self, span: Span):
+        if not self.closed:
+            self.spans.append(span)
+
+def _parent_id() -> Optional[str]:
+    current = _current_span.get()
+    return current.span_id if current else None
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """同步代码段的 span，期间新建的 span 以它为父节点；请求未被采样时返回 None"""
+    trace = _current_trace.get()
+    if trace is None or trace.closed:
+        yield None
+        return
+    current = Span(name, _parent_id(), attributes=attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        trace.add(current)
+
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Optional[Span]:
+    """
+    手动结束的 span（配合 end_span），用于跨越多次 await 的异步生成器：
+    生成器每一步可能在不同的 Task/Context 中执行，不能用 ContextVar 的 set/reset
+    """
+    trace = _current_trace.get()
+    if trace is None or trace.closed:
+        return None
+    return Span(name, _parent_id(), kind=kind, attributes=attributes)
+
+def end_span(current: Optional[Span], error: Optional[BaseException] = None, **attributes):
+    if current is None or current.end_ns is not None:
+        return
+    trace = _current_trace.get()
+    current.attributes.update(attributes)
+    if error is not None:
+        current.fail(error)
+    current.end_ns = time.time_ns()
+    if trace is not None:
+        trace.add(current)
+
+def record_span(name: str, start_ns: int, kind: int = SPAN_KIND_INTERNAL, **attributes):
+    """补记一个已经结束的 span（如 SQL 语句）"""
+    trace = _current_trace.get()
+    if trace is None or trace.closed:
+        return
+    current = Span(name, _parent_id(), kind=kind, attributes=attributes, start_ns=start_ns)
+    current.end_ns = time.time_ns()
+    trace.add(current)
+
+def annotate(key: str, value: Any):
+    """给当前 span（通常是请求的根 span）附加属性"""
+    current = _current_span.get()
+    if current is not None and _current_trace.get() is not None:
+        current.set(key, value)
+
+class SamplingProfiler:
+    """
+    采样分析器：有被采样的请求在处理时，后台线程定期抓取所有线程的调用栈。
+    请求结束时若超过慢请求阈值，取其时间窗口内的样本汇总为折叠栈（flamegraph 格式）。
+    样本是进程级的，并发请求较多时会混入其他请求的栈，结果按比例理解即可。
+    采样时只保存 (代码对象, 行号)，格式化推迟到慢请求汇总时，空闲时线程挂起不占 CPU。
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._samples: deque = deque(maxlen=50000)
+
+    def enter(self):
+        with self._lock:
+            self._active += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-profiler", daemon=True)
+                self._thread.start()
+            self._wake.set()
+
+    def exit(self):
+        with self._lock:
+            self._active -= 1
+            if self._active <= 0:
+                self._wake.clear()
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            self._wake.wait()
+            now = time.time_ns()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    stack.append((frame.f_code, frame.f_lineno))
+                    frame = frame.f_back
+                self._samples.append((now, tuple(stack)))
+            time.sleep(self.interval)
+
+    def collect(self, start_ns: int, end_ns: int) -> Counter:
+        counts: Counter = Counter()
+        for sampled_at, stack in list(self._samples):
+            if start_ns <= sampled_at <= end_ns:
+                counts[stack] += 1
+        folded: Counter = Counter()
+        for stack, count in counts.items():
+            folded[_fold(stack)] += count
+        return folded
+
+def _fold(stack) -> str:
+    return ";".join(
+        f"{os.path.basename(code.co_filename)}:{code.co_name}:{lineno}" for code, lineno in reversed(stack)
+    )
+
+class TraceExporter:
+    """后台线程把追踪写入 JSON Lines 文件，每行一个 OTLP/JSON ExportTraceServiceRequest；队列满时丢弃"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dropped = 0
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=1000)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, record: dict):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        while True:
+            record = self._queue.get()
+            lines = [record]
+            # 批量写入，减少 IO 次数
+            while len(lines) < 100:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with open(self.path, "a", encoding="utf-8") as f:
+                for line in lines:
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[dict]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+def to_otlp(trace: Trace) -> dict:
+    spans = []
+    for item in trace.spans:
+        spans.append({
+            "traceId": trace.trace_id,
+            "spanId": item.span_id,
+            "parentSpanId": item.parent_id or "",
+            "name": item.name,
+            "kind": item.kind,
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns or item.start_ns),
+            "attributes": _otlp_attributes(item.attributes),
+            "events": [
+                {"name": name, "timeUnixNano": str(at), "attributes": _otlp_attributes(attrs)}
+                for name, at, attrs in item.events
+            ],
+            "status": {"code": STATUS_ERROR, "message": item.error} if item.error else {"code": STATUS_UNSET},
+        })
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({
+            "service.name": settings.PROJECT_NAME,
+            "process.pid": os.getpid(),
+        })},
+        "scopeSpans": [{"scope": {"name": "app.core.tracing"}, "spans": spans}],
+    }]}
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """W3C traceparent: 00-<trace_id>-<parent_id>-<flags>，返回 (trace_id, parent_id, sampled)"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+_sql_hooks_installed = False
+
+def install_sql_hooks(engine):
+    """每条 SQL 记录为一个 span（只在有采样中的请求时计时）"""
+    global _sql_hooks_installed
+    if _sql_hooks_installed:
+        return
+    _sql_hooks_installed = True
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and _current_trace.get() is not None:
+            context._trace_start_ns = time.time_ns()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start_ns = getattr(context, "_trace_start_ns", None)
+        if start_ns is None:
+            return
+        record_span(
+            "db.query", start_ns, kind=SPAN_KIND_CLIENT,
+            **{
+                "db.system": engine.dialect.name,
+                "db.operation": statement.lstrip().split(None, 1)[0].upper() if statement.strip() else None,
+                "db.statement": statement[:settings.TRACE_SQL_MAX_CHARS],
+                "db.executemany": executemany,
+                "db.rows": cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None,
+            }
+        )
+
+def _route_template(scope) -> Optional[str]:
+    """
+    路由模板（如 /api/v1/generation/projects/{project_id}），用于按接口聚合。
+    较新的 FastAPI 中 include_router 的 route.path 不含前缀，按实际路径的段数补齐
+    """
+    route_path = getattr(scope.get("route"), "path", None)
+    if not route_path:
+        return None
+    if ":path}" in route_path:
+        return route_path
+    path_parts = scope["path"].split("/")
+    route_parts = route_path.split("/")
+    if len(route_parts) > len(path_parts):
+        return route_path
+    return "/".join(path_parts[:len(path_parts) - len(route_parts) + 1]) + route_path
+
+class TracingMiddleware:
+    """
+    请求级追踪（纯 ASGI 中间件，不包装请求体，不影响流式响应和断开检测）。
+    按 TRACE_SAMPLE_RATE 采样，或上游 traceparent 已标记采样时跟随；
+    根 span 覆盖到响应体发送完毕（包括整个流式生成），慢请求附带调用栈采样。
+    """
+
+    def __init__(self, app):
+        from app.core.database import engine
+        self.app = app
+        self.profiler = SamplingProfiler(settings.TRACE_PROFILE_INTERVAL_MS / 1000) if settings.TRACE_PROFILE_INTERVAL_MS > 0 else None
+        self.exporter = TraceExporter(settings.TRACE_LOG_PATH)
+        install_sql_hooks(engine)
+        print(f"DEBUG: Request tracing enabled, sample rate {settings.TRACE_SAMPLE_RATE}, log {settings.TRACE_LOG_PATH}")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        parent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                parent = parse_traceparent(value.decode("latin-1"))
+                break
+        sampled = parent[2] if parent else random.random() < settings.TRACE_SAMPLE_RATE
+        if not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(*(parent[:2] if parent else ()))
+        root = Span(f"{scope['method']} {scope['path']}", trace.parent_span_id, kind=SPAN_KIND_SERVER, attributes={
+            "http.request.method": scope["method"],
+            "url.path": scope["path"],
+            "url.query": scope.get("query_string", b"").decode("latin-1") or None,
+        })
+        status_code = 500
+
+        async def send_with_trace_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        if self.profiler:
+            self.profiler.enter()
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            root.fail(e)
+            raise
+        finally:
+            if self.profiler:
+                self.profiler.exit()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._finish(trace, root, scope, status_code)
+
+    def _finish(self, trace: Trace, root: Span, scope, status_code: int):
+        root.end_ns = time.time_ns()
+        template = _route_template(scope)
+        if template:
+            root.name = f"{scope['method']} {template}"
+            root.set("http.route", template)
+        root.set("http.response.status_code", status_code)
+        if status_code >= 500 and not root.error:
+            root.error = f"HTTP {status_code}"
+        slow = root.duration_ms >= settings.TRACE_SLOW_MS
+        root.set("trace.slow", slow)
+        if slow and self.profiler:
+            counts = self.profiler.collect(root.start_ns, root.end_ns)
+            if counts:
+                root.add_event("profile", {
+                    "profile.format": "folded",
+                    "profile.scope": "process",
+                    "profile.interval_ms": settings.TRACE_PROFILE_INTERVAL_MS,
+                    "profile.samples": sum(counts.values()),
+                    "profile.folded": "\n".join(f"{stack} {count}" for stack, count in counts.most_common(PROFILE_TOP_STACKS)),
+                })
+        trace.add(root)
+        trace.closed = True
+        self.exporter.submit(to_otlp(trace))
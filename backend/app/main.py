@@ -1,38 +1,37 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from app.core.config import settings
-from app.api.v1.endpoints import generation, files, auth, admin, demo_storage
-from app.core.database import create_db_and_tables, engine
-from sqlmodel import Session, select
-from app.models.models import User
-from app.core.auth import get_password_hash
+from app.services.file_serving import CachedStaticFiles
+from app.api.v1.endpoints import generation, files, auth, admin, demo_storage, editing, bundles
+from app.core.startup import initialize
+from app.core.tracing import TracingMiddleware
+from app.core.compression import CompressionMiddleware
+from app.core.responses import FastJSONResponse
+from app.services import maintenance
 from contextlib import asynccontextmanager
 import os
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动时：创建表和初始化管理员
-    create_db_and_tables()
-    with Session(engine) as session:
-        admin_user = session.exec(select(User).where(User.username == "admin")).first()
-        if not admin_user:
-            admin = User(
-                username="admin",
-                hashed_password=get_password_hash("admin123"),
-                is_admin=True
-            )
-            session.add(admin)
-            session.commit()
-            print("--- 初始化管理员账号成功: admin / admin123 ---")
+    # 启动时：创建表和初始化管理员（可重复执行，多 worker 时串行）
+    initialize()
+    # 定时清理孤儿数据、未引用文件并回收数据库空间
+    maintenance_task = maintenance.start_worker()
     yield
+    if maintenance_task:
+        maintenance_task.cancel()
 
 app = FastAPI(
     title="AI 军工管理系统",
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
+# 响应压缩（gzip / brotli），位于 CORS 内侧
+if settings.API_COMPRESSION:
+    app.add_middleware(CompressionMiddleware)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -40,20 +39,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Generation-Id", "X-Next-Cursor", "X-Total-Count", "X-Trace-Id"],
 )
 
+# 请求级追踪（TRACE_ENABLED 开启，按 TRACE_SAMPLE_RATE 采样），放在最外层以覆盖完整请求
+if settings.TRACE_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
 # 注册路由
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
 app.include_router(generation.router, prefix="/api/v1/generation", tags=["Generation"])
 app.include_router(files.router, prefix="/api/v1/files", tags=["Files"])
 app.include_router(admin.router, prefix="/api/v1/admin", tags=["Admin"])
 app.include_router(demo_storage.router, prefix="/api/v1/demo", tags=["Demo Storage"])
+app.include_router(editing.router, prefix="/api/v1/editing", tags=["Editing"])
+app.include_router(bundles.router, prefix="/api/v1/bundles", tags=["Bundles"])
 
 # 挂载前端静态文件（生产环境下使用）
 # 假设前端 build 后的文件放在 backend/static 目录下
 static_path = os.path.join(os.path.dirname(__file__), "..", "static")
 if os.path.exists(static_path):
-    app.mount("/", StaticFiles(directory=static_path, html=True), name="static")
+    app.mount("/", CachedStaticFiles(directory=static_path, html=True), name="static")
 
 @app.get("/api/health")
 def health_check():
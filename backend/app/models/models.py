@@ -1,4 +1,5 @@
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 from datetime import datetime
 
@@ -11,6 +12,9 @@ class User(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.now)
 
 class License(SQLModel, table=True):
+    # 管理后台按创建时间做游标分页
+    __table_args__ = (Index("ix_license_created_at_id", "created_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     license_key: str = Field(unique=True, index=True) # 授权码
     user_id: int = Field(foreign_key="user.id") # 绑定用户
@@ -21,6 +25,9 @@ class License(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.now)
 
 class Project(SQLModel, table=True):
+    # 项目列表按 (user_id, updated_at DESC, id DESC) 做游标分页
+    __table_args__ = (Index("ix_project_user_id_updated_at", "user_id", "updated_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
     description: Optional[str] = None
@@ -33,7 +40,7 @@ class Project(SQLModel, table=True):
     tech_doc: Optional[str] = None
     demo_code: Optional[str] = None
     report_content: Optional[str] = None
-    chat_history: Optional[str] = Field(default="[]") # 存储对话历史 JSON 字符串
+    chat_history: Optional[str] = Field(default="[]") # 旧版对话历史 JSON，启动时迁移到 ChatMessage
     share_token: Optional[str] = Field(default=None, index=True) # 发布分享用的 Token
     
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -46,6 +53,24 @@ class DemoData(SQLModel, table=True):
     data_content: str = Field(default="[]") # JSON 字符串存储
     updated_at: datetime = Field(default_factory=datetime.now)
 
+class ChatMessage(SQLModel, table=True):
+    """项目对话记录：每条消息一行，只追加不改写"""
+    __table_args__ = (Index("ix_chatmessage_project_id_id", "project_id", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    project_id: int = Field(foreign_key="project.id")
+    role: str # user / assistant
+    content: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ChatSummary(SQLModel, table=True):
+    """较早对话的滚动摘要，作为修改类提示词的精简上下文"""
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    content: str = Field(default="")
+    covered_until: int = Field(default=0) # 已并入摘要的最后一条消息 id
+    message_count: int = Field(default=0) # 已并入摘要的消息数
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 class FileUpload(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     filename: str
@@ -53,8 +78,59 @@ class FileUpload(SQLModel, table=True):
     file_type: str
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
     project_id: Optional[int] = Field(default=None, foreign_key="project.id")
+    content_hash: Optional[str] = Field(default=None, index=True) # 内容 SHA-256，相同内容只存一份
+    size: Optional[int] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class UploadSession(SQLModel, table=True):
+    """分片上传会话：支持断点续传"""
+    id: str = Field(primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    filename: str
+    content_type: str
+    project_id: Optional[int] = Field(default=None, foreign_key="project.id")
+    total_size: int
+    received: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class KnowledgeChunk(SQLModel, table=True):
+    """参考资料切片：由项目附件抽取文本后切分得到"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    file_id: int = Field(foreign_key="fileupload.id", index=True)
+    project_id: int = Field(foreign_key="project.id", index=True)
+    content_hash: Optional[str] = Field(default=None, index=True) # 来源文件的内容哈希，用于检索去重
+    ordinal: int # 在来源文件中的序号
+    content: str
+    length: int # 词元数，BM25 文档长度
+
+class KnowledgePosting(SQLModel, table=True):
+    """倒排索引：词元 -> 切片及词频"""
+    term: str = Field(primary_key=True)
+    chunk_id: int = Field(foreign_key="knowledgechunk.id", primary_key=True, index=True)
+    tf: int
+
+class SimilaritySignature(SQLModel, table=True):
+    """近似重复检测：项目各阶段输入文档的 MinHash 签名"""
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    field: str = Field(primary_key=True) # raw_requirement / requirements_doc / product_doc / tech_doc
+    user_id: Optional[int] = Field(default=None, index=True)
+    signature: str # 逗号分隔的十六进制 MinHash 值
+
+class SimilarityBand(SQLModel, table=True):
+    """LSH 分桶：签名在任一 band 上相同即为候选"""
+    band_key: str = Field(primary_key=True) # 字段:band 序号:该段签名的哈希
+    project_id: int = Field(foreign_key="project.id", primary_key=True, index=True)
+
+class ArtifactDigest(SQLModel, table=True):
+    """项目文档的结构摘要：随文档写入生成，content_hash 与当前文档不一致时视为失效"""
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    field: str = Field(primary_key=True) # requirements_doc / product_doc / tech_doc / demo_code
+    content_hash: str
+    digest: str
+    source_chars: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 class ProjectCreate(SQLModel):
     name: str
     description: Optional[str] = None
@@ -64,7 +140,6 @@ class ProjectCreate(SQLModel):
     tech_doc: Optional[str] = None
     demo_code: Optional[str] = None
     report_content: Optional[str] = None
-    chat_history: Optional[str] = None
 
 class ProjectUpdate(SQLModel):
     name: Optional[str] = None
@@ -74,7 +149,19 @@ class ProjectUpdate(SQLModel):
     tech_doc: Optional[str] = None
     demo_code: Optional[str] = None
     report_content: Optional[str] = None
-    chat_history: Optional[str] = None
 
-class ProjectRead(Project):
-    pass
+class ProjectRead(SQLModel):
+    """项目返回结构：对话记录通过 /messages 接口分页读取，不随项目返回"""
+    id: int
+    name: str
+    description: Optional[str] = None
+    user_id: Optional[int] = None
+    raw_requirement: Optional[str] = None
+    requirements_doc: Optional[str] = None
+    product_doc: Optional[str] = None
+    tech_doc: Optional[str] = None
+    demo_code: Optional[str] = None
+    report_content: Optional[str] = None
+    share_token: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
@@ -5,6 +5,12 @@ class BaseRequest(BaseModel):
     model: Optional[str] = None
     # If provided, this is a refinement request based on existing content
     current_content: Optional[str] = None 
+    # 设为 False 可关闭本次请求的下一阶段预测生成
+    speculate: Optional[bool] = None
+    # 提供后从该项目的附件中检索相关参考资料注入提示词
+    project_id: Optional[int] = None
+    # 输入与历史项目近似重复时基于其产物修改；None 表示使用服务端默认（NEAR_DUP_ENABLED）
+    warm_start: Optional[bool] = None
 
 class RequirementRequest(BaseRequest):
     raw_requirement: str # User input or feedback
@@ -34,6 +40,8 @@ class IterateRequest(BaseModel):
     current_code: str
     user_feedback: str
     model: Optional[str] = None
+    # 提供后附带该项目的对话摘要作为背景
+    project_id: Optional[int] = None
 
 class SelectedElement(BaseModel):
     selector: str
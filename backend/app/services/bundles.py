@@ -0,0 +1,466 @@
+import hashlib
+import json
+import os
+import re
+import tarfile
+import time
+import uuid
+import zlib
+from datetime import datetime
+from itertools import groupby
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, tuple_
+from sqlmodel import Session, select
+from app.core.config import settings
+from app.core.database import engine
+from app.models.models import ChatMessage, ChatSummary, FileUpload, Project
+from app.services import chat_history
+from app.services.demo_store import get_store
+from app.services.file_storage import _commit_blob, _hash_file, _remove_quietly, blob_path, tmp_dir
+
+# 导出包：tar.gz，成员按以下顺序排列，导入时顺序读取一遍即可，不需要随机访问
+#   bundle.json                         格式与版本
+#   projects/<id>/project.json          项目字段与各阶段文档
+#   projects/<id>/messages-0000.jsonl   对话记录（每 BUNDLE_BATCH_ROWS 条一个成员）
+#   projects/<id>/summary.json          对话滚动摘要
+#   projects/<id>/demo_data.jsonl       Demo 业务数据
+#   blobs/<sha256>                      附件内容（同一个包内相同内容只写一次）
+#   projects/<id>/files.jsonl           附件记录（引用前面的 blobs）
+#   stats.json                          导出统计，位于末尾，缺失说明包不完整
+BUNDLE_FORMAT = "demo-generator-bundle"
+BUNDLE_VERSION = 1
+PROJECT_FIELDS = (
+    "name", "description", "raw_requirement", "requirements_doc", "product_doc", "tech_doc",
+    "demo_code", "report_content", "created_at", "updated_at",
+)
+PROJECT_MEMBER = re.compile(r"^projects/(\d+)/(project|messages|summary|demo_data|files)(?:-\d+)?\.jsonl?$")
+BLOB_MEMBER = re.compile(r"^blobs/([0-9a-f]{64})$")
+BLOCK = 512
+PROJECT_PAGE = 20
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, default=_default).encode("utf-8")
+
+def _parse_time(value: Optional[str]) -> datetime:
+    try:
+        return datetime.fromisoformat(value) if value else datetime.utcnow()
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
+class _TarGzWriter:
+    """逐个成员写出 tar 并增量 gzip 压缩：任何时刻只持有一个成员（文件则是一个数据块）"""
+
+    def __init__(self):
+        self._deflate = zlib.compressobj(settings.BUNDLE_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        self._mtime = int(time.time())
+
+    def _header(self, name: str, size: int) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = self._mtime
+        info.mode = 0o644
+        return info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8")
+
+    def add_bytes(self, name: str, data: bytes) -> bytes:
+        return self._deflate.compress(self._header(name, len(data)) + data + b"\0" * (-len(data) % BLOCK))
+
+    def add_json(self, name: str, value) -> bytes:
+        return self.add_bytes(name, _dumps(value))
+
+    def add_lines(self, name: str, values: List[dict]) -> bytes:
+        return self.add_bytes(name, b"".join(_dumps(value) + b"\n" for value in values))
+
+    def add_file(self, name: str, path: str, size: int) -> Iterator[bytes]:
+        yield self._deflate.compress(self._header(name, size))
+        remaining = size
+        with open(path, "rb") as f:
+            while remaining > 0:
+                block = f.read(min(settings.UPLOAD_CHUNK_BYTES, remaining))
+                if not block:
+                    raise IOError(f"{path} 在导出过程中被截断")
+                remaining -= len(block)
+                output = self._deflate.compress(block)
+                if output:
+                    yield output
+        yield self._deflate.compress(b"\0" * (-size % BLOCK))
+
+    def close(self) -> bytes:
+        return self._deflate.compress(b"\0" * (BLOCK * 2)) + self._deflate.flush()
+
+def _iter_pages(user_id: int, project_ids: Optional[List[int]]) -> Iterator[List[Project]]:
+    """按 id 游标分页读取，每页单独的会话，不会一次加载全部项目"""
+    last_id = 0
+    while True:
+        with Session(engine) as session:
+            statement = select(Project).where(Project.user_id == user_id, Project.id > last_id)
+            if project_ids is not None:
+                statement = statement.where(Project.id.in_(project_ids))
+            projects = session.exec(statement.order_by(Project.id).limit(PROJECT_PAGE)).all()
+        if not projects:
+            return
+        yield projects
+        last_id = projects[-1].id
+
+def _message_batches(project_ids: List[int]) -> Iterator[Tuple[int, list]]:
+    """一页项目的对话记录按 (project_id, id) 游标分批读取，每批按项目切开"""
+    last = (0, 0)
+    while True:
+        with Session(engine) as session:
+            rows = session.exec(
+                select(ChatMessage.project_id, ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at)
+                .where(ChatMessage.project_id.in_(project_ids), tuple_(ChatMessage.project_id, ChatMessage.id) > last)
+                .order_by(ChatMessage.project_id, ChatMessage.id).limit(settings.BUNDLE_BATCH_ROWS)
+            ).all()
+        if not rows:
+            return
+        for project_id, group in groupby(rows, key=lambda row: row.project_id):
+            yield project_id, list(group)
+        last = (rows[-1].project_id, rows[-1].id)
+
+def _page_extras(project_ids: List[int]) -> Tuple[Dict[int, dict], Dict[int, List[FileUpload]]]:
+    """一页项目的对话摘要与附件记录"""
+    summaries: Dict[int, dict] = {}
+    files: Dict[int, List[FileUpload]] = {}
+    with Session(engine) as session:
+        for summary in session.exec(select(ChatSummary).where(ChatSummary.project_id.in_(project_ids))).all():
+            # 消息导入后 id 会变化，摘要覆盖范围按条数记录
+            covered = session.exec(
+                select(func.count()).select_from(ChatMessage).where(
+                    ChatMessage.project_id == summary.project_id, ChatMessage.id <= summary.covered_until
+                )
+            ).one()
+            summaries[summary.project_id] = {
+                "content": summary.content, "covered_count": covered,
+                "message_count": summary.message_count, "updated_at": summary.updated_at,
+            }
+        for db_file in session.exec(
+            select(FileUpload).where(FileUpload.project_id.in_(project_ids)).order_by(FileUpload.id)
+        ).all():
+            files.setdefault(db_file.project_id, []).append(db_file)
+    return summaries, files
+
+def _export_page(writer: _TarGzWriter, projects: List[Project], exported_blobs: Set[str], stats: Dict[str, int]) -> Iterator[bytes]:
+    project_ids = [project.id for project in projects]
+    summaries, files = _page_extras(project_ids)
+    batches = _message_batches(project_ids)
+    batch = next(batches, None)
+    for project in projects:
+        prefix = f"projects/{project.id}"
+        yield writer.add_json(f"{prefix}/project.json", {field: getattr(project, field) for field in PROJECT_FIELDS})
+
+        part = 0
+        while batch is not None and batch[0] == project.id:
+            yield writer.add_lines(f"{prefix}/messages-{part:04d}.jsonl", [
+                {"role": row.role, "content": row.content, "created_at": row.created_at} for row in batch[1]
+            ])
+            stats["messages"] += len(batch[1])
+            part += 1
+            batch = next(batches, None)
+        if project.id in summaries:
+            yield writer.add_json(f"{prefix}/summary.json", summaries[project.id])
+
+        rows = get_store().items(project.id)
+        if rows:
+            yield writer.add_lines(f"{prefix}/demo_data.jsonl", [{"key": key, "content": content} for key, content in rows])
+            stats["demo_data"] += len(rows)
+
+        records = []
+        for db_file in files.get(project.id, ()):
+            try:
+                size = os.path.getsize(db_file.file_path)
+            except OSError:
+                stats["missing_files"] += 1
+                continue
+            # 早于内容寻址的旧附件没有哈希，导出时补算
+            digest = db_file.content_hash or _hash_file(db_file.file_path)
+            if digest not in exported_blobs:
+                yield from writer.add_file(f"blobs/{digest}", db_file.file_path, size)
+                exported_blobs.add(digest)
+                stats["blobs"] += 1
+                stats["blob_bytes"] += size
+            records.append({
+                "filename": db_file.filename, "file_type": db_file.file_type, "content_hash": digest,
+                "size": size, "created_at": db_file.created_at,
+            })
+        if records:
+            yield writer.add_lines(f"{prefix}/files.jsonl", records)
+            stats["files"] += len(records)
+        stats["projects"] += 1
+
+def export_bundle(user_id: int, project_ids: Optional[List[int]] = None) -> Iterator[bytes]:
+    """
+    流式导出用户的项目（project_ids 为空时导出全部）：边查询边压缩边发送，
+    内存占用只与单个成员有关。同步生成器，由 StreamingResponse 放到线程池中迭代。
+    """
+    started = time.perf_counter()
+    writer = _TarGzWriter()
+    stats = {"projects": 0, "messages": 0, "demo_data": 0, "files": 0, "blobs": 0, "blob_bytes": 0, "missing_files": 0}
+    exported_blobs: Set[str] = set()
+    yield writer.add_json("bundle.json", {
+        "format": BUNDLE_FORMAT, "version": BUNDLE_VERSION, "exported_at": datetime.utcnow(), "user_id": user_id,
+    })
+    for projects in _iter_pages(user_id, project_ids):
+        yield from _export_page(writer, projects, exported_blobs, stats)
+    yield writer.add_json("stats.json", stats)
+    yield writer.close()
+    print(f"DEBUG: Exported bundle for user {user_id}: {stats} in {time.perf_counter() - started:.1f}s")
+
+class _Importer:
+    """顺序处理导入包的成员：主库写入按 BUNDLE_BATCH_ROWS 行分批提交，附件按内容哈希去重"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.session = Session(engine)
+        self.pending = 0
+        self.project_map: Dict[int, int] = {}
+        self.file_ids: List[int] = []
+        self.header: Optional[dict] = None
+        self.complete = False
+        self.stats = {
+            "projects": 0, "messages": 0, "demo_data": 0, "demo_data_skipped": 0, "files": 0,
+            "missing_files": 0, "blobs_written": 0, "blobs_deduplicated": 0, "blobs_skipped": 0,
+        }
+
+    def commit(self):
+        if self.pending:
+            self.session.commit()
+            self.pending = 0
+
+    def _added(self, rows: int):
+        self.pending += rows
+        if self.pending >= settings.BUNDLE_BATCH_ROWS:
+            self.commit()
+
+    def handle(self, archive: tarfile.TarFile, member: tarfile.TarInfo):
+        if not member.isfile():
+            return
+        if self.header is None:
+            if member.name != "bundle.json":
+                raise HTTPException(status_code=400, detail="不是有效的项目导出包")
+            self.header = json.loads(self._read(archive, member))
+            if self.header.get("format") != BUNDLE_FORMAT or self.header.get("version") != BUNDLE_VERSION:
+                raise HTTPException(status_code=400, detail="不支持的导出包格式或版本")
+            return
+        if member.name == "stats.json":
+            self.complete = True
+            return
+        blob = BLOB_MEMBER.match(member.name)
+        if blob:
+            self._blob(archive, member, blob.group(1))
+            return
+        match = PROJECT_MEMBER.match(member.name)
+        if not match:
+            print(f"DEBUG: Bundle import skipped unknown member {member.name}")
+            return
+        old_id, kind = int(match.group(1)), match.group(2)
+        if kind == "project":
+            self._project(old_id, json.loads(self._read(archive, member)))
+            return
+        project_id = self.project_map.get(old_id)
+        if project_id is None:
+            raise HTTPException(status_code=400, detail=f"导出包成员顺序错误：{member.name}")
+        if kind == "summary":
+            self._summary(project_id, json.loads(self._read(archive, member)))
+        else:
+            getattr(self, f"_{kind}")(project_id, self._lines(archive, member))
+
+    @staticmethod
+    def _check_size(member: tarfile.TarInfo):
+        if member.size > settings.UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=400, detail=f"导出包成员过大：{member.name}")
+
+    def _read(self, archive: tarfile.TarFile, member: tarfile.TarInfo) -> bytes:
+        self._check_size(member)
+        return archive.extractfile(member).read()
+
+    def _lines(self, archive: tarfile.TarFile, member: tarfile.TarInfo) -> Iterator[dict]:
+        """逐行读取 JSONL（流式 tar 不支持 seek，不能套 TextIOWrapper）；单行长度有上限，防止畸形包把整个成员读进内存"""
+        self._check_size(member)
+        source = archive.extractfile(member)
+        limit = settings.BUNDLE_LINE_MAX_BYTES
+        while True:
+            line = source.readline(limit + 1)
+            if not line:
+                return
+            if len(line) > limit:
+                raise HTTPException(status_code=400, detail=f"导出包成员中的行过长：{member.name}")
+            if line.strip():
+                yield json.loads(line)
+
+    def _project(self, old_id: int, data: dict):
+        project = Project(
+            **{field: data.get(field) for field in PROJECT_FIELDS if field not in ("created_at", "updated_at")},
+            user_id=self.user_id,
+            created_at=_parse_time(data.get("created_at")),
+            updated_at=_parse_time(data.get("updated_at")),
+        )
+        if not project.name:
+            project.name = "导入的项目"
+        self.session.add(project)
+        # 取得新 id；项目检索、近似重复与文档摘要索引由 Project 的写入事件在同一事务中建立
+        self.session.flush()
+        self.project_map[old_id] = project.id
+        self.stats["projects"] += 1
+        self._added(1)
+
+    def _messages(self, project_id: int, lines: Iterator[dict]):
+        batch = []
+        for line in lines:
+            batch.append({
+                "project_id": project_id, "role": line.get("role") or "user",
+                "content": (line.get("content") or "")[:settings.CHAT_MESSAGE_MAX_CHARS],
+                "created_at": _parse_time(line.get("created_at")),
+            })
+            if len(batch) >= settings.BUNDLE_BATCH_ROWS:
+                self._insert_messages(batch)
+                batch = []
+        if batch:
+            self._insert_messages(batch)
+
+    def _insert_messages(self, batch: List[dict]):
+        self.session.connection().execute(insert(ChatMessage), batch)
+        self.stats["messages"] += len(batch)
+        self._added(len(batch))
+
+    def _summary(self, project_id: int, data: dict):
+        covered_until = 0
+        covered = int(data.get("covered_count") or 0)
+        if covered > 0:
+            covered_until = self.session.exec(
+                select(ChatMessage.id).where(ChatMessage.project_id == project_id)
+                .order_by(ChatMessage.id).offset(covered - 1).limit(1)
+            ).first() or 0
+        self.session.add(ChatSummary(
+            project_id=project_id, content=data.get("content") or "", covered_until=covered_until,
+            message_count=int(data.get("message_count") or 0), updated_at=_parse_time(data.get("updated_at")),
+        ))
+        self._added(1)
+
+    def _demo_data(self, project_id: int, lines: Iterator[dict]):
+        """导入的数据同样受每个项目的 Demo 数据配额限制"""
+        rows, total = [], 0
+        for line in lines:
+            key, content = line.get("key"), line.get("content")
+            size = len(content.encode("utf-8")) if isinstance(content, str) else 0
+            if (not key or not isinstance(content, str) or size > settings.DEMO_DATA_MAX_VALUE_BYTES
+                    or len(rows) >= settings.DEMO_DATA_MAX_KEYS_PER_PROJECT
+                    or total + size > settings.DEMO_DATA_MAX_BYTES_PER_PROJECT):
+                self.stats["demo_data_skipped"] += 1
+                continue
+            rows.append((key, content))
+            total += size
+        if rows:
+            # Demo 数据可能在独立的分片中，先提交项目，保证数据不会挂到回滚后被复用的项目 id 上
+            self.commit()
+            get_store().put_many(project_id, rows)
+            self.stats["demo_data"] += len(rows)
+
+    def _files(self, project_id: int, lines: Iterator[dict]):
+        added = []
+        for line in lines:
+            digest = line.get("content_hash") or ""
+            path = blob_path(digest)
+            if not BLOB_MEMBER.match(f"blobs/{digest}") or not os.path.exists(path):
+                self.stats["missing_files"] += 1
+                continue
+            db_file = FileUpload(
+                filename=line.get("filename") or digest, file_path=path,
+                file_type=line.get("file_type") or "application/octet-stream",
+                user_id=self.user_id, project_id=project_id, content_hash=digest,
+                size=line.get("size"), created_at=_parse_time(line.get("created_at")),
+            )
+            self.session.add(db_file)
+            added.append(db_file)
+        if added:
+            self.session.flush()
+            self.file_ids.extend(db_file.id for db_file in added)
+            self.stats["files"] += len(added)
+            self._added(len(added))
+
+    def _blob(self, archive: tarfile.TarFile, member: tarfile.TarInfo, digest: str):
+        target = blob_path(digest)
+        if os.path.exists(target):
+            # 已有相同内容：不读取成员数据，刷新修改时间避免被后台清理回收
+            os.utime(target)
+            self.stats["blobs_deduplicated"] += 1
+            return
+        if member.size > settings.UPLOAD_MAX_BYTES:
+            self.stats["blobs_skipped"] += 1
+            return
+        source = archive.extractfile(member)
+        tmp_path = os.path.join(tmp_dir(), f"{uuid.uuid4().hex}.import")
+        os.makedirs(tmp_dir(), exist_ok=True)
+        hasher = hashlib.sha256()
+        try:
+            with open(tmp_path, "wb") as f:
+                for block in iter(lambda: source.read(settings.UPLOAD_CHUNK_BYTES), b""):
+                    f.write(block)
+                    hasher.update(block)
+            if hasher.hexdigest() != digest:
+                raise HTTPException(status_code=400, detail=f"附件内容与哈希不一致：{digest}")
+            _commit_blob(tmp_path, digest)
+        finally:
+            _remove_quietly(tmp_path)
+        self.stats["blobs_written"] += 1
+
+    def discard(self):
+        """
+        导入失败：回滚未提交的批次，再删除本次已提交的项目及其对话、摘要、附件记录与 Demo 数据，
+        不留下导入了一半的项目。本次写入的附件内容若无其他引用，由后台维护任务回收。
+        """
+        self.session.rollback()
+        project_ids = list(self.project_map.values())
+        self.file_ids = []
+        if not project_ids:
+            return
+        with Session(engine) as session:
+            for project_id in project_ids:
+                chat_history.delete_history(session, project_id)
+            session.exec(delete(FileUpload).where(FileUpload.project_id.in_(project_ids)))
+            # 逐个删除项目，检索、近似重复与摘要索引由 Project 的删除事件清理
+            for project in session.exec(select(Project).where(Project.id.in_(project_ids))).all():
+                session.delete(project)
+            session.commit()
+        store = get_store()
+        for project_id in project_ids:
+            store.drop_project(project_id)
+        print(f"DEBUG: Bundle import failed, removed {len(project_ids)} partially imported projects")
+
+    def close(self):
+        self.session.close()
+
+def import_bundle(source: IO[bytes], user_id: int) -> dict:
+    """
+    顺序读取导出包并导入为 user_id 的新项目（不恢复发布状态），返回统计与需要建立检索索引的附件 id。
+    包损坏或被截断时删除本次已导入的项目，并返回 400（processed 为失败前处理的数量）。
+    """
+    started = time.perf_counter()
+    importer = _Importer(user_id)
+    try:
+        with tarfile.open(fileobj=source, mode="r|gz") as archive:
+            for member in archive:
+                importer.handle(archive, member)
+        if importer.header is None or not importer.complete:
+            raise HTTPException(status_code=400, detail="导出包不完整")
+        importer.commit()
+    except HTTPException as e:
+        importer.discard()
+        e.detail = {"message": e.detail, "processed": importer.stats}
+        raise
+    except (tarfile.TarError, zlib.error, EOFError, ValueError, UnicodeDecodeError) as e:
+        importer.discard()
+        raise HTTPException(status_code=400, detail={"message": f"导出包已损坏：{e}", "processed": importer.stats})
+    except BaseException:
+        importer.discard()
+        raise
+    finally:
+        importer.close()
+    stats = dict(importer.stats, seconds=round(time.perf_counter() - started, 2))
+    print(f"DEBUG: Imported bundle for user {user_id}: {stats}")
+    return {**stats, "file_ids": importer.file_ids}
@@ -0,0 +1,184 @@
+import json
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+from sqlalchemy import delete, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.core.database import engine
+from app.core.prompt_builder import build_prompt
+from app.models.models import ChatMessage, ChatSummary, Project
+from app.services.llm_service import llm_service
+
+ROLES = ("user", "assistant")
+ROLE_LABELS = {"user": "用户", "assistant": "助手"}
+
+# 本进程正在摘要的项目，避免连续追加时重复调用 LLM（跨进程的并发由条件更新兜底）
+_summarizing: Set[int] = set()
+
+def append_messages(session: Session, project_id: int, messages: List[Tuple[str, str]]) -> List[ChatMessage]:
+    """追加若干条消息；写入量只与本次消息数有关，与历史长度无关"""
+    rows = [
+        ChatMessage(project_id=project_id, role=role, content=content[:settings.CHAT_MESSAGE_MAX_CHARS])
+        for role, content in messages
+    ]
+    session.add_all(rows)
+    session.commit()
+    for row in rows:
+        session.refresh(row)
+    return rows
+
+def read_messages(session: Session, project_id: int, before: Optional[int], limit: int) -> Tuple[List[ChatMessage], Optional[int]]:
+    """
+    从新到旧分页读取：返回 (按时间正序排列的一页消息, 更早一页的游标)。
+    游标为本页最早一条消息的 id，传回 before 参数即可继续向前翻页。
+    """
+    statement = select(ChatMessage).where(ChatMessage.project_id == project_id)
+    if before is not None:
+        statement = statement.where(ChatMessage.id < before)
+    rows = session.exec(statement.order_by(ChatMessage.id.desc()).limit(limit + 1)).all()
+    next_before = rows[limit - 1].id if len(rows) > limit else None
+    return list(reversed(rows[:limit])), next_before
+
+def count_messages(session: Session, project_id: int) -> int:
+    return session.exec(select(func.count()).select_from(ChatMessage).where(ChatMessage.project_id == project_id)).one()
+
+def get_summary(session: Session, project_id: int) -> Optional[ChatSummary]:
+    return session.get(ChatSummary, project_id)
+
+def delete_history(session: Session, project_id: int):
+    """随项目一起删除（不单独提交）"""
+    session.exec(delete(ChatMessage).where(ChatMessage.project_id == project_id))
+    session.exec(delete(ChatSummary).where(ChatSummary.project_id == project_id))
+
+def _covered_until(session: Session, project_id: int) -> int:
+    summary = get_summary(session, project_id)
+    return summary.covered_until if summary else 0
+
+def needs_summary(session: Session, project_id: int) -> bool:
+    """未摘要的消息超过阈值；摘要后这部分消息数有上界，计数成本不随历史增长"""
+    pending = session.exec(
+        select(func.count()).select_from(ChatMessage).where(
+            ChatMessage.project_id == project_id, ChatMessage.id > _covered_until(session, project_id)
+        )
+    ).one()
+    return pending > settings.CHAT_RECENT_MESSAGES + settings.CHAT_SUMMARY_BATCH
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + "…"
+
+def _transcript(rows: List[ChatMessage], limit: int = 2000) -> str:
+    return "\n".join(f"{ROLE_LABELS.get(row.role, row.role)}：{_clip(row.content, limit)}" for row in rows)
+
+def conversation_context(project_id: Optional[int], user_id: int) -> str:
+    """修改类提示词的对话背景：滚动摘要 + 摘要之后的最近几条消息，长度有上界"""
+    if not project_id:
+        return ""
+    with Session(engine) as session:
+        project = session.get(Project, project_id)
+        if not project or project.user_id != user_id:
+            return ""
+        summary = get_summary(session, project_id)
+        covered_until = summary.covered_until if summary else 0
+        recent = session.exec(
+            select(ChatMessage)
+            .where(ChatMessage.project_id == project_id, ChatMessage.id > covered_until)
+            .order_by(ChatMessage.id.desc())
+            .limit(settings.CHAT_RECENT_MESSAGES)
+        ).all()
+    parts = []
+    if summary and summary.content:
+        parts.append(f"较早对话摘要：\n{summary.content}")
+    recent = [row for row in reversed(recent) if row.role == "user"]
+    if recent:
+        parts.append(f"最近的用户意见：\n{_transcript(recent, 500)}")
+    if not parts:
+        return ""
+    return "【对话背景（仅供参考）】：\n" + "\n\n".join(parts) + "\n\n---\n\n"
+
+def _pending_batch(project_id: int) -> Optional[Tuple[str, int, List[ChatMessage]]]:
+    """待并入摘要的消息：已摘要位置之后、最近 CHAT_RECENT_MESSAGES 条之前的部分"""
+    with Session(engine) as session:
+        summary = get_summary(session, project_id)
+        covered_until = summary.covered_until if summary else 0
+        rows = session.exec(
+            select(ChatMessage)
+            .where(ChatMessage.project_id == project_id, ChatMessage.id > covered_until)
+            .order_by(ChatMessage.id)
+        ).all()
+        if len(rows) <= settings.CHAT_RECENT_MESSAGES + settings.CHAT_SUMMARY_BATCH:
+            return None
+        return (summary.content if summary else ""), covered_until, rows[:-settings.CHAT_RECENT_MESSAGES]
+
+def _store_summary(project_id: int, expected: int, covered_until: int, added: int, content: str) -> bool:
+    """只有摘要位置仍为 expected 时才写入：其他进程先完成了同一批摘要时放弃本次结果"""
+    with Session(engine) as session:
+        if expected == 0 and not get_summary(session, project_id):
+            session.add(ChatSummary(
+                project_id=project_id, content=content, covered_until=covered_until, message_count=added
+            ))
+            try:
+                session.commit()
+                return True
+            except IntegrityError:
+                return False
+        result = session.exec(
+            update(ChatSummary)
+            .where(ChatSummary.project_id == project_id, ChatSummary.covered_until == expected)
+            .values(
+                content=content,
+                covered_until=covered_until,
+                message_count=ChatSummary.message_count + added,
+                updated_at=datetime.utcnow(),
+            )
+        )
+        session.commit()
+        return result.rowcount == 1
+
+async def summarize_project(project_id: int):
+    """后台任务：把较早的消息并入滚动摘要。失败时保持原样，下次追加后重试"""
+    if project_id in _summarizing:
+        return
+    _summarizing.add(project_id)
+    try:
+        batch = await run_in_threadpool(_pending_batch, project_id)
+        if not batch:
+            return
+        previous, expected, rows = batch
+        messages, _ = build_prompt(
+            "chat_summary", previous_summary=previous or "（无）", transcript=_transcript(rows)
+        )
+        content = await llm_service.chat_completion(messages, model=settings.CHAT_SUMMARY_MODEL, temperature=0.3)
+        content = _clip((content or "").strip(), settings.CHAT_SUMMARY_MAX_CHARS)
+        if not content:
+            return
+        stored = await run_in_threadpool(_store_summary, project_id, expected, rows[-1].id, len(rows), content)
+        print(f"DEBUG: Chat summary for project {project_id}: +{len(rows)} messages up to {rows[-1].id} (stored={stored})")
+    except Exception as e:
+        print(f"DEBUG: Chat summary for project {project_id} failed: {e}")
+    finally:
+        _summarizing.discard(project_id)
+
+def migrate_legacy_history():
+    """把旧版 Project.chat_history JSON 拆成逐条消息，迁移后清空该列。可重复执行"""
+    with Session(engine) as session:
+        projects = session.exec(
+            select(Project).where(Project.chat_history.is_not(None), Project.chat_history.not_in(["", "[]"]))
+        ).all()
+        for project in projects:
+            try:
+                history = json.loads(project.chat_history)
+            except ValueError:
+                history = []
+            if not count_messages(session, project.id):
+                session.add_all([
+                    ChatMessage(project_id=project.id, role=item["role"], content=str(item["content"]))
+                    for item in history
+                    if isinstance(item, dict) and item.get("role") in ROLES and item.get("content")
+                ])
+            project.chat_history = "[]"
+            session.add(project)
+            session.commit()
+        if projects:
+            print(f"--- 数据库迁移：{len(projects)} 个项目的对话记录迁移到 chatmessage ---")
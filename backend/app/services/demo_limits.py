@@ -0,0 +1,95 @@
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from sqlalchemy import select
+from app.core.config import settings
+from app.core.database import engine
+from app.core.rate_limit import TokenBucketLimiter, check_buckets
+from app.models.models import Project
+from app.services.demo_store import get_store
+
+# 已发布 Demo 页面的地址中带有分享 Token，Demo 发出的数据请求通过 Referer 带回
+SHARE_REFERER = re.compile(r"/public/(?:demo|preview)/([0-9a-f]{32})")
+
+project_limiter = TokenBucketLimiter("demo-project", settings.DEMO_RATE_PER_PROJECT, settings.DEMO_BURST_PER_PROJECT)
+share_limiter = TokenBucketLimiter("demo-share", settings.DEMO_RATE_PER_SHARE, settings.DEMO_BURST_PER_SHARE)
+ip_limiter = TokenBucketLimiter("demo-ip", settings.DEMO_RATE_PER_IP, settings.DEMO_BURST_PER_IP)
+
+# 项目用量缓存：project_id -> [字节数, key 数, 加载时间]；写入接口在线程池中并发执行，读写都持有 _usage_lock
+_usage: Dict[int, List[float]] = {}
+_usage_lock = threading.Lock()
+# 确认存在的项目：project_id -> 确认时间（不存在的不缓存，由限流约束随意猜测的 ID）
+_known_projects: Dict[int, float] = {}
+MAX_CACHED_PROJECTS = 10000
+
+def _share_token(request: Request) -> Optional[str]:
+    match = SHARE_REFERER.search(request.headers.get("referer", ""))
+    return match.group(1) if match else None
+
+def throttle(request: Request, project_key: str, cost: float = 1.0):
+    """按项目、分享 Token、客户端 IP 三个维度限流，任一维度超限返回 429"""
+    if not settings.DEMO_RATE_LIMIT_ENABLED:
+        return
+    checks: List[Tuple[TokenBucketLimiter, str]] = [(project_limiter, project_key)]
+    token = _share_token(request)
+    if token:
+        checks.append((share_limiter, token))
+    checks.append((ip_limiter, request.client.host if request.client else "unknown"))
+    check_buckets(checks, cost)
+
+def project_exists(project_id: int) -> bool:
+    """写入前确认项目存在，避免为任意 ID 创建分片；结果缓存 DEMO_QUOTA_CACHE_SECONDS 秒"""
+    with _usage_lock:
+        checked = _known_projects.get(project_id)
+    if checked is not None and time.monotonic() - checked <= settings.DEMO_QUOTA_CACHE_SECONDS:
+        return True
+    with engine.connect() as connection:
+        exists = connection.execute(select(Project.id).where(Project.id == project_id)).first() is not None
+    if exists:
+        with _usage_lock:
+            if len(_known_projects) >= MAX_CACHED_PROJECTS:
+                _known_projects.clear()
+            _known_projects[project_id] = time.monotonic()
+    return exists
+
+def _usage_of(project_id: int) -> List[float]:
+    """项目当前的 Demo 数据用量（按 UTF-8 字节计），缓存 DEMO_QUOTA_CACHE_SECONDS 秒"""
+    with _usage_lock:
+        usage = _usage.get(project_id)
+    if usage is None or time.monotonic() - usage[2] > settings.DEMO_QUOTA_CACHE_SECONDS:
+        # 统计用量要读存储，不在锁内进行
+        size, count = get_store().usage(project_id)
+        with _usage_lock:
+            if len(_usage) >= MAX_CACHED_PROJECTS:
+                _usage.clear()
+            usage = _usage[project_id] = [float(size), float(count), time.monotonic()]
+    return usage
+
+def check_quota(project_id: int, old_size: Optional[int], payload: str) -> int:
+    """
+    写入前检查单个值大小（old_size 为已有值的字节数，新 key 为 None）与项目的总字节数、key 数配额，超出时返回 413。
+    检查通过时立即在缓存中预占本次写入的用量，并发写入不会一起越过配额；
+    返回字节数变化，写入失败时调用方用 record_write 退回。
+    """
+    size = len(payload.encode("utf-8"))
+    if size > settings.DEMO_DATA_MAX_VALUE_BYTES:
+        raise HTTPException(status_code=413, detail=f"单个数据不能超过 {settings.DEMO_DATA_MAX_VALUE_BYTES} 字节")
+    usage = _usage_of(project_id)
+    delta = size - (old_size or 0)
+    with _usage_lock:
+        if old_size is None and usage[1] + 1 > settings.DEMO_DATA_MAX_KEYS_PER_PROJECT:
+            raise HTTPException(status_code=413, detail=f"项目数据项已达上限（{settings.DEMO_DATA_MAX_KEYS_PER_PROJECT} 个）")
+        if delta > 0 and usage[0] + delta > settings.DEMO_DATA_MAX_BYTES_PER_PROJECT:
+            raise HTTPException(status_code=413, detail="项目数据已超出存储配额")
+        usage[0] += delta
+        usage[1] += 1 if old_size is None else 0
+    return delta
+
+def record_write(project_id: int, delta_bytes: int, delta_keys: int):
+    with _usage_lock:
+        usage = _usage.get(project_id)
+        if usage is not None:
+            usage[0] += delta_bytes
+            usage[1] += delta_keys
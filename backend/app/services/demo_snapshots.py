@@ -0,0 +1,333 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event, inspect, select as sa_select
+from sqlmodel import Session, select
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from app.core.config import settings
+from app.core.database import engine
+from app.core.shared_state import get_shared_state
+from app.models.models import Project
+from app.services import demo_store
+from app.services.file_serving import IMMUTABLE, HAS_BROTLI, is_not_modified, negotiate_encoding, variant_etag
+
+TOKEN_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+VERSION_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+HEAD_TAG = re.compile(r"<head\b[^>]*>", re.I)
+HTML_TAG = re.compile(r"<html\b[^>]*>", re.I)
+
+# 影响快照内容的项目字段
+SNAPSHOT_FIELDS = ("demo_code", "share_token")
+
+# 首次读取某个 key 时直接返回内联数据，省去 Demo 加载后的数据请求；
+# 之后的读写照常走 /api/v1/demo 接口。快照构建时不存在的 key 与接口一致返回 []，
+# 超出内联大小上限的 key（remote）始终走接口。
+BOOTSTRAP_SCRIPT = """<script>
+window.PROJECT_ID = %(project_id)s;
+(function () {
+  var inline = %(data)s;
+  var remote = %(remote)s;
+  var pattern = /\\/api\\/v1\\/demo\\/[^\\/]+\\/data\\/([^\\/?#]+)/;
+  var nativeFetch = window.fetch.bind(window);
+  window.fetch = function (input, init) {
+    var url = typeof input === "string" ? input : (input && input.url) || String(input);
+    var method = ((init && init.method) || (input && input.method) || "GET").toUpperCase();
+    var match = pattern.exec(url);
+    if (match) {
+      var key = decodeURIComponent(match[1]);
+      var served;
+      if (remote.indexOf(key) < 0) {
+        served = Object.prototype.hasOwnProperty.call(inline, key) ? inline[key] : "[]";
+      }
+      remote.push(key);
+      if (method === "GET" && served !== undefined) {
+        return Promise.resolve(new Response(served, { status: 200, headers: { "Content-Type": "application/json" } }));
+      }
+    }
+    return nativeFetch(input, init);
+  };
+})();
+</script>"""
+
+_build_locks: Dict[str, threading.Lock] = {}
+_build_locks_guard = threading.Lock()
+
+# 过期快照照常下发，重建放到后台线程；同一 token 同时只排队一次
+_rebuild_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snapshot")
+_rebuilding = set()
+_rebuilding_lock = threading.Lock()
+
+# Demo 数据写入引起的失效按 token 去抖：token -> 上次递增代数的时间；窗口内的写入只在窗口结束时补一次
+_invalidated_at: Dict[str, float] = {}
+_deferred = set()
+_invalidate_lock = threading.Lock()
+
+# Demo 数据写入时要找到项目的分享 Token：project_id -> (share_token, 查询时间)，缓存 SNAPSHOT_MAX_AGE 秒，
+# 未发布的项目写入时不访问主库也不访问共享状态。本进程内的发布/取消发布立即更新缓存，
+# 其他进程最多滞后 SNAPSHOT_MAX_AGE 秒，因此首次构建的快照在这段时间之后再重建一次（见 settle_at）
+_share_tokens: Dict[int, Tuple[Optional[str], float]] = {}
+_share_tokens_lock = threading.Lock()
+MAX_CACHED_TOKENS = 10000
+
+def _snapshot_dir(token: str) -> str:
+    return os.path.join(settings.SNAPSHOT_DIR, token)
+
+def _generation_key(token: str) -> str:
+    return f"snapshot:{token}:gen"
+
+def current_generation(token: str) -> int:
+    return int(get_shared_state().get(_generation_key(token)) or 0)
+
+def invalidate(token: Optional[str]):
+    """项目或其 Demo 数据变化：递增代数，下次访问时重建（不在数据库事务中做文件操作）"""
+    if token:
+        get_shared_state().incr(_generation_key(token))
+
+def _flush_invalidation(token: str):
+    with _invalidate_lock:
+        _deferred.discard(token)
+        _invalidated_at[token] = time.monotonic()
+    invalidate(token)
+
+def invalidate_soon(token: Optional[str]):
+    """Demo 数据写入：去抖后的 invalidate，连续写入时不必每次都递增共享状态中的代数"""
+    if not token:
+        return
+    window = settings.SNAPSHOT_INVALIDATE_DEBOUNCE_SECONDS
+    now = time.monotonic()
+    with _invalidate_lock:
+        if token in _deferred:
+            return
+        elapsed = now - _invalidated_at.get(token, float("-inf"))
+        if elapsed < window:
+            # 窗口结束时再递增一次，保证窗口内最后一次写入之后的快照会重建
+            _deferred.add(token)
+            timer = threading.Timer(window - elapsed, _flush_invalidation, (token,))
+            timer.daemon = True
+            timer.start()
+            return
+        if len(_invalidated_at) >= MAX_CACHED_TOKENS:
+            _invalidated_at.clear()
+        _invalidated_at[token] = now
+    invalidate(token)
+
+def _script_json(value) -> str:
+    """可安全嵌入 <script> 的 JSON"""
+    text = json.dumps(value, ensure_ascii=False)
+    return text.replace("</", "<\\/").replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+
+def render_snapshot(project: Project, rows: List[Tuple[str, str]]) -> str:
+    """最终 HTML：在 <head> 最前面注入 PROJECT_ID 与初始数据（rows 为 key, JSON 文本），保证先于 Demo 自身脚本执行"""
+    inline = {}
+    remote = []
+    budget = settings.SNAPSHOT_INLINE_MAX_BYTES
+    for key, content in sorted(rows, key=lambda r: len(r[1])):
+        if len(content) <= budget:
+            # 值保持为 JSON 文本，原样作为响应体返回
+            inline[key] = content
+            budget -= len(content)
+        else:
+            remote.append(key)
+    bootstrap = BOOTSTRAP_SCRIPT % {
+        "project_id": json.dumps(project.id),
+        "data": _script_json(inline),
+        "remote": _script_json(remote),
+    }
+    html = project.demo_code or ""
+    for pattern in (HEAD_TAG, HTML_TAG):
+        match = pattern.search(html)
+        if match:
+            return html[:match.end()] + bootstrap + html[match.end():]
+    return bootstrap + html
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _prune(directory: str, keep: str):
+    """保留最近几个版本，已缓存旧版本地址的访客仍可访问"""
+    versions = {}
+    for name in os.listdir(directory):
+        version = name.split(".", 1)[0]
+        if VERSION_PATTERN.match(version):
+            versions.setdefault(version, []).append(os.path.join(directory, name))
+    ordered = sorted(versions, key=lambda v: max(os.path.getmtime(p) for p in versions[v]), reverse=True)
+    for version in ordered[settings.SNAPSHOT_KEEP_VERSIONS:]:
+        if version == keep:
+            continue
+        for path in versions[version]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def build_snapshot(session: Session, project: Project, generation: int) -> dict:
+    rows = demo_store.get_store().items(project.id)
+    body = render_snapshot(project, rows).encode("utf-8")
+    version = hashlib.sha256(body).hexdigest()[:16]
+    directory = _snapshot_dir(project.share_token)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{version}.html")
+    if not os.path.exists(base):
+        # 构建时一次性生成压缩副本，访问时直接发送文件
+        _write_atomic(f"{base}.gz", gzip.compress(body, compresslevel=9, mtime=0))
+        if HAS_BROTLI:
+            import brotli
+            _write_atomic(f"{base}.br", brotli.compress(body, quality=settings.SNAPSHOT_BROTLI_QUALITY))
+        _write_atomic(base, body)
+    manifest = {"version": version, "generation": generation, "size": len(body), "built_at": time.time()}
+    if _read_manifest(project.share_token) is None:
+        # 刚发布：其他进程可能还缓存着“未发布”，这段时间的数据写入不会使快照失效
+        manifest["settle_at"] = manifest["built_at"] + settings.SNAPSHOT_MAX_AGE
+    if current_generation(project.share_token) == generation:
+        # 构建期间数据又变了就不写指针，下次访问重新构建
+        _write_atomic(os.path.join(directory, "current.json"), json.dumps(manifest).encode("utf-8"))
+    _prune(directory, version)
+    print(f"DEBUG: Built demo snapshot {project.share_token}/{version} ({len(body)} bytes)")
+    return manifest
+
+def _read_manifest(token: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(_snapshot_dir(token), "current.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _fresh(manifest: Optional[dict], token: str, generation: int) -> bool:
+    return (
+        manifest is not None
+        and manifest.get("generation") == generation
+        and (manifest.get("settle_at") is None or time.time() < manifest["settle_at"])
+        and os.path.exists(os.path.join(_snapshot_dir(token), f"{manifest['version']}.html"))
+    )
+
+def _build(token: str) -> Optional[dict]:
+    """同一进程内同一 token 只构建一次；构建结束后移除锁，避免 _build_locks 随 token 数量增长"""
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(token, threading.Lock())
+    try:
+        with lock:
+            generation = current_generation(token)
+            manifest = _read_manifest(token)
+            if _fresh(manifest, token, generation):
+                return manifest
+            with Session(engine) as session:
+                project = session.exec(select(Project).where(Project.share_token == token)).first()
+                if not project or not project.demo_code:
+                    return None
+                return build_snapshot(session, project, generation)
+    finally:
+        with _build_locks_guard:
+            if _build_locks.get(token) is lock:
+                del _build_locks[token]
+
+def _rebuild(token: str):
+    try:
+        if _build(token) is None:
+            # 分享已失效（取消发布或清空了 Demo）：不再下发旧快照
+            shutil.rmtree(_snapshot_dir(token), ignore_errors=True)
+    except Exception as e:
+        print(f"DEBUG: Failed to rebuild demo snapshot {token}: {e}")
+    finally:
+        with _rebuilding_lock:
+            _rebuilding.discard(token)
+
+def _schedule_rebuild(token: str):
+    with _rebuilding_lock:
+        if token in _rebuilding:
+            return
+        _rebuilding.add(token)
+    _rebuild_executor.submit(_rebuild, token)
+
+def ensure_snapshot(token: str) -> Optional[dict]:
+    """
+    返回快照清单，分享已失效返回 None。
+    还没有快照时当场构建；已有但过期时先返回旧快照，同时在后台重建（stale-while-revalidate）。
+    """
+    if not TOKEN_PATTERN.match(token):
+        return None
+    generation = current_generation(token)
+    manifest = _read_manifest(token)
+    if _fresh(manifest, token, generation):
+        return manifest
+    if manifest is not None and snapshot_path(token, manifest.get("version", "")):
+        _schedule_rebuild(token)
+        return manifest
+    return _build(token)
+
+def snapshot_path(token: str, version: str) -> Optional[str]:
+    if not TOKEN_PATTERN.match(token) or not VERSION_PATTERN.match(version):
+        return None
+    path = os.path.join(_snapshot_dir(token), f"{version}.html")
+    return path if os.path.exists(path) else None
+
+def serve_snapshot(request: Request, path: str, version: str, cache_control: str) -> Response:
+    """ETag 即内容版本；按 Accept-Encoding 直接发送预压缩文件"""
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if is_not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
+    encoding = negotiate_encoding(request)
+    if encoding and os.path.exists(f"{path}.{'br' if encoding == 'br' else 'gz'}"):
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = variant_etag(etag, encoding)
+        return FileResponse(f"{path}.{'br' if encoding == 'br' else 'gz'}", media_type="text/html; charset=utf-8", headers=headers)
+    return FileResponse(path, media_type="text/html; charset=utf-8", headers=headers)
+
+def current_cache_control() -> str:
+    # 分享链接本身会随项目更新而变化：短时间内直接用缓存，过期后后台重新验证
+    return f"public, max-age={settings.SNAPSHOT_MAX_AGE}, stale-while-revalidate=86400"
+
+VERSION_CACHE_CONTROL = IMMUTABLE
+
+def _cache_token(project_id: int, token: Optional[str]):
+    with _share_tokens_lock:
+        if len(_share_tokens) >= MAX_CACHED_TOKENS:
+            _share_tokens.clear()
+        _share_tokens[project_id] = (token, time.monotonic())
+
+def _share_token_of(project_id: int) -> Optional[str]:
+    with _share_tokens_lock:
+        cached = _share_tokens.get(project_id)
+    if cached is not None and time.monotonic() - cached[1] <= settings.SNAPSHOT_MAX_AGE:
+        return cached[0]
+    with engine.connect() as connection:
+        token = connection.execute(sa_select(Project.share_token).where(Project.id == project_id)).scalar()
+    _cache_token(project_id, token)
+    return token
+
+@event.listens_for(Project, "after_update")
+def _on_project_update(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[field].history.has_changes() for field in SNAPSHOT_FIELDS):
+        return
+    for token in state.attrs.share_token.history.deleted or ():
+        invalidate(token)
+        # 旧链接立即失效，不能再作为过期快照下发
+        if token and TOKEN_PATTERN.match(token):
+            shutil.rmtree(_snapshot_dir(token), ignore_errors=True)
+    invalidate(target.share_token)
+    _cache_token(target.id, target.share_token)
+
+@event.listens_for(Project, "after_delete")
+def _on_project_delete(mapper, connection, target):
+    with _share_tokens_lock:
+        _share_tokens.pop(target.id, None)
+    if target.share_token and TOKEN_PATTERN.match(target.share_token):
+        invalidate(target.share_token)
+        shutil.rmtree(_snapshot_dir(target.share_token), ignore_errors=True)
+
+def _on_demo_data_change(project_id: int):
+    invalidate_soon(_share_token_of(project_id))
+
+demo_store.add_listener(_on_demo_data_change)
@@ -0,0 +1,551 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import LargeBinary, cast, delete, func, insert, update
+from sqlmodel import select
+from app.core.config import settings
+from app.core.database import engine
+from app.models.models import DemoData
+
+# Demo 业务数据的存储引擎：每个项目一组 key -> JSON 文本。
+# table：主数据库的 demodata 表（所有项目的写入共用主库的一把写锁）；
+# sharded：按项目放到独立的 SQLite 文件（DEMO_STORE_SHARDS 为 0 时每个项目一个文件，
+# 否则按 project_id 取模分到固定数量的文件），不同分片的写入互不阻塞。
+
+SHARD_SCHEMA = """
+CREATE TABLE IF NOT EXISTS demo_data (
+    project_id INTEGER NOT NULL,
+    data_key TEXT NOT NULL,
+    data_content TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (project_id, data_key)
+) WITHOUT ROWID
+"""
+SHARD_FILE = re.compile(r"^(project|shard)-(\d+)\.db$")
+# 主库中还有历史数据时，每个进程隔多久重新确认一次（维护任务可能在其他进程中完成了迁移）
+LEGACY_RECHECK_SECONDS = 60
+
+# 写入或删除后的回调（参数为 project_id），用于让已发布快照失效
+_listeners: List[Callable[[int], None]] = []
+
+def add_listener(callback: Callable[[int], None]):
+    _listeners.append(callback)
+
+def _notify(project_id: int):
+    for callback in _listeners:
+        try:
+            callback(project_id)
+        except Exception as e:
+            print(f"DEBUG: Demo data listener failed: {e}")
+
+def _now() -> datetime:
+    return datetime.now()
+
+class DemoStore:
+    """存储引擎接口，值均为 JSON 文本，大小按 UTF-8 字节计"""
+
+    name = ""
+
+    def get(self, project_id: int, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def size(self, project_id: int, key: str) -> Optional[int]:
+        """已有值的字节数，不存在时返回 None"""
+        raise NotImplementedError
+
+    def put(self, project_id: int, key: str, content: str):
+        raise NotImplementedError
+
+    def put_many(self, project_id: int, rows: List[Tuple[str, str]]):
+        """一个事务写入多条（导入等批量场景）"""
+        raise NotImplementedError
+
+    def delete(self, project_id: int, key: str) -> Optional[int]:
+        """删除并返回原值的字节数，不存在时返回 None"""
+        raise NotImplementedError
+
+    def items(self, project_id: int) -> List[Tuple[str, str]]:
+        raise NotImplementedError
+
+    def usage(self, project_id: int) -> Tuple[int, int]:
+        """(总字节数, key 数)"""
+        raise NotImplementedError
+
+    def project_ids(self) -> List[int]:
+        """有数据的项目（供维护任务清理已删除项目的数据）"""
+        raise NotImplementedError
+
+    def drop_project(self, project_id: int) -> int:
+        raise NotImplementedError
+
+    def expire(self, cutoff: datetime) -> Dict[int, int]:
+        """删除 cutoff 之前最后写入的数据，返回 project_id -> 删除条数"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class TableDemoStore(DemoStore):
+    """主数据库中的 demodata 表"""
+
+    name = "table"
+
+    def _where(self, project_id: int, key: str):
+        return (DemoData.project_id == project_id) & (DemoData.data_key == key)
+
+    def get(self, project_id: int, key: str) -> Optional[str]:
+        with engine.connect() as connection:
+            return connection.execute(
+                select(DemoData.data_content).where(self._where(project_id, key)).limit(1)
+            ).scalar()
+
+    def size(self, project_id: int, key: str) -> Optional[int]:
+        with engine.connect() as connection:
+            return connection.execute(
+                select(func.length(cast(DemoData.data_content, LargeBinary))).where(self._where(project_id, key)).limit(1)
+            ).scalar()
+
+    def put(self, project_id: int, key: str, content: str):
+        with engine.begin() as connection:
+            updated = connection.execute(
+                update(DemoData).where(self._where(project_id, key)).values(data_content=content, updated_at=_now())
+            ).rowcount
+            if not updated:
+                connection.execute(insert(DemoData).values(
+                    project_id=project_id, data_key=key, data_content=content, updated_at=_now()
+                ))
+        _notify(project_id)
+
+    def put_many(self, project_id: int, rows: List[Tuple[str, str]]):
+        with engine.begin() as connection:
+            connection.execute(delete(DemoData).where(
+                DemoData.project_id == project_id, DemoData.data_key.in_([key for key, _ in rows])
+            ))
+            connection.execute(insert(DemoData), [
+                {"project_id": project_id, "data_key": key, "data_content": content, "updated_at": _now()}
+                for key, content in rows
+            ])
+        _notify(project_id)
+
+    def delete(self, project_id: int, key: str) -> Optional[int]:
+        with engine.begin() as connection:
+            size = connection.execute(
+                select(func.length(cast(DemoData.data_content, LargeBinary))).where(self._where(project_id, key)).limit(1)
+            ).scalar()
+            if size is None:
+                return None
+            connection.execute(delete(DemoData).where(self._where(project_id, key)))
+        _notify(project_id)
+        return size
+
+    def items(self, project_id: int) -> List[Tuple[str, str]]:
+        with engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(
+                select(DemoData.data_key, DemoData.data_content).where(DemoData.project_id == project_id)
+            )]
+
+    def usage(self, project_id: int) -> Tuple[int, int]:
+        with engine.connect() as connection:
+            size, count = connection.execute(
+                select(func.coalesce(func.sum(func.length(cast(DemoData.data_content, LargeBinary))), 0), func.count())
+                .where(DemoData.project_id == project_id)
+            ).one()
+        return int(size), int(count)
+
+    # 已删除项目与过期数据的清理仍由维护任务按主键分批执行（见 maintenance）
+    def project_ids(self) -> List[int]:
+        return []
+
+    def drop_project(self, project_id: int) -> int:
+        with engine.begin() as connection:
+            return connection.execute(delete(DemoData).where(DemoData.project_id == project_id)).rowcount
+
+    def expire(self, cutoff: datetime) -> Dict[int, int]:
+        return {}
+
+class _Handle:
+    def __init__(self, path: str):
+        self.path = path
+        # 连接可在线程池的不同线程间复用，同一时刻只由一个线程使用
+        self.lock = threading.Lock()
+        self.users = 0
+        # 已从连接池移除（文件被其他进程删除），最后一个使用者归还时关闭
+        self.stale = False
+        self.connection = sqlite3.connect(path, timeout=15, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA busy_timeout=15000")
+        self.connection.execute(SHARD_SCHEMA)
+        self.inode = os.stat(path).st_ino
+
+    def same_file(self) -> bool:
+        """文件仍是打开时的那个（没有被删除或删除后重建）"""
+        try:
+            return os.stat(self.path).st_ino == self.inode
+        except FileNotFoundError:
+            return False
+
+class ShardedDemoStore(DemoStore):
+    """
+    分片存储：每个分片是一个独立的 SQLite 文件（WAL），写锁按文件划分，活跃项目越多可并行的写入越多。
+    打开的分片连接放在容量为 max_open 的 LRU 池中，超出时关闭最久未用且空闲的连接。
+    每次取用连接时核对文件的 inode，其他进程删除了文件时丢弃旧连接，不会继续读写已删除的文件。
+
+    主库 demodata 表中的历史数据由维护任务分批搬入分片后从主库删除（migrate_legacy，幂等，分片中已有的 key 以分片为准）。
+    迁移完成前，读取有历史数据的项目时只读地合并主库中的数据，写入前先迁移该项目；
+    “主库已没有历史数据”与“某项目没有历史数据”都有缓存，迁移完成后读写不再访问主库。
+    """
+
+    name = "sharded"
+
+    def __init__(self, directory: str, shards: int = 0, max_open: int = 64):
+        self.directory = directory
+        self.shards = max(0, shards)
+        self.max_open = max(1, max_open)
+        self._pool: "OrderedDict[str, _Handle]" = OrderedDict()
+        self._guard = threading.Lock()
+        # 确认没有历史数据的项目；主库整体是否还有历史数据（None 为未检查，False 后不再检查）
+        self._no_legacy: Set[int] = set()
+        self._legacy_remaining: Optional[bool] = None
+        self._legacy_checked_at = 0.0
+        # 本进程已清空、等待文件空闲后删除的项目
+        self._dropped: Set[int] = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def shard_name(self, project_id: int) -> str:
+        if self.shards:
+            return f"shard-{project_id % self.shards:04d}.db"
+        return f"project-{project_id}.db"
+
+    def _shard_files(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if SHARD_FILE.match(name))
+
+    def _evict(self):
+        """关闭超出容量的空闲连接；全部在用时暂时超出，等归还后再回收"""
+        for name in list(self._pool):
+            if len(self._pool) <= self.max_open:
+                break
+            handle = self._pool[name]
+            if handle.users == 0:
+                del self._pool[name]
+                handle.connection.close()
+
+    @contextmanager
+    def _shard(self, name: str, create: bool = True) -> Iterator[Optional[sqlite3.Connection]]:
+        with self._guard:
+            handle = self._pool.get(name)
+            if handle is not None and not handle.same_file():
+                del self._pool[name]
+                handle.stale = True
+                if not handle.users:
+                    handle.connection.close()
+                handle = None
+            if handle is not None:
+                self._pool.move_to_end(name)
+            else:
+                path = os.path.join(self.directory, name)
+                if not create and not os.path.exists(path):
+                    handle = None
+                else:
+                    handle = self._pool[name] = _Handle(path)
+            if handle is not None:
+                handle.users += 1
+                self._evict()
+        if handle is None:
+            yield None
+            return
+        try:
+            with handle.lock:
+                yield handle.connection
+        finally:
+            with self._guard:
+                handle.users -= 1
+                if handle.stale and not handle.users:
+                    handle.connection.close()
+                self._evict()
+
+    @contextmanager
+    def _project(self, project_id: int, create: bool = True) -> Iterator[Optional[sqlite3.Connection]]:
+        with self._shard(self.shard_name(project_id), create) as connection:
+            yield connection
+
+    def _has_legacy(self) -> bool:
+        """主库中是否还有历史数据；迁移完成后不会再出现，之后不再查询"""
+        if self._legacy_remaining is False:
+            return False
+        if self._legacy_remaining is None or time.monotonic() - self._legacy_checked_at > LEGACY_RECHECK_SECONDS:
+            with engine.connect() as connection:
+                self._legacy_remaining = connection.execute(select(DemoData.id).limit(1)).first() is not None
+            self._legacy_checked_at = time.monotonic()
+        return self._legacy_remaining
+
+    def _pending(self, project_id: int) -> bool:
+        """该项目在主库中是否还有未迁移的历史数据"""
+        if project_id in self._no_legacy or not self._has_legacy():
+            return False
+        with engine.connect() as connection:
+            found = connection.execute(
+                select(DemoData.id).where(DemoData.project_id == project_id).limit(1)
+            ).first() is not None
+        if not found:
+            self._mark_migrated(project_id)
+        return found
+
+    def _mark_migrated(self, project_id: int):
+        if len(self._no_legacy) >= 100000:
+            self._no_legacy.clear()
+        self._no_legacy.add(project_id)
+
+    def _legacy(self, project_id: int) -> Dict[str, str]:
+        """迁移前只读地取出主库中的历史数据"""
+        with engine.connect() as connection:
+            return dict(connection.execute(
+                select(DemoData.data_key, DemoData.data_content).where(DemoData.project_id == project_id)
+            ).all())
+
+    def _migrate(self, project_id: int) -> int:
+        """把主库中该项目的历史数据搬入分片"""
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(DemoData.id, DemoData.data_key, DemoData.data_content, DemoData.updated_at)
+                .where(DemoData.project_id == project_id)
+            ).all()
+        if rows:
+            with self._shard(self.shard_name(project_id)) as shard:
+                shard.execute("BEGIN IMMEDIATE")
+                try:
+                    shard.executemany(
+                        "INSERT OR IGNORE INTO demo_data (project_id, data_key, data_content, updated_at) VALUES (?, ?, ?, ?)",
+                        [(project_id, row.data_key, row.data_content, str(row.updated_at or _now())) for row in rows],
+                    )
+                    shard.execute("COMMIT")
+                except Exception:
+                    shard.execute("ROLLBACK")
+                    raise
+            with engine.begin() as connection:
+                connection.execute(delete(DemoData).where(DemoData.id.in_([row.id for row in rows])))
+            print(f"DEBUG: Migrated {len(rows)} demo data rows of project {project_id} to {self.shard_name(project_id)}")
+        self._mark_migrated(project_id)
+        return len(rows)
+
+    def _before_write(self, project_id: int):
+        # 写入前先迁移，避免分片与主库中的同一个 key 分叉（只在迁移完成前发生）
+        if self._pending(project_id):
+            self._migrate(project_id)
+
+    def migrate_legacy(self, limit: Optional[int] = None) -> int:
+        """维护任务：分批迁移主库中剩余的历史数据，返回迁移的行数"""
+        limit = limit or settings.MAINTENANCE_BATCH_SIZE
+        with engine.connect() as connection:
+            project_ids = connection.execute(select(DemoData.project_id).distinct().limit(limit)).scalars().all()
+        migrated = sum(self._migrate(project_id) for project_id in project_ids)
+        if len(project_ids) < limit:
+            self._legacy_remaining = False
+        return migrated
+
+    def get(self, project_id: int, key: str) -> Optional[str]:
+        row = None
+        with self._project(project_id, create=False) as shard:
+            if shard is not None:
+                row = shard.execute(
+                    "SELECT data_content FROM demo_data WHERE project_id = ? AND data_key = ?", (project_id, key)
+                ).fetchone()
+        if row is None and self._pending(project_id):
+            return self._legacy(project_id).get(key)
+        return row[0] if row else None
+
+    def size(self, project_id: int, key: str) -> Optional[int]:
+        row = None
+        with self._project(project_id, create=False) as shard:
+            if shard is not None:
+                row = shard.execute(
+                    "SELECT length(CAST(data_content AS BLOB)) FROM demo_data WHERE project_id = ? AND data_key = ?",
+                    (project_id, key),
+                ).fetchone()
+        if row is None and self._pending(project_id):
+            content = self._legacy(project_id).get(key)
+            return None if content is None else len(content.encode("utf-8"))
+        return row[0] if row else None
+
+    def put(self, project_id: int, key: str, content: str):
+        self._before_write(project_id)
+        with self._project(project_id) as shard:
+            shard.execute(
+                "INSERT INTO demo_data (project_id, data_key, data_content, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (project_id, data_key) DO UPDATE SET data_content = excluded.data_content, "
+                "updated_at = excluded.updated_at",
+                (project_id, key, content, str(_now())),
+            )
+        _notify(project_id)
+
+    def put_many(self, project_id: int, rows: List[Tuple[str, str]]):
+        now = str(_now())
+        self._before_write(project_id)
+        with self._project(project_id) as shard:
+            shard.execute("BEGIN IMMEDIATE")
+            try:
+                shard.executemany(
+                    "INSERT INTO demo_data (project_id, data_key, data_content, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (project_id, data_key) DO UPDATE SET data_content = excluded.data_content, "
+                    "updated_at = excluded.updated_at",
+                    [(project_id, key, content, now) for key, content in rows],
+                )
+                shard.execute("COMMIT")
+            except Exception:
+                shard.execute("ROLLBACK")
+                raise
+        _notify(project_id)
+
+    def delete(self, project_id: int, key: str) -> Optional[int]:
+        self._before_write(project_id)
+        with self._project(project_id, create=False) as shard:
+            if shard is None:
+                return None
+            row = shard.execute(
+                "SELECT length(CAST(data_content AS BLOB)) FROM demo_data WHERE project_id = ? AND data_key = ?",
+                (project_id, key),
+            ).fetchone()
+            if row:
+                shard.execute("DELETE FROM demo_data WHERE project_id = ? AND data_key = ?", (project_id, key))
+        if row is None:
+            return None
+        _notify(project_id)
+        return row[0]
+
+    def items(self, project_id: int) -> List[Tuple[str, str]]:
+        rows = []
+        with self._project(project_id, create=False) as shard:
+            if shard is not None:
+                rows = shard.execute(
+                    "SELECT data_key, data_content FROM demo_data WHERE project_id = ?", (project_id,)
+                ).fetchall()
+        if self._pending(project_id):
+            merged = self._legacy(project_id)
+            merged.update(rows)
+            return list(merged.items())
+        return rows
+
+    def usage(self, project_id: int) -> Tuple[int, int]:
+        if self._pending(project_id):
+            rows = self.items(project_id)
+            return sum(len(content.encode("utf-8")) for _, content in rows), len(rows)
+        with self._project(project_id, create=False) as shard:
+            if shard is None:
+                return 0, 0
+            size, count = shard.execute(
+                "SELECT coalesce(sum(length(CAST(data_content AS BLOB))), 0), count(*) FROM demo_data WHERE project_id = ?",
+                (project_id,),
+            ).fetchone()
+        return int(size), int(count)
+
+    def project_ids(self) -> List[int]:
+        ids: Set[int] = set()
+        for name in self._shard_files():
+            kind, number = SHARD_FILE.match(name).groups()
+            if kind == "project":
+                ids.add(int(number))
+                continue
+            with self._shard(name, create=False) as shard:
+                if shard is not None:
+                    ids.update(row[0] for row in shard.execute("SELECT DISTINCT project_id FROM demo_data"))
+        return sorted(ids)
+
+    def _idle(self, name: str) -> bool:
+        """超过 DEMO_STORE_REMOVE_IDLE_SECONDS 没有写入（写入落在 -wal，检查点后落在主文件）"""
+        path = os.path.join(self.directory, name)
+        latest = 0.0
+        for suffix in ("", "-wal"):
+            try:
+                latest = max(latest, os.path.getmtime(path + suffix))
+            except FileNotFoundError:
+                pass
+        return time.time() - latest >= settings.DEMO_STORE_REMOVE_IDLE_SECONDS
+
+    def _remove_file(self, name: str) -> bool:
+        with self._guard:
+            handle = self._pool.get(name)
+            if handle is not None:
+                if handle.users:
+                    # 仍有请求在使用，留到下一轮维护
+                    return False
+                del self._pool[name]
+                handle.connection.close()
+        path = os.path.join(self.directory, name)
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def drop_project(self, project_id: int) -> int:
+        name = self.shard_name(project_id)
+        # 其他 worker 可能仍打开着该文件：只删除长时间没有写入的，它们下次取用连接时发现 inode 变化会重新打开。
+        # 先判断是否空闲再打开（打开连接会重建 -wal 文件）
+        idle = not self.shards and self._idle(name)
+        removed = 0
+        if project_id not in self._dropped:
+            with self._project(project_id, create=False) as shard:
+                if shard is None:
+                    return 0
+                removed = shard.execute("DELETE FROM demo_data WHERE project_id = ?", (project_id,)).rowcount
+            if len(self._dropped) >= 100000:
+                self._dropped.clear()
+            self._dropped.add(project_id)
+        # 共用的分片只删除数据；每个项目一个文件时，空闲后由之后的维护删除文件
+        if self.shards or (idle and self._remove_file(name)):
+            self._dropped.discard(project_id)
+        return removed
+
+    def expire(self, cutoff: datetime) -> Dict[int, int]:
+        removed: Dict[int, int] = {}
+        for name in self._shard_files():
+            with self._shard(name, create=False) as shard:
+                if shard is None:
+                    continue
+                counts = shard.execute(
+                    "SELECT project_id, count(*) FROM demo_data WHERE updated_at < ? GROUP BY project_id", (str(cutoff),)
+                ).fetchall()
+                if counts:
+                    shard.execute("DELETE FROM demo_data WHERE updated_at < ?", (str(cutoff),))
+            removed.update(counts)
+        return removed
+
+    def close(self):
+        with self._guard:
+            handles = list(self._pool.values())
+            self._pool.clear()
+        for handle in handles:
+            with handle.lock:
+                handle.connection.close()
+
+_store: Optional[DemoStore] = None
+_store_lock = threading.Lock()
+
+def get_store() -> DemoStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.DEMO_STORE_BACKEND == "sharded":
+                    _store = ShardedDemoStore(settings.DEMO_STORE_DIR, settings.DEMO_STORE_SHARDS, settings.DEMO_STORE_MAX_OPEN)
+                elif settings.DEMO_STORE_BACKEND == "table":
+                    _store = TableDemoStore()
+                else:
+                    raise ValueError(f"Unknown DEMO_STORE_BACKEND: {settings.DEMO_STORE_BACKEND}")
+                print(f"DEBUG: Demo data store: {_store.name}")
+    return _store
+
+def migrate_legacy() -> int:
+    store = get_store()
+    return store.migrate_legacy() if isinstance(store, ShardedDemoStore) else 0
@@ -0,0 +1,228 @@
+import hashlib
+import html
+import re
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, event, inspect, insert
+from sqlmodel import Session, select
+from app.core.config import settings
+from app.core.database import engine
+from app.models.models import ArtifactDigest, Project
+from app.services.html_pipeline import TRACE_ID_PATTERN
+from app.services.project_index import backfill_projects, field_changed
+
+# 提取规则变化时递增，旧摘要的 content_hash 随之全部失效
+DIGEST_VERSION = "1"
+DIGEST_FIELDS = ("requirements_doc", "product_doc", "tech_doc", "demo_code")
+# 补建时没有可摘要内容的项目写入一条空摘要作为标记，字段名为空，不会与任何文档对应
+EMPTY_MARKER = ""
+
+HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+LIST_ITEM = re.compile(r"^\s*(?:[-*+]|\d+[.)、])\s+(.+)$")
+TABLE_SEPARATOR = re.compile(r"^\|?\s*:?-{2,}")
+BOLD = re.compile(r"\*\*([^*\n]{1,40})\*\*")
+INLINE_CODE = re.compile(r"`([^`\n]{1,60})`")
+MARKUP = re.compile(r"[*_`>#]+")
+
+TITLE = re.compile(r"<title[^>]*>(.*?)</title>", re.I | re.S)
+HTML_HEADING = re.compile(r"<h([1-3])[^>]*>(.*?)</h\1>", re.I | re.S)
+BUTTON = re.compile(r"<button[^>]*>(.*?)</button>", re.I | re.S)
+DATA_KEY = re.compile(r"/data/([A-Za-z0-9_\-]+)")
+TAG = re.compile(r"<[^>]+>")
+SPACES = re.compile(r"\s+")
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(f"{DIGEST_VERSION}:{text}".encode("utf-8")).hexdigest()
+
+def _clip(text: str, limit: int) -> str:
+    text = SPACES.sub(" ", text).strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+def _unique(values, limit: int) -> List[str]:
+    return list(OrderedDict.fromkeys(v for v in values if v))[:limit]
+
+class _Section:
+    def __init__(self, heading: Optional[str]):
+        self.heading = heading
+        self.summary = ""
+        self.items: List[str] = []
+        self.omitted = 0
+        self.table: Optional[str] = None
+
+def _parse_markdown(text: str) -> Tuple[List[_Section], List[str]]:
+    """按标题切分章节，每节保留首段、前几条列表项和表头；同时收集加粗词、代码词和表格首列作为关键实体"""
+    sections = [_Section(None)]
+    entities: List[str] = []
+    lines = text.splitlines()
+    in_code = False
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            in_code = not in_code
+            continue
+        if in_code or not stripped:
+            continue
+        section = sections[-1]
+        heading = HEADING.match(stripped)
+        if heading:
+            sections.append(_Section(f"{heading.group(1)} {MARKUP.sub('', heading.group(2)).strip()}"))
+            continue
+        entities.extend(BOLD.findall(stripped))
+        entities.extend(INLINE_CODE.findall(stripped))
+        if stripped.startswith("|"):
+            cells = [c.strip() for c in stripped.strip("|").split("|")]
+            is_header = index + 1 < len(lines) and TABLE_SEPARATOR.match(lines[index + 1].strip())
+            if is_header and section.table is None:
+                section.table = " | ".join(MARKUP.sub("", c) for c in cells)
+            elif not is_header and not TABLE_SEPARATOR.match(stripped) and cells:
+                entities.append(MARKUP.sub("", cells[0]).strip())
+            continue
+        item = LIST_ITEM.match(line)
+        if item:
+            if len(section.items) < settings.DIGEST_SECTION_ITEMS:
+                section.items.append(_clip(MARKUP.sub("", item.group(1)), settings.DIGEST_SECTION_CHARS))
+            else:
+                section.omitted += 1
+            continue
+        if not section.summary:
+            section.summary = _clip(MARKUP.sub("", stripped), settings.DIGEST_SECTION_CHARS)
+    if sections[0].summary == "" and not sections[0].items and sections[0].table is None:
+        sections.pop(0)
+    return sections, _unique((_clip(e, 40) for e in entities), settings.DIGEST_MAX_ENTITIES)
+
+def _render_markdown(sections: List[_Section], entities: List[str], detail: int) -> str:
+    """detail: 2 = 标题 + 首段 + 列表项，1 = 标题 + 首段，0 = 仅标题"""
+    lines = []
+    for section in sections:
+        if section.heading:
+            lines.append(section.heading)
+        if detail >= 1 and section.summary:
+            lines.append(f"  {section.summary}")
+        if detail >= 1 and section.table:
+            lines.append(f"  表格：{section.table}")
+        if detail >= 2:
+            lines.extend(f"  - {item}" for item in section.items)
+            if section.omitted:
+                lines.append(f"  - （另有 {section.omitted} 项）")
+    if entities:
+        lines.append(f"关键词：{'、'.join(entities)}")
+    return "\n".join(lines)
+
+def markdown_digest(text: str) -> str:
+    """文档摘要：优先保留完整的章节结构，超出上限时依次去掉列表项、首段"""
+    sections, entities = _parse_markdown(text)
+    if not sections:
+        return _clip(text, settings.DIGEST_MAX_CHARS)
+    for detail in (2, 1, 0):
+        digest = _render_markdown(sections, entities, detail)
+        if len(digest) <= settings.DIGEST_MAX_CHARS:
+            return digest
+    return digest[:settings.DIGEST_MAX_CHARS]
+
+def _text(fragment: str) -> str:
+    return _clip(html.unescape(TAG.sub(" ", fragment)), 60)
+
+def demo_digest(code: str) -> str:
+    """原型摘要：页面标题、各级标题、按模块分组的 data-trace-id、操作按钮和持久化数据 Key"""
+    lines = []
+    title = TITLE.search(code)
+    if title and _text(title.group(1)):
+        lines.append(f"页面标题：{_text(title.group(1))}")
+    headings = _unique((f"{'#' * int(level)} {_text(body)}" for level, body in HTML_HEADING.findall(code) if _text(body)), 60)
+    if headings:
+        lines.append("页面结构：")
+        lines.extend(f"  {heading}" for heading in headings)
+    modules: Dict[str, List[str]] = OrderedDict()
+    for trace_id in _unique(TRACE_ID_PATTERN.findall(code), 1000):
+        modules.setdefault(trace_id.split("-")[0], []).append(trace_id)
+    if modules:
+        lines.append(f"功能模块（data-trace-id，共 {sum(len(ids) for ids in modules.values())} 个）：")
+        lines.extend(f"  - {module}：{', '.join(ids)}" for module, ids in modules.items())
+    buttons = _unique((_text(body) for body in BUTTON.findall(code)), 40)
+    if buttons:
+        lines.append(f"操作按钮：{'、'.join(buttons)}")
+    data_keys = _unique(DATA_KEY.findall(code), 30)
+    if data_keys:
+        lines.append(f"持久化数据：{', '.join(data_keys)}")
+    lines.append(f"代码规模：{len(code)} 字符")
+    return "\n".join(lines)[:settings.DIGEST_MAX_CHARS]
+
+def build_digest(field: str, text: str) -> str:
+    return demo_digest(text) if field == "demo_code" else markdown_digest(text)
+
+def _store(connection, project_id: int, field: str, text: Optional[str]) -> bool:
+    """在写入项目的同一事务中重建某个字段的摘要，返回是否写入了摘要"""
+    connection.execute(delete(ArtifactDigest).where(
+        ArtifactDigest.project_id == project_id, ArtifactDigest.field == field
+    ))
+    if not text:
+        return False
+    connection.execute(insert(ArtifactDigest).values(
+        project_id=project_id, field=field, content_hash=content_hash(text),
+        digest=build_digest(field, text), source_chars=len(text), updated_at=datetime.utcnow(),
+    ))
+    return True
+
+@event.listens_for(Project, "after_insert")
+def _on_insert(mapper, connection, target):
+    for field in DIGEST_FIELDS:
+        if getattr(target, field):
+            _store(connection, target.id, field, getattr(target, field))
+
+@event.listens_for(Project, "after_update")
+def _on_update(mapper, connection, target):
+    state = inspect(target)
+    for field in DIGEST_FIELDS:
+        if field_changed(state, field):
+            _store(connection, target.id, field, getattr(target, field))
+
+@event.listens_for(Project, "after_delete")
+def _on_delete(mapper, connection, target):
+    connection.execute(delete(ArtifactDigest).where(ArtifactDigest.project_id == target.id))
+
+def digest_documents(docs: Dict[str, Optional[str]], project_id: Optional[int] = None, user_id: Optional[int] = None) -> Tuple[Dict[str, str], dict]:
+    """
+    返回各文档的摘要与统计。请求中的文档与项目已保存的版本一致（内容哈希相同）时直接使用预先生成的摘要，
+    否则（未保存的修改、未关联项目）当场提取，提取是纯文本扫描，不调用模型。
+    """
+    stored: Dict[str, ArtifactDigest] = {}
+    if project_id:
+        with Session(engine) as session:
+            project = session.get(Project, project_id)
+            if project and project.user_id == user_id:
+                stored = {row.field: row for row in session.exec(
+                    select(ArtifactDigest).where(ArtifactDigest.project_id == project_id)
+                ).all()}
+    digests = {}
+    stats = {"source_chars": 0, "digest_chars": 0, "stored": 0}
+    for field, text in docs.items():
+        if not text:
+            digests[field] = ""
+            continue
+        row = stored.get(field)
+        if row is not None and row.content_hash == content_hash(text):
+            digests[field] = row.digest
+            stats["stored"] += 1
+        else:
+            digests[field] = build_digest(field, text)
+        stats["source_chars"] += len(text)
+        stats["digest_chars"] += len(digests[field])
+    return digests, stats
+
+def _store_project(connection, project: Project) -> bool:
+    stored = False
+    for field in DIGEST_FIELDS:
+        if getattr(project, field):
+            stored = _store(connection, project.id, field, getattr(project, field)) or stored
+    return stored
+
+def _mark_empty(connection, project: Project):
+    connection.execute(insert(ArtifactDigest).values(
+        project_id=project.id, field=EMPTY_MARKER, content_hash="", digest="", source_chars=0,
+        updated_at=datetime.utcnow(),
+    ))
+
+def backfill(limit: Optional[int] = None) -> int:
+    """为尚未生成摘要的历史项目补建（由后台维护任务分批执行），返回处理的项目数"""
+    return backfill_projects(select(ArtifactDigest.project_id), DIGEST_FIELDS, _store_project, _mark_empty, limit)
@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+from typing import AsyncGenerator, Dict, List, Optional, Union
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+from app.core.auth import charge_license, check_license, token_expires_at, user_from_token
+from app.core.config import settings
+from app.core.database import engine
+from app.core.shared_state import get_shared_state
+from app.models.models import Project, User
+from app.services import chat_history
+from app.services.generations import Generation, generation_registry
+from app.services.html_pipeline import extract_elements, extract_trace_ids, process_html_stream
+from app.services.llm_service import LLMError, llm_service
+from app.services.pipeline import build_partial_edit_messages
+from app.core.prompt_builder import build_prompt
+from app.services.streaming import StreamEvent, watch_remote_cancel
+
+# 应用层关闭码（4000-4999）
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_LICENSE = 4402
+CLOSE_NOT_FOUND = 4404
+CLOSE_IDLE = 4408
+
+def code_hash(code: str) -> str:
+    return hashlib.sha1(code.encode("utf-8")).hexdigest()
+
+def _authenticate(token: Optional[str], project_id: int) -> dict:
+    """认证、License 校验与加载项目代码，整个会话只做一次"""
+    with Session(engine) as session:
+        user = user_from_token(session, token)
+        if user is None:
+            return {"close": CLOSE_UNAUTHORIZED, "message": "登录会话已过期，请重新登录"}
+        license_id = None
+        if not user.is_admin:
+            try:
+                license_id = check_license(session, user).id
+            except HTTPException as e:
+                return {"close": CLOSE_LICENSE, "message": e.detail}
+        project = session.get(Project, project_id)
+        if not project or project.user_id != user.id:
+            return {"close": CLOSE_NOT_FOUND, "message": "项目不存在"}
+        return {
+            "user": user, "license_id": license_id, "code": project.demo_code or "",
+            "expires_at": token_expires_at(token),
+        }
+
+def _charge(license_id: Optional[int]) -> bool:
+    if license_id is None:
+        return True
+    with Session(engine) as session:
+        return charge_license(session, license_id)
+
+def _save_code(project_id: int, user_id: int, code: str):
+    with Session(engine) as session:
+        project = session.get(Project, project_id)
+        if not project or project.user_id != user_id:
+            return
+        project.demo_code = code
+        project.updated_at = datetime.utcnow()
+        session.add(project)
+        session.commit()
+
+class EditSession:
+    """
+    一个项目的原型编辑会话：服务端持有当前代码，客户端每次只发送修改意见与选中元素的 data-trace-id，
+    选中元素的 HTML 由服务端从自己持有的代码中取出。每次修改完成后更新并保存服务端的代码副本。
+
+    客户端消息：auth / sync（整体替换代码，例如手工编辑后）/ edit / cancel / ping
+    服务端消息：ready / synced / start / token / html_report / done / cancelled / error / pong
+    """
+
+    def __init__(self, websocket: WebSocket, project_id: int):
+        self.websocket = websocket
+        self.project_id = project_id
+        self.user: Optional[User] = None
+        self.license_id: Optional[int] = None
+        # 登录令牌的过期时间：会话只在建立时认证一次，到期后关闭连接，客户端需用新令牌重连
+        self.expires_at: Optional[float] = None
+        self.code = ""
+        self.generation: Optional[Generation] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def send(self, message: dict):
+        try:
+            await self.websocket.send_json(message)
+        except (WebSocketDisconnect, RuntimeError):
+            # 客户端已断开：生成由主循环负责停止
+            pass
+
+    def _state(self) -> dict:
+        return {"hash": code_hash(self.code), "chars": len(self.code), "trace_ids": len(extract_trace_ids(self.code))}
+
+    async def open(self) -> bool:
+        try:
+            message = await asyncio.wait_for(self.websocket.receive_json(), settings.EDIT_SESSION_AUTH_TIMEOUT)
+        except WebSocketDisconnect:
+            return False
+        except (asyncio.TimeoutError, ValueError):
+            await self.websocket.close(code=CLOSE_UNAUTHORIZED)
+            return False
+        token = message.get("token") if isinstance(message, dict) and message.get("type") == "auth" else None
+        result = await run_in_threadpool(_authenticate, token, self.project_id)
+        if "close" in result:
+            await self.send({"type": "error", "message": result["message"]})
+            await self.websocket.close(code=result["close"])
+            return False
+        self.user, self.license_id, self.code = result["user"], result["license_id"], result["code"]
+        self.expires_at = result["expires_at"]
+        print(f"DEBUG: Edit session opened for user {self.user.id}, project {self.project_id}")
+        await self.send({"type": "ready", **self._state()})
+        return True
+
+    def _remaining(self) -> Optional[float]:
+        return None if self.expires_at is None else self.expires_at - time.time()
+
+    async def _expire(self):
+        await self.send({"type": "error", "message": "登录会话已过期，请重新登录"})
+        await self.websocket.close(code=CLOSE_UNAUTHORIZED)
+
+    async def run(self):
+        try:
+            while True:
+                timeout = settings.EDIT_SESSION_IDLE_SECONDS
+                remaining = self._remaining()
+                if remaining is not None:
+                    if remaining <= 0:
+                        await self._expire()
+                        return
+                    timeout = min(timeout, remaining)
+                try:
+                    message = await asyncio.wait_for(self.websocket.receive_json(), timeout)
+                except asyncio.TimeoutError:
+                    remaining = self._remaining()
+                    if remaining is not None and remaining <= 0:
+                        # 进行中的修改随断开停止（见 finally）
+                        await self._expire()
+                        return
+                    if self.task is not None:
+                        continue
+                    await self.websocket.close(code=CLOSE_IDLE)
+                    return
+                except ValueError:
+                    await self.send({"type": "error", "message": "消息不是合法的 JSON"})
+                    continue
+                if not isinstance(message, dict):
+                    await self.send({"type": "error", "message": "消息格式错误"})
+                    continue
+                await self.handle(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if self.generation is not None:
+                self.generation.request_stop("disconnected")
+            if self.task is not None:
+                await asyncio.wait({self.task})
+
+    async def handle(self, message: dict):
+        kind = message.get("type")
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "cancel":
+            if self.generation is not None:
+                self.generation.request_stop("cancelled")
+        elif kind == "sync":
+            code = message.get("code")
+            if not isinstance(code, str) or len(code) > settings.EDIT_SESSION_MAX_CODE_CHARS:
+                await self.send({"type": "error", "message": "代码为空或过大"})
+                return
+            if self.task is not None:
+                await self.send({"type": "error", "message": "正在修改中，请稍后再同步"})
+                return
+            self.code = code
+            await self.send({"type": "synced", **self._state()})
+        elif kind == "edit":
+            await self.start_edit(message)
+        else:
+            await self.send({"type": "error", "message": f"未知的消息类型: {kind}"})
+
+    def _selected(self, message: dict) -> List[Dict[str, Optional[str]]]:
+        """选中元素：有 data-trace-id 的从服务端代码中取 HTML，没有的才使用客户端附带的片段"""
+        elements = []
+        snippets = extract_elements(self.code, [tid for tid in message.get("trace_ids") or [] if isinstance(tid, str)])
+        for trace_id, html in snippets.items():
+            elements.append({"traceId": trace_id, "selector": None, "html": html})
+        for el in message.get("elements") or []:
+            if isinstance(el, dict) and el.get("html") and el.get("traceId") not in snippets:
+                elements.append({"traceId": el.get("traceId"), "selector": el.get("selector"), "html": el["html"]})
+        return elements
+
+    async def start_edit(self, message: dict):
+        feedback = message.get("feedback")
+        if not isinstance(feedback, str) or not feedback.strip():
+            await self.send({"type": "error", "message": "修改意见不能为空"})
+            return
+        if not self.code:
+            await self.send({"type": "error", "message": "项目还没有原型代码"})
+            return
+        if self.task is not None:
+            await self.send({"type": "error", "message": "上一次修改尚未完成"})
+            return
+        elements = self._selected(message)
+        if (message.get("trace_ids") or message.get("elements")) and not elements:
+            await self.send({"type": "error", "message": "选中的元素在当前代码中不存在，请重新选择"})
+            return
+        if not await run_in_threadpool(_charge, self.license_id):
+            await self.send({"type": "error", "message": "授权无效或额度已耗尽", "code": "license"})
+            return
+        model = message.get("model")
+        if elements:
+            stage = "partial_edit"
+            messages, prompt_stats = build_partial_edit_messages(self.code, elements, feedback)
+        else:
+            stage = "iterate"
+            conversation = await run_in_threadpool(chat_history.conversation_context, self.project_id, self.user.id)
+            messages, prompt_stats = build_prompt(
+                "iterate", conversation=conversation, current_code=self.code, user_feedback=feedback
+            )
+        prompt_stats["edit_session"] = True
+        source = process_html_stream(llm_service.chat_completion_stream(messages, model=model), original_code=self.code)
+        self.generation = generation_registry.start(self.user.id, stage, prompt_stats)
+        self.task = asyncio.ensure_future(self._stream(self.generation, source))
+
+    async def _stream(self, generation: Generation, source: AsyncGenerator[Union[str, StreamEvent], None]):
+        """转发一次修改的输出；取消（cancel 消息、取消接口）或断开时立即关闭上游流"""
+        stopped = asyncio.ensure_future(generation.stopped.wait())
+        # 多 worker 时取消接口可能由其他进程受理，与 HTTP 流式接口一样轮询共享状态中的取消标记
+        watcher = asyncio.ensure_future(watch_remote_cancel(generation)) if get_shared_state().shared else None
+        parts: List[str] = []
+        report: Optional[dict] = None
+        try:
+            await self.send({"type": "start", "generation_id": generation.id, "prompt": generation.prompt_stats})
+            while True:
+                step = asyncio.ensure_future(source.__anext__())
+                await asyncio.wait({step, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                if not step.done():
+                    step.cancel()
+                    await asyncio.wait({step})
+                    break
+                try:
+                    chunk = step.result()
+                except StopAsyncIteration:
+                    generation_registry.finish(generation, "completed")
+                    break
+                if isinstance(chunk, StreamEvent):
+                    if chunk.event == "html_report":
+                        report = chunk.data
+                    await self.send({"type": chunk.event, "data": chunk.data})
+                elif chunk:
+                    parts.append(chunk)
+                    generation.record(chunk)
+                    generation_registry.sync(generation)
+                    await self.send({"type": "token", "content": chunk})
+        except LLMError as e:
+            print(f"DEBUG: Edit session stream aborted: {e.message}")
+            generation_registry.finish(generation, "failed", e.message)
+            await self.send({"type": "error", **e.to_dict()})
+        except Exception as e:
+            print(f"ERROR in edit session: {e}")
+            generation_registry.finish(generation, "failed", str(e))
+            await self.send({"type": "error", "message": str(e)})
+        finally:
+            stopped.cancel()
+            if watcher is not None:
+                watcher.cancel()
+            await source.aclose()
+            generation_registry.finish(generation, generation.stop_reason or "disconnected")
+            self.generation = None
+            self.task = None
+
+        if generation.status == "cancelled":
+            await self.send({"type": "cancelled", "generation": generation.snapshot()})
+        elif generation.status == "completed":
+            code = "".join(parts)
+            saved = bool(code) and (report is None or report.get("valid", True))
+            if saved:
+                # 只有完整有效的结果才替换服务端副本并保存，失败的修改不影响下一次
+                self.code = code
+                await run_in_threadpool(_save_code, self.project_id, self.user.id, code)
+            await self.send({"type": "done", "generation": generation.snapshot(), "saved": saved, **self._state()})
@@ -0,0 +1,248 @@
+import gzip
+import hashlib
+import importlib.util
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from typing import AsyncIterator, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.staticfiles import StaticFiles
+from app.core.config import settings
+
+# brotli 为可选依赖，缺失时只提供 gzip；启动时只检查是否安装，首次压缩时才导入
+HAS_BROTLI = importlib.util.find_spec("brotli") is not None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript", "application/xml",
+    "application/xhtml+xml", "image/svg+xml", "application/x-javascript",
+)
+
+# Vite 构建产物形如 assets/index-3f9a1c2b.js，文件名带内容哈希，可以永久缓存
+HASHED_ASSET = re.compile(r"(^|/)assets/.+[-.][A-Za-z0-9_-]{8,}\.\w+$")
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# 预压缩副本在独立的后台线程中生成（brotli 最高质量压缩大文件要数秒），不占用请求线程池
+_compress_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="compress")
+_building = set()
+_building_lock = threading.Lock()
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    return bool(media_type) and media_type.startswith(COMPRESSIBLE_TYPES)
+
+def negotiate_encoding(request: Request) -> Optional[str]:
+    accepted = request.headers.get("accept-encoding", "")
+    encodings = {part.split(";")[0].strip() for part in accepted.split(",")}
+    if HAS_BROTLI and "br" in encodings:
+        return "br"
+    if "gzip" in encodings:
+        return "gzip"
+    return None
+
+def _compress_file(path: str, encoding: str, target: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    if encoding == "br":
+        import brotli
+        data = brotli.compress(data, quality=settings.BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=9, mtime=0)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # 同一进程的多个线程也可能同时生成同一副本，临时文件名必须唯一
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+def _build_variant(path: str, encoding: str, target: str):
+    try:
+        _compress_file(path, encoding, target)
+    except Exception as e:
+        print(f"DEBUG: Failed to compress {path} ({encoding}): {e}")
+    finally:
+        with _building_lock:
+            _building.discard(target)
+
+def _variant_exists(target: str) -> bool:
+    return os.path.exists(target)
+
+async def compressed_variant(path: str, size: int, mtime: float, encoding: str) -> Optional[str]:
+    """
+    返回预压缩副本路径；副本还不存在时提交后台生成并返回 None，本次由调用方返回未压缩的原文件。
+    副本缓存到 COMPRESSED_CACHE_DIR，缓存 Key 包含路径、大小和修改时间，源文件变化后自动换新。
+    """
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{size}|{mtime}".encode("utf-8")).hexdigest()
+    target = os.path.join(settings.COMPRESSED_CACHE_DIR, key[:2], f"{key}.{'br' if encoding == 'br' else 'gz'}")
+    if await run_in_threadpool(_variant_exists, target):
+        return target
+    with _building_lock:
+        if target in _building:
+            return None
+        _building.add(target)
+    _compress_executor.submit(_build_variant, path, encoding, target)
+    return None
+
+ENCODING_SUFFIX = re.compile(r'-(gzip|br)"$')
+
+def variant_etag(etag: str, encoding: str) -> str:
+    """不同编码是不同的表示，ETag 需要区分"""
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match 使用弱比较，并忽略压缩副本的编码后缀"""
+    if header.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if ENCODING_SUFFIX.sub('"', candidate) == bare:
+            return True
+    return False
+
+def is_not_modified(request: Request, etag: str, mtime: Optional[float]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """只支持单个区间；返回闭区间 (start, end)，无法满足时抛 ValueError"""
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None  # 多区间或格式不识别：按完整内容返回
+    start, end = match.groups()
+    if start == "":
+        if end == "":
+            return None
+        length = int(end)
+        if length == 0:
+            raise ValueError("unsatisfiable")
+        start, end = max(0, size - length), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("unsatisfiable")
+    return start, end
+
+def _read_range(path: str, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+async def _iter_range(path: str, start: int, end: int) -> AsyncIterator[bytes]:
+    position = start
+    while position <= end:
+        length = min(settings.UPLOAD_CHUNK_BYTES, end - position + 1)
+        data = await run_in_threadpool(_read_range, path, position, length)
+        if not data:
+            return
+        position += len(data)
+        yield data
+
+async def serve_file(
+    request: Request,
+    path: str,
+    media_type: str,
+    etag: str,
+    size: int,
+    mtime: float,
+    cache_control: str,
+    filename: Optional[str] = None
+) -> Response:
+    """带条件请求、Range 和预压缩副本的文件响应"""
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+    }
+    if is_not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() in (etag, headers["Last-Modified"])):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            headers.update({
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(end - start + 1),
+            })
+            return StreamingResponse(_iter_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+    encoding = negotiate_encoding(request) if is_compressible(media_type) else None
+    if encoding and size >= settings.COMPRESS_MIN_BYTES and not range_header:
+        variant = await compressed_variant(path, size, mtime, encoding)
+        if variant:
+            headers["Content-Encoding"] = encoding
+            headers["ETag"] = variant_etag(etag, encoding)
+            return FileResponse(variant, media_type=media_type, headers=headers, filename=filename, content_disposition_type="inline")
+
+    return FileResponse(path, media_type=media_type, headers=headers, filename=filename, content_disposition_type="inline")
+
+class CachedStaticFiles(StaticFiles):
+    """
+    前端构建产物：带哈希的 assets 永久缓存，其余（index.html 等）每次协商缓存；
+    文本资源按 Accept-Encoding 返回预压缩副本。
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        cache_control = IMMUTABLE if HASHED_ASSET.search(path) else REVALIDATE
+        response.headers["Cache-Control"] = cache_control
+        if not isinstance(response, FileResponse) or response.status_code != 200 or response.stat_result is None:
+            return response
+
+        request = Request(scope)
+        encoding = negotiate_encoding(request) if is_compressible(response.media_type) else None
+        stat_result = response.stat_result
+        if not encoding or stat_result.st_size < settings.COMPRESS_MIN_BYTES or request.headers.get("range"):
+            response.headers["Vary"] = "Accept-Encoding"
+            return response
+
+        etag = response.headers.get("etag", "")
+        headers = {
+            "Cache-Control": cache_control,
+            "Content-Encoding": encoding,
+            "Vary": "Accept-Encoding",
+            "Last-Modified": response.headers.get("last-modified", formatdate(stat_result.st_mtime, usegmt=True)),
+            "ETag": variant_etag(etag, encoding),
+        }
+        # StaticFiles 只认识原始 ETag，压缩副本的协商缓存在这里处理
+        if etag and is_not_modified(request, etag, stat_result.st_mtime):
+            return Response(status_code=304, headers=headers)
+        variant = await compressed_variant(str(response.path), stat_result.st_size, stat_result.st_mtime, encoding)
+        if not variant:
+            # 副本生成中：先返回原文件
+            response.headers["Vary"] = "Accept-Encoding"
+            return response
+        return FileResponse(variant, media_type=response.media_type, headers=headers)
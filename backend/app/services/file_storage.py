@@ -0,0 +1,167 @@
+import hashlib
+import os
+import uuid
+from typing import AsyncIterator, BinaryIO, Optional, Tuple
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+
+def blob_dir() -> str:
+    return os.path.join(settings.UPLOAD_DIR, "blobs")
+
+def tmp_dir() -> str:
+    return os.path.join(settings.UPLOAD_DIR, "tmp")
+
+def blob_path(digest: str) -> str:
+    """按内容哈希寻址：uploads/blobs/ab/cd/abcd..."""
+    return os.path.join(blob_dir(), digest[:2], digest[2:4], digest)
+
+def session_path(upload_id: str) -> str:
+    return os.path.join(tmp_dir(), f"{upload_id}.part")
+
+def _open_for_append(path: str) -> BinaryIO:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, "ab")
+
+def _open_at(path: str, offset: int) -> BinaryIO:
+    """打开（不存在则创建）文件并定位到 offset，不截断已有内容"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    f = os.fdopen(fd, "wb")
+    f.seek(offset)
+    return f
+
+def _truncate(path: str, size: int):
+    with open(path, "r+b") as f:
+        f.truncate(size)
+
+def _write(f: BinaryIO, data: bytes, hasher: Optional["hashlib._Hash"]):
+    f.write(data)
+    if hasher is not None:
+        hasher.update(data)
+
+def _hash_file(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(settings.UPLOAD_CHUNK_BYTES), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _commit_blob(tmp_path: str, digest: str) -> Tuple[str, bool]:
+    """把临时文件放到内容地址下；已存在相同内容时直接丢弃临时文件"""
+    target = blob_path(digest)
+    if os.path.exists(target):
+        os.remove(tmp_path)
+        # 刷新修改时间：后台清理只删除超过保护期的文件，新引用写入数据库前不会被回收
+        os.utime(target)
+        return target, True
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(tmp_path, target)
+    return target, False
+
+def _too_large(limit: Optional[int] = None):
+    return HTTPException(
+        status_code=413,
+        detail=f"文件超过大小限制（{(limit or settings.UPLOAD_MAX_BYTES) // (1024 * 1024)} MB）"
+    )
+
+async def _copy_stream(
+    f: BinaryIO,
+    chunks: AsyncIterator[bytes],
+    size: int,
+    hasher: Optional["hashlib._Hash"],
+    limit: int
+) -> int:
+    buffer = bytearray()
+    try:
+        async for data in chunks:
+            if not data:
+                continue
+            size += len(data)
+            if size > limit:
+                raise _too_large(limit)
+            buffer += data
+            if len(buffer) >= settings.UPLOAD_CHUNK_BYTES:
+                await run_in_threadpool(_write, f, bytes(buffer), hasher)
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(_write, f, bytes(buffer), hasher)
+    finally:
+        await run_in_threadpool(f.close)
+    return size
+
+async def append_stream(
+    path: str,
+    chunks: AsyncIterator[bytes],
+    already: int = 0,
+    hasher: Optional["hashlib._Hash"] = None,
+    limit: Optional[int] = None
+) -> int:
+    """
+    把异步字节流追加写入文件，磁盘 IO 全部放到线程池，不阻塞事件循环。
+    小片段先在内存中攒到 UPLOAD_CHUNK_BYTES 再写；超过大小上限（默认 UPLOAD_MAX_BYTES）立即中止。
+    返回写入后的文件总字节数。
+    """
+    f = await run_in_threadpool(_open_for_append, path)
+    return await _copy_stream(f, chunks, already, hasher, limit or settings.UPLOAD_MAX_BYTES)
+
+async def write_stream_at(path: str, chunks: AsyncIterator[bytes], offset: int, limit: int) -> int:
+    """
+    从 offset 处写入异步字节流（定位写而不是追加）：同一偏移量的重复或并发请求覆盖同一段数据，
+    不会交错追加；写入末尾超过 limit 时在写盘前中止。返回本次写入的末尾位置。
+    """
+    f = await run_in_threadpool(_open_at, path, offset)
+    return await _copy_stream(f, chunks, offset, None, limit)
+
+async def _upload_chunks(upload) -> AsyncIterator[bytes]:
+    while True:
+        data = await upload.read(settings.UPLOAD_CHUNK_BYTES)
+        if not data:
+            return
+        yield data
+
+async def store_upload(upload) -> Tuple[str, str, int, bool]:
+    """
+    保存一个 UploadFile，返回 (content_hash, file_path, size, deduplicated)。
+    写入时同步计算 SHA-256，内容相同的文件只保存一份。
+    """
+    tmp_path = os.path.join(tmp_dir(), f"{uuid.uuid4().hex}.upload")
+    hasher = hashlib.sha256()
+    try:
+        size = await append_stream(tmp_path, _upload_chunks(upload), hasher=hasher)
+    except BaseException:
+        await run_in_threadpool(_remove_quietly, tmp_path)
+        raise
+    digest = hasher.hexdigest()
+    path, deduplicated = await run_in_threadpool(_commit_blob, tmp_path, digest)
+    return digest, path, size, deduplicated
+
+async def finalize_session(upload_id: str) -> Tuple[str, str, bool]:
+    """分片上传完成：计算哈希并归档到内容地址，返回 (content_hash, file_path, deduplicated)"""
+    tmp_path = session_path(upload_id)
+    digest = await run_in_threadpool(_hash_file, tmp_path)
+    path, deduplicated = await run_in_threadpool(_commit_blob, tmp_path, digest)
+    return digest, path, deduplicated
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def discard_file(path: str):
+    await run_in_threadpool(_remove_quietly, path)
+
+async def truncate_session(upload_id: str, size: int):
+    """把分片文件截回 size 字节（丢弃超出声明大小的部分）"""
+    await run_in_threadpool(_truncate, session_path(upload_id), size)
+
+async def discard_session(upload_id: str):
+    await discard_file(session_path(upload_id))
+
+def session_size(upload_id: str) -> int:
+    """以磁盘上的实际字节数为准（进程在写入中途退出时数据库记录可能落后）"""
+    try:
+        return os.path.getsize(session_path(upload_id))
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional
+from app.core.config import settings
+from app.core.shared_state import get_shared_state
+
+# 已结束生成的快照在共享状态中保留的时间
+SNAPSHOT_TTL = 3600
+
+# 共享状态的写入（sqlite/redis 均为同步 I/O）交给单个后台线程按提交顺序执行：
+# 不阻塞事件循环，结束时写入的最终快照也不会被之前排队的写入覆盖
+_sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation-sync")
+
+class Generation:
+    """一次进行中的流式生成，可被客户端断开或取消接口提前终止"""
+
+    def __init__(self, user_id: int, stage: str, prompt_stats: Optional[dict] = None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.stage = stage
+        self.prompt_stats = prompt_stats
+        self.status = "running"
+        self.chunks: List[str] = []
+        self.chars = 0
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.stop_reason: Optional[str] = None
+        self.stopped = asyncio.Event()
+        self.synced_at = 0.0
+        # 已提交、尚未写入共享状态的快照
+        self.sync_pending = False
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+    def record(self, chunk: str):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.chunks.append(chunk)
+        self.chars += len(chunk)
+
+    def request_stop(self, reason: str):
+        """reason: cancelled（调用取消接口）或 disconnected（客户端断开）"""
+        if self.running and not self.stopped.is_set():
+            self.stop_reason = reason
+            self.stopped.set()
+
+    @property
+    def output(self) -> str:
+        return "".join(self.chunks)
+
+    def tail(self, limit: int) -> str:
+        """最近 limit 个字符的输出，只拼接末尾的片段"""
+        parts = []
+        size = 0
+        for chunk in reversed(self.chunks):
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= limit:
+                break
+        return "".join(reversed(parts))[-limit:] if limit > 0 else ""
+
+    def snapshot(self, include_output: bool = False) -> dict:
+        end = self.finished_at or time.monotonic()
+        data = {
+            "generation_id": self.id,
+            "stage": self.stage,
+            "status": self.status,
+            "chars": self.chars,
+            "duration_ms": round((end - self.started_at) * 1000),
+            "ttft_ms": round((self.first_token_at - self.started_at) * 1000) if self.first_token_at else None,
+            "error": self.error,
+            "prompt": self.prompt_stats,
+        }
+        if include_output:
+            data["output"] = self.output
+        return data
+
+class GenerationRegistry:
+    """
+    进行中生成的登记表，并汇总取消/断开等指标。
+    多 worker 部署时，查询/取消请求可能落到其他进程：生成快照和取消标记经共享状态同步，
+    由执行生成的进程定期写快照、检查取消标记。运行中的快照只带输出的末尾部分（output_truncated），
+    结束时写入完整输出。
+    """
+
+    def __init__(self):
+        self.active: Dict[str, Generation] = {}
+        self.recent: Deque[Generation] = deque(maxlen=settings.GENERATION_HISTORY_SIZE)
+        self.metrics = {
+            "started": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "disconnected": 0,
+            # 被提前终止的生成已经输出的字符数（已付费但未被使用的部分）
+            "partial_chars": 0,
+        }
+
+    @staticmethod
+    def _submit(func: Callable, *args):
+        def run():
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"DEBUG: Generation state sync failed: {e}")
+        _sync_executor.submit(run)
+
+    def _count(self, name: str, amount: int = 1):
+        self.metrics[name] += amount
+        state = get_shared_state()
+        if state.shared:
+            self._submit(state.incr, f"generations:metrics:{name}", amount)
+
+    def start(self, user_id: int, stage: str, prompt_stats: Optional[dict] = None) -> Generation:
+        generation = Generation(user_id, stage, prompt_stats)
+        self.active[generation.id] = generation
+        self._count("started")
+        self.sync(generation, force=True)
+        return generation
+
+    def finish(self, generation: Generation, status: str, error: Optional[str] = None):
+        if not generation.running:
+            return
+        generation.status = status
+        generation.error = error
+        generation.finished_at = time.monotonic()
+        self.active.pop(generation.id, None)
+        self.recent.append(generation)
+        self._count(status)
+        if status in ("cancelled", "disconnected"):
+            self._count("partial_chars", generation.chars)
+            print(f"DEBUG: Generation {generation.id} ({generation.stage}) {status} after {generation.chars} chars")
+        self.sync(generation, force=True)
+
+    def sync(self, generation: Generation, force: bool = False):
+        """
+        把快照写入共享状态（在后台线程中执行）；运行中按 GENERATION_SYNC_INTERVAL 节流，
+        只带最近 GENERATION_SYNC_TAIL_CHARS 个字符的输出，上一次写入未完成时跳过
+        """
+        state = get_shared_state()
+        if not state.shared:
+            return
+        now = time.monotonic()
+        if not force and (generation.sync_pending or now - generation.synced_at < settings.GENERATION_SYNC_INTERVAL):
+            return
+        generation.synced_at = now
+        snapshot = {**generation.snapshot(), "user_id": generation.user_id}
+        if generation.running:
+            snapshot["output"] = generation.tail(settings.GENERATION_SYNC_TAIL_CHARS)
+            snapshot["output_truncated"] = generation.chars > len(snapshot["output"])
+        else:
+            snapshot["output"] = generation.output
+        generation.sync_pending = True
+        self._submit(self._write_snapshot, state, generation, snapshot)
+
+    @staticmethod
+    def _write_snapshot(state, generation: Generation, snapshot: dict):
+        try:
+            state.set(f"generation:{generation.id}", json.dumps(snapshot, ensure_ascii=False), ttl=SNAPSHOT_TTL)
+        finally:
+            generation.sync_pending = False
+
+    def get(self, generation_id: str) -> Optional[Generation]:
+        if generation_id in self.active:
+            return self.active[generation_id]
+        for generation in self.recent:
+            if generation.id == generation_id:
+                return generation
+        return None
+
+    def lookup(self, generation_id: str) -> Optional[dict]:
+        """返回生成快照（含 user_id 和部分输出），本进程没有时查共享状态"""
+        generation = self.get(generation_id)
+        if generation:
+            return {**generation.snapshot(include_output=True), "user_id": generation.user_id}
+        state = get_shared_state()
+        if state.shared:
+            raw = state.get(f"generation:{generation_id}")
+            if raw:
+                return json.loads(raw)
+        return None
+
+    def cancel(self, generation_id: str, user_id: int) -> Optional[dict]:
+        generation = self.active.get(generation_id)
+        if generation:
+            if generation.user_id != user_id:
+                return None
+            generation.request_stop("cancelled")
+            return generation.snapshot()
+        # 生成可能在其他 worker 上运行：写入取消标记，由该进程检查后终止
+        snapshot = self.lookup(generation_id)
+        if not snapshot or snapshot.get("user_id") != user_id or snapshot["status"] != "running":
+            return None
+        get_shared_state().set(f"generation:{generation_id}:cancel", "1", ttl=SNAPSHOT_TTL)
+        return snapshot
+
+    def cancel_requested(self, generation_id: str) -> bool:
+        return get_shared_state().get(f"generation:{generation_id}:cancel") is not None
+
+    def summary(self) -> dict:
+        state = get_shared_state()
+        if not state.shared:
+            return {**self.metrics, "active": len(self.active)}
+        # 汇总所有 worker 的计数
+        totals = {name: int(state.get(f"generations:metrics:{name}") or 0) for name in self.metrics}
+        ended = sum(totals[name] for name in ("completed", "failed", "cancelled", "disconnected"))
+        return {**totals, "active": max(0, totals["started"] - ended), "active_in_process": len(self.active)}
+
+generation_registry = GenerationRegistry()
@@ -0,0 +1,327 @@
+import re
+from html.parser import HTMLParser
+from typing import AsyncGenerator, Dict, List, Optional, Set, Tuple, Union
+from app.services.streaming import StreamEvent
+
+FENCE = "```"
+
+# 无需闭合的空元素
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "param", "source", "track", "wbr",
+}
+
+# 结束标签可省略的元素：浏览器会隐式闭合，补全时不追加（多余的 </p> 反而会生成空段落）
+OPTIONAL_END_ELEMENTS = {
+    "p", "li", "dt", "dd", "td", "th", "tr", "thead", "tbody", "tfoot",
+    "option", "optgroup", "colgroup", "rt", "rp",
+}
+
+# 开始标签会隐式结束的前一个同级元素
+IMPLIED_END_SIBLINGS = {
+    "li": {"li"}, "p": {"p"}, "dt": {"dt", "dd"}, "dd": {"dt", "dd"},
+    "tr": {"tr"}, "td": {"td", "th"}, "th": {"td", "th"}, "option": {"option"},
+}
+
+# 解析器喂入批量大小：标签跟踪不需要逐 Token 实时，批量喂入避免在长 <script> 内反复扫描
+PARSE_BATCH_CHARS = 1024
+
+TRACE_ID_PATTERN = re.compile(r'data-trace-id\s*=\s*["\']([^"\']+)["\']')
+PARTIAL_TAG_PATTERN = re.compile(r"<([a-zA-Z][a-zA-Z0-9-]*)([^<>]*)$", re.S)
+
+def extract_trace_ids(html: str) -> Set[str]:
+    return set(TRACE_ID_PATTERN.findall(html or ""))
+
+class _TagTracker(HTMLParser):
+    """增量跟踪标签平衡与 data-trace-id"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack: List[str] = []
+        self.stray_end_tags: List[str] = []
+        self.trace_ids: Dict[str, int] = {}
+
+    def _collect(self, attrs):
+        for name, value in attrs:
+            if name == "data-trace-id" and value:
+                self.trace_ids[value] = self.trace_ids.get(value, 0) + 1
+
+    def handle_starttag(self, tag, attrs):
+        self._collect(attrs)
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._collect(attrs)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS:
+            return
+        if tag in self.stack:
+            # 与浏览器一致：隐式闭合中间未闭合的元素（如 <p>、<li>）
+            while self.stack and self.stack.pop() != tag:
+                pass
+        else:
+            self.stray_end_tags.append(tag)
+
+class _ElementLocator(HTMLParser):
+    """定位带指定 data-trace-id 的元素在源码中的起止位置（含子元素的完整外层 HTML）"""
+
+    def __init__(self, html: str, trace_ids: Set[str]):
+        super().__init__(convert_charrefs=False)
+        self.html = html
+        self.targets = trace_ids
+        self.line_starts = [0]
+        for line in html.splitlines(keepends=True):
+            self.line_starts.append(self.line_starts[-1] + len(line))
+        self.stack: List[Tuple[str, Optional[str], int]] = []
+        self.found: Dict[str, Tuple[int, int]] = {}
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_starts[line - 1] + column
+
+    def _target(self, attrs) -> Optional[str]:
+        for name, value in attrs:
+            if name == "data-trace-id" and value in self.targets and value not in self.found:
+                return value
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        start = self._offset()
+        trace_id = self._target(attrs)
+        if tag in VOID_ELEMENTS:
+            if trace_id:
+                self.found[trace_id] = (start, start + len(self.get_starttag_text()))
+            return
+        # 同级的 <li>、<p>、<td> 等开始时，上一个未写结束标签的同类元素随之结束
+        siblings = IMPLIED_END_SIBLINGS.get(tag)
+        if siblings and self.stack and self.stack[-1][0] in siblings:
+            _, previous, begin = self.stack.pop()
+            if previous:
+                self.found[previous] = (begin, start)
+        self.stack.append((tag, trace_id, start))
+
+    def handle_startendtag(self, tag, attrs):
+        trace_id = self._target(attrs)
+        if trace_id:
+            start = self._offset()
+            self.found[trace_id] = (start, start + len(self.get_starttag_text()))
+
+    def handle_endtag(self, tag):
+        if not any(open_tag == tag for open_tag, _, _ in self.stack):
+            return
+        start = self._offset()
+        end = self.html.find(">", start) + 1 or len(self.html)
+        while self.stack:
+            open_tag, trace_id, begin = self.stack.pop()
+            if open_tag == tag:
+                if trace_id:
+                    self.found[trace_id] = (begin, end)
+                return
+            # 隐式闭合的元素在当前结束标签之前结束
+            if trace_id:
+                self.found[trace_id] = (begin, start)
+
+    def locate(self) -> Dict[str, Tuple[int, int]]:
+        self.feed(self.html)
+        self.close()
+        for _, trace_id, begin in self.stack:
+            if trace_id and trace_id not in self.found:
+                self.found[trace_id] = (begin, len(self.html))
+        return self.found
+
+def extract_elements(html: str, trace_ids: List[str]) -> Dict[str, str]:
+    """按 data-trace-id 取出元素的完整 HTML，找不到的 ID 不出现在结果中"""
+    if not html or not trace_ids:
+        return {}
+    spans = _ElementLocator(html, set(trace_ids)).locate()
+    return {trace_id: html[start:end] for trace_id, (start, end) in spans.items()}
+
+class HtmlStreamProcessor:
+    """
+    生成 Demo 的流式后处理：
+    1. 去掉 Markdown 代码围栏及其前后的说明文字；
+    2. 增量跟踪标签平衡与 data-trace-id；
+    3. 结束时补全被截断的标签并给出结构化的问题报告。
+    """
+
+    def __init__(self, original_code: Optional[str] = None):
+        self.original_trace_ids = extract_trace_ids(original_code) if original_code else set()
+        self._preamble = ""
+        self._in_body = False
+        self._fenced = False
+        self._closed = False
+        self._held = ""
+        self._pending_parse = ""
+        self._tracker = _TagTracker()
+        self.emitted_chars = 0
+
+    def _start_body(self) -> Optional[str]:
+        """在前置说明中定位代码开始的位置；返回应输出的正文部分"""
+        fence_at = self._preamble.find(FENCE)
+        tag_at = self._preamble.find("<")
+        if fence_at != -1 and (tag_at == -1 or fence_at < tag_at):
+            newline = self._preamble.find("\n", fence_at)
+            if newline == -1:
+                return None  # ```html 这一行还没收完整
+            self._fenced = True
+            body = self._preamble[newline + 1:]
+        elif tag_at != -1:
+            body = self._preamble[tag_at:]
+        elif len(self._preamble) > 2000:
+            body = self._preamble
+        else:
+            return None
+        self._in_body = True
+        self._preamble = ""
+        return body
+
+    def _split_closing_fence(self, text: str) -> str:
+        """处理正文：遇到行首的收尾围栏后丢弃其后的内容；行尾可能是围栏的前缀时先暂存"""
+        text = self._held + text
+        self._held = ""
+        if not self._fenced:
+            return text
+        search_from = 0
+        while True:
+            at = text.find(FENCE, search_from)
+            if at == -1:
+                break
+            if at == 0 or text[at - 1] == "\n":
+                self._closed = True
+                return text[:at]
+            search_from = at + len(FENCE)
+        newline = text.rfind("\n")
+        tail = text[newline + 1:] if newline != -1 else text
+        if FENCE.startswith(tail.rstrip(" ")) or tail == "":
+            cut = newline + 1 if newline != -1 else 0
+            self._held = text[cut:]
+            return text[:cut]
+        return text
+
+    def _emit(self, text: str) -> str:
+        if text:
+            self.emitted_chars += len(text)
+            self._pending_parse += text
+            if len(self._pending_parse) >= PARSE_BATCH_CHARS:
+                self._tracker.feed(self._pending_parse)
+                self._pending_parse = ""
+        return text
+
+    def feed(self, chunk: str) -> str:
+        """喂入一段模型输出，返回清洗后应下发给客户端的内容"""
+        if self._closed:
+            return ""
+        if not self._in_body:
+            self._preamble += chunk
+            body = self._start_body()
+            if body is None:
+                return ""
+            chunk = body
+        return self._emit(self._split_closing_fence(chunk))
+
+    def _repair_suffix(self, issues: List[dict]) -> str:
+        tracker = self._tracker
+        suffix = ""
+        leftover = tracker.rawdata if tracker.rawdata.startswith("<") else ""
+        if tracker.cdata_elem:
+            issues.append({"level": "error", "type": "truncated", "message": f"<{tracker.cdata_elem}> 内容被截断"})
+            suffix += f"</{tracker.cdata_elem}>"
+            tracker.stack = tracker.stack[:-1] if tracker.stack and tracker.stack[-1] == tracker.cdata_elem else tracker.stack
+        elif leftover.startswith("<!--"):
+            issues.append({"level": "error", "type": "truncated", "message": "注释被截断"})
+            suffix += "-->"
+        elif leftover:
+            match = PARTIAL_TAG_PATTERN.match(leftover)
+            if match and match.group(2).count('"') % 2 == 0 and match.group(2).count("'") % 2 == 0:
+                issues.append({"level": "error", "type": "truncated", "message": f"<{match.group(1)}> 标签被截断"})
+                suffix += ">"
+                tag = match.group(1).lower()
+                if tag not in VOID_ELEMENTS:
+                    tracker.stack.append(tag)
+            else:
+                issues.append({"level": "error", "type": "truncated", "message": "代码在标签中间被截断，无法自动修复"})
+                return ""
+        unclosed = [tag for tag in tracker.stack if tag not in OPTIONAL_END_ELEMENTS]
+        # html/body/head 虽然也可省略结束标签，但补全是无害的，只对其它元素报告问题
+        if any(tag not in ("html", "head", "body") for tag in unclosed):
+            issues.append({
+                "level": "warning", "type": "unclosed_tags",
+                "message": f"{len(unclosed)} 个标签未闭合，已自动补全",
+                "tags": unclosed[-20:],
+            })
+        suffix += "".join(f"</{tag}>" for tag in reversed(unclosed))
+        return suffix
+
+    def finish(self) -> Tuple[str, dict]:
+        """流结束：输出暂存内容与修复后缀，并生成问题报告"""
+        issues: List[dict] = []
+        tail = ""
+        if not self._in_body and self._preamble:
+            # 没有发现任何 HTML 特征：原样输出
+            tail += self._emit(self._preamble)
+        if self._held and not self._closed and not FENCE.startswith(self._held.strip()):
+            tail += self._emit(self._held)
+        if self._fenced and not self._closed:
+            issues.append({"level": "warning", "type": "unclosed_fence", "message": "代码块缺少结束标记，输出可能不完整"})
+        if self._pending_parse:
+            self._tracker.feed(self._pending_parse)
+            self._pending_parse = ""
+
+        if self.emitted_chars == 0:
+            issues.append({"level": "error", "type": "empty", "message": "模型没有返回任何代码"})
+
+        repair = self._repair_suffix(issues) if self.emitted_chars else ""
+        tail += repair
+
+        tracker = self._tracker
+        if tracker.stray_end_tags:
+            issues.append({
+                "level": "warning", "type": "stray_end_tags",
+                "message": f"{len(tracker.stray_end_tags)} 个结束标签没有对应的开始标签",
+                "tags": tracker.stray_end_tags[:20],
+            })
+        duplicates = sorted(t for t, n in tracker.trace_ids.items() if n > 1)
+        if duplicates:
+            issues.append({
+                "level": "warning", "type": "duplicate_trace_ids",
+                "message": f"{len(duplicates)} 个 data-trace-id 重复",
+                "trace_ids": duplicates[:50],
+            })
+        if self.original_trace_ids:
+            missing = sorted(self.original_trace_ids - set(tracker.trace_ids))
+            if missing:
+                issues.append({
+                    "level": "warning", "type": "missing_trace_ids",
+                    "message": f"修改后丢失了 {len(missing)} 个原有的 data-trace-id",
+                    "trace_ids": missing[:50],
+                })
+
+        report = {
+            "valid": not any(i["level"] == "error" for i in issues),
+            "repaired": bool(repair),
+            "trace_id_count": len(tracker.trace_ids),
+            "issues": issues,
+        }
+        return tail, report
+
+async def process_html_stream(
+    source: AsyncGenerator[str, None],
+    original_code: Optional[str] = None
+) -> AsyncGenerator[Union[str, StreamEvent], None]:
+    """包装模型输出流：下发清洗后的 HTML，结束时追加修复内容与 html_report 事件"""
+    processor = HtmlStreamProcessor(original_code)
+    try:
+        async for chunk in source:
+            cleaned = processor.feed(chunk)
+            if cleaned:
+                yield cleaned
+    finally:
+        await source.aclose()
+    tail, report = processor.finish()
+    if tail:
+        yield tail
+    if report["issues"]:
+        print(f"DEBUG: HTML report: {[i['type'] for i in report['issues']]}")
+    yield StreamEvent("html_report", report)
@@ -0,0 +1,255 @@
+import math
+import os
+import re
+import zipfile
+from collections import Counter
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+from xml.etree import ElementTree
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+from app.core.config import settings
+from app.core.database import engine
+from app.models.models import FileUpload, KnowledgeChunk, KnowledgePosting, Project
+
+TEXT_EXTENSIONS = {
+    ".txt", ".md", ".markdown", ".csv", ".tsv", ".json", ".yaml", ".yml", ".xml",
+    ".log", ".ini", ".sql", ".py", ".js", ".ts", ".jsx", ".tsx", ".java", ".go", ".css",
+}
+HTML_EXTENSIONS = {".html", ".htm"}
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 拉丁字母/数字按词切分；中日韩文字没有空格，按相邻两字（bigram）切分
+LATIN_TOKEN = re.compile(r"[a-z0-9_]+")
+CJK_RUN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]+")
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower()
+    tokens = LATIN_TOKEN.findall(text)
+    for run in CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class _HTMLText(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.parts: List[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+        elif tag in ("p", "div", "li", "tr", "br", "h1", "h2", "h3", "h4", "section"):
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+def _decode(data: bytes) -> str:
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+def _docx_text(path: str) -> str:
+    namespace = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{namespace}p"):
+        paragraphs.append("".join(node.text or "" for node in paragraph.iter(f"{namespace}t")))
+    return "\n\n".join(paragraphs)
+
+def extract_text(path: str, filename: str, content_type: Optional[str] = None) -> Optional[str]:
+    """按扩展名/类型抽取纯文本；不支持的格式返回 None"""
+    ext = os.path.splitext(filename or "")[1].lower()
+    content_type = content_type or ""
+    if ext in HTML_EXTENSIONS or content_type == "text/html":
+        parser = _HTMLText()
+        with open(path, "rb") as f:
+            parser.feed(_decode(f.read()))
+        parser.close()
+        return "".join(parser.parts)
+    if ext in TEXT_EXTENSIONS or content_type.startswith("text/") or content_type == "application/json":
+        with open(path, "rb") as f:
+            return _decode(f.read())
+    if ext == ".docx":
+        return _docx_text(path)
+    if ext == ".pdf":
+        try:
+            from pypdf import PdfReader  # PDF 解析为可选依赖，仅在遇到 PDF 时导入
+        except ImportError:
+            return None
+        reader = PdfReader(path)
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    return None
+
+def chunk_text(text: str, size: Optional[int] = None, overlap: Optional[int] = None) -> List[str]:
+    """按段落聚合成不超过 size 字符的切片，超长段落硬切；相邻切片保留 overlap 字符的重叠"""
+    size = size or settings.KNOWLEDGE_CHUNK_CHARS
+    overlap = settings.KNOWLEDGE_CHUNK_OVERLAP if overlap is None else overlap
+    pieces: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > size:
+            pieces.append(paragraph[:size])
+            paragraph = paragraph[size - overlap:]
+        if paragraph:
+            pieces.append(paragraph)
+
+    chunks: List[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > size:
+            chunks.append(current)
+            tail = current[-overlap:] if overlap else ""
+            current = f"{tail}\n\n{piece}" if tail and len(tail) + len(piece) + 2 <= size else piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _clear_file(session: Session, file_id: int):
+    chunk_ids = select(KnowledgeChunk.id).where(KnowledgeChunk.file_id == file_id)
+    session.exec(delete(KnowledgePosting).where(KnowledgePosting.chunk_id.in_(chunk_ids)))
+    session.exec(delete(KnowledgeChunk).where(KnowledgeChunk.file_id == file_id))
+
+def ingest_file(file_id: int) -> int:
+    """
+    抽取附件文本、切片并写入倒排索引，返回切片数。
+    在后台任务（线程池）中执行，使用独立的数据库会话。
+    """
+    with Session(engine) as session:
+        db_file = session.get(FileUpload, file_id)
+        if not db_file or not db_file.project_id:
+            return 0
+        _clear_file(session, file_id)
+        project = session.get(Project, db_file.project_id)
+        if not project or project.user_id != db_file.user_id:
+            # 只索引项目所有者本人上传的附件，其他用户的文件不能进入该项目的提示词
+            print(f"DEBUG: Knowledge skipped file {file_id}: not owned by the project owner")
+            session.commit()
+            return 0
+        try:
+            text = extract_text(db_file.file_path, db_file.filename, db_file.file_type)
+        except Exception as e:
+            print(f"DEBUG: Knowledge extract failed for file {file_id}: {e}")
+            text = None
+        if not text or not text.strip():
+            session.commit()
+            return 0
+
+        chunks = chunk_text(text)
+        for ordinal, content in enumerate(chunks):
+            terms = Counter(tokenize(content))
+            chunk = KnowledgeChunk(
+                file_id=file_id,
+                project_id=db_file.project_id,
+                content_hash=db_file.content_hash,
+                ordinal=ordinal,
+                content=content,
+                length=sum(terms.values())
+            )
+            session.add(chunk)
+            session.flush()
+            session.add_all([KnowledgePosting(term=term, chunk_id=chunk.id, tf=tf) for term, tf in terms.items()])
+        session.commit()
+        print(f"DEBUG: Knowledge ingested file {file_id} ({db_file.filename}): {len(chunks)} chunks")
+        return len(chunks)
+
+def _owner_files(project_id: int):
+    """项目所有者本人上传到该项目的附件 id（子查询）"""
+    owner = select(Project.user_id).where(Project.id == project_id).scalar_subquery()
+    return select(FileUpload.id).where(FileUpload.project_id == project_id, FileUpload.user_id == owner)
+
+def search(session: Session, project_id: int, query: str, top_k: Optional[int] = None) -> List[Tuple[float, KnowledgeChunk]]:
+    """BM25 检索项目内最相关的切片（只包含项目所有者上传的附件），按得分降序返回"""
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+    owned = KnowledgeChunk.file_id.in_(_owner_files(project_id))
+    total, avg_length = session.exec(
+        select(func.count(KnowledgeChunk.id), func.avg(KnowledgeChunk.length))
+        .where(KnowledgeChunk.project_id == project_id, owned)
+    ).one()
+    if not total:
+        return []
+    avg_length = avg_length or 1
+
+    # 去重所需的字段随倒排表一起取出，排序后只按 id 批量加载最终入选的切片
+    postings = session.exec(
+        select(
+            KnowledgePosting.term, KnowledgePosting.chunk_id, KnowledgePosting.tf, KnowledgeChunk.length,
+            KnowledgeChunk.content_hash, KnowledgeChunk.file_id, KnowledgeChunk.ordinal,
+        )
+        .join(KnowledgeChunk, KnowledgeChunk.id == KnowledgePosting.chunk_id)
+        .where(KnowledgeChunk.project_id == project_id, owned, KnowledgePosting.term.in_(terms))
+    ).all()
+    df = Counter(row[0] for row in postings)
+    scores: Dict[int, float] = {}
+    identities: Dict[int, tuple] = {}
+    for term, chunk_id, tf, length, content_hash, file_id, ordinal in postings:
+        idf = math.log(1 + (total - df[term] + 0.5) / (df[term] + 0.5))
+        norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        identities[chunk_id] = (content_hash or f"file-{file_id}", ordinal)
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    top_k = top_k or settings.KNOWLEDGE_TOP_K
+    selected: List[Tuple[int, float]] = []
+    seen = set()
+    for chunk_id, score in ranked:
+        # 同一份内容上传多次时只取一份
+        if identities[chunk_id] in seen:
+            continue
+        seen.add(identities[chunk_id])
+        selected.append((chunk_id, score))
+        if len(selected) >= top_k:
+            break
+    if not selected:
+        return []
+    chunks = {chunk.id: chunk for chunk in session.exec(
+        select(KnowledgeChunk).where(KnowledgeChunk.id.in_([chunk_id for chunk_id, _ in selected]))
+    ).all()}
+    return [(score, chunks[chunk_id]) for chunk_id, score in selected if chunk_id in chunks]
+
+def retrieve_references(project_id: Optional[int], user_id: int, query: str) -> Tuple[str, Optional[dict]]:
+    """
+    为生成阶段检索参考资料，返回 (可直接拼入提示词的文本, 统计信息)。
+    总长度受 KNOWLEDGE_MAX_CHARS 限制，无论项目附件多少，提示词大小都有上界。
+    """
+    if not project_id or not query:
+        return "", None
+    with Session(engine) as session:
+        project = session.get(Project, project_id)
+        if not project or project.user_id != user_id:
+            return "", None
+        results = search(session, project_id, query)
+        filenames = {}
+        parts: List[str] = []
+        used = 0
+        for score, chunk in results:
+            if used + len(chunk.content) > settings.KNOWLEDGE_MAX_CHARS:
+                continue
+            if chunk.file_id not in filenames:
+                db_file = session.get(FileUpload, chunk.file_id)
+                filenames[chunk.file_id] = db_file.filename if db_file else ""
+            parts.append(f"[{filenames[chunk.file_id]} #{chunk.ordinal + 1}]\n{chunk.content}")
+            used += len(chunk.content)
+    if not parts:
+        return "", {"chunks": 0, "chars": 0}
+    return "\n\n".join(parts), {"chunks": len(parts), "chars": used}
@@ -1,34 +1,229 @@
-from openai import AsyncOpenAI
+import asyncio
+import random
+import time
 from app.core.config import settings
-from typing import List, Dict, AsyncGenerator
+from app.core import tracing
+from typing import List, Dict, AsyncGenerator, Optional, Tuple
+
+class LLMError(Exception):
+    """上游 LLM 调用失败（重试耗尽、熔断或流中途中断）"""
+
+    def __init__(self, message: str, code: str = "upstream_error", retryable: bool = False, started: bool = False):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.retryable = retryable
+        # 是否已经向客户端输出过内容
+        self.started = started
+
+    def to_dict(self) -> dict:
+        return {"code": self.code, "message": self.message, "retryable": self.retryable}
+
+def is_retryable(exc: Exception) -> bool:
+    """连接错误、超时、限流和 5xx 可以重试；其余（如 400/401）重试也无济于事"""
+    # openai 包导入较慢（约 0.5s），推迟到真正调用时；此时客户端已创建，导入无额外开销
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+    if isinstance(exc, (APIConnectionError, APITimeoutError, asyncio.TimeoutError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+class CircuitBreaker:
+    """单个上游 Endpoint 的熔断器：连续失败达到阈值后熔断，冷却后放行一次试探请求"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.half_open_trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= settings.LLM_BREAKER_RESET_SECONDS:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.half_open_trial:
+            self.half_open_trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_trial = False
+
+    def release_trial(self):
+        """试探请求没有给出结论（被取消或不可重试的错误）：回到 half_open，下一个请求可以再试探"""
+        self.half_open_trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.half_open_trial = False
+        if self.opened_at is not None or self.failures >= settings.LLM_BREAKER_FAILURE_THRESHOLD:
+            if self.opened_at is None:
+                print(f"DEBUG: Circuit breaker opened for {self.name}")
+            self.opened_at = time.monotonic()
 
 class LLMService:
     def __init__(self):
-        self.client = AsyncOpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_BASE_URL
-        )
+        self._client = None
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    @property
+    def client(self):
+        """首次调用模型时才导入 openai 并创建客户端，缩短进程冷启动时间"""
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=settings.OPENAI_BASE_URL
+            )
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        """按 base_url + model 区分上游 Endpoint"""
+        name = f"{settings.OPENAI_BASE_URL}#{model}"
+        if name not in self._breakers:
+            self._breakers[name] = CircuitBreaker(name)
+        return self._breakers[name]
+
+    def _check_breaker(self, breaker: CircuitBreaker) -> bool:
+        """熔断时抛出 LLMError；返回本次请求是否占用了 half_open 的试探名额"""
+        trial = breaker.state == "half_open"
+        if not breaker.allow():
+            raise LLMError(
+                "上游模型服务暂时不可用，请稍后重试",
+                code="circuit_open", retryable=True
+            )
+        return trial
+
+    async def _backoff(self, attempt: int):
+        """带抖动的指数退避（full jitter）"""
+        ceiling = min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * (2 ** attempt))
+        await asyncio.sleep(random.uniform(0, ceiling))
 
     async def chat_completion(
-        self, 
-        messages: List[Dict[str, str]], 
+        self,
+        messages: List[Dict[str, str]],
         model: str = None,
         temperature: float = 0.7
     ) -> str:
         """Standard Chat Completion"""
         if not model:
             model = settings.DEFAULT_MODEL
-            
+
+        breaker = self.breaker(model)
+        attempt = 0
+        completion_span = tracing.start_span("llm.completion", kind=tracing.SPAN_KIND_CLIENT, **{"llm.model": model})
         try:
-            response = await self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"LLM Error: {e}")
-            return f"Error generating response: {str(e)}"
+            while True:
+                trial = self._check_breaker(breaker)
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                    )
+                    breaker.record_success()
+                    tracing.end_span(completion_span, **{"llm.attempts": attempt + 1})
+                    return response.choices[0].message.content
+                except Exception as e:
+                    print(f"LLM Error: {e}")
+                    retryable = is_retryable(e)
+                    if retryable:
+                        breaker.record_failure()
+                    if not retryable or attempt >= settings.LLM_MAX_RETRIES:
+                        tracing.end_span(completion_span, e, **{"llm.attempts": attempt + 1})
+                        raise LLMError(f"Error generating response: {str(e)}", retryable=retryable) from e
+                finally:
+                    # 成功/失败已各自记录；取消或不可重试错误时也要交还试探名额，否则熔断器会卡在 half_open
+                    if trial:
+                        breaker.release_trial()
+                await self._backoff(attempt)
+                attempt += 1
+        except BaseException as e:
+            # 熔断（包括重试中途熔断）与取消同样要结束 span，已经结束的不会被覆盖
+            tracing.end_span(completion_span, e, **{"llm.attempts": attempt + 1})
+            raise
+
+    async def _open_stream(self, model: str, messages: List[Dict[str, str]], temperature: float) -> Tuple[object, AsyncGenerator, str]:
+        """发起一次流式请求，直到拿到首个 Token 才返回"""
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            # 增加超时时间，防止长文本生成中断
+            timeout=120.0
+        )
+        try:
+            iterator = stream.__aiter__()
+            async for chunk in iterator:
+                content = self._chunk_content(chunk)
+                if content:
+                    return stream, iterator, content
+            return stream, iterator, ""
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def _first_token(self, model: str, messages: List[Dict[str, str]], temperature: float, breaker: CircuitBreaker):
+        """
+        对冲请求：首个请求在阈值时间内没有产出 Token 时再发起一个，
+        谁先产出首个 Token 就用谁，另一个立即取消。
+        """
+        hedge_delay = settings.LLM_HEDGE_DELAY_SECONDS
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + hedge_delay
+        pending = {asyncio.create_task(self._open_stream(model, messages, temperature))}
+        hedged = hedge_delay <= 0
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                timeout = None if hedged else max(0.0, deadline - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if breaker.allow():
+                        print(f"DEBUG: No token after {hedge_delay}s, sending hedged request for {model}")
+                        pending.add(asyncio.create_task(self._open_stream(model, messages, temperature)))
+                    hedged = True
+                    continue
+                winner = None
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        if is_retryable(error):
+                            breaker.record_failure()
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        await task.result()[0].close()
+                if winner:
+                    return winner
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    def _chunk_content(chunk) -> str:
+        if chunk.choices and len(chunk.choices) > 0:
+            delta = chunk.choices[0].delta
+            if hasattr(delta, 'content') and delta.content:
+                return delta.content
+        return ""
 
     async def chat_completion_stream(
         self,
@@ -36,58 +231,89 @@ class LLMService:
         model: str = None,
         temperature: float = 0.7
     ) -> AsyncGenerator[str, None]:
-        """Streaming Chat Completion"""
+        """
+        Streaming Chat Completion
+        首个 Token 之前的错误会带抖动退避重试；失败时抛出 LLMError，
+        由调用方转换为结构化错误事件，而不是把错误文本混入文档内容。
+        """
         if not model:
             model = settings.DEFAULT_MODEL
-            
+
+        # 数据清洗：确保没有空消息，且格式正确
+        valid_messages = []
+        for m in messages:
+            if m.get("content") and m.get("role"):
+                valid_messages.append({
+                    "role": m["role"],
+                    "content": str(m["content"]).strip()
+                })
+
+        if not valid_messages:
+            raise LLMError("No valid messages to send to LLM.", code="invalid_request")
+
+        # 兼容性处理：某些模型（如 Claude）在某些 Provider 下要求首条消息必须是 user，或者不能只有 system 消息
+        # 如果第一条是 system，且只有这一条，我们把它改成 user 或者在后面加一条 user
+        if len(valid_messages) == 1 and valid_messages[0]["role"] == "system":
+            # 将单条 system 消息转为 user 消息，提高兼容性
+            valid_messages[0]["role"] = "user"
+        elif valid_messages[0]["role"] == "system" and len(valid_messages) > 1 and valid_messages[1]["role"] == "system":
+            # 合并连续的 system 消息
+            system_content = valid_messages[0]["content"] + "\n\n" + valid_messages[1]["content"]
+            valid_messages[1]["content"] = system_content
+            valid_messages.pop(0)
+
+        print(f"DEBUG: Starting stream for model {model}")
+        print(f"DEBUG: Messages structure: {[ {'role': m['role'], 'len': len(m['content'])} for m in valid_messages ]}")
+
+        breaker = self.breaker(model)
+        attempt = 0
+        # 首 Token 阶段（含重试退避与对冲）与输出阶段分别计时
+        ttft_span = tracing.start_span("llm.ttft", kind=tracing.SPAN_KIND_CLIENT, **{"llm.model": model})
         try:
-            # 数据清洗：确保没有空消息，且格式正确
-            valid_messages = []
-            for m in messages:
-                if m.get("content") and m.get("role"):
-                    valid_messages.append({
-                        "role": m["role"],
-                        "content": str(m["content"]).strip()
-                    })
-            
-            if not valid_messages:
-                yield "Error: No valid messages to send to LLM."
-                return
-
-            # 兼容性处理：某些模型（如 Claude）在某些 Provider 下要求首条消息必须是 user，或者不能只有 system 消息
-            # 如果第一条是 system，且只有这一条，我们把它改成 user 或者在后面加一条 user
-            if len(valid_messages) == 1 and valid_messages[0]["role"] == "system":
-                # 将单条 system 消息转为 user 消息，提高兼容性
-                valid_messages[0]["role"] = "user"
-            elif valid_messages[0]["role"] == "system" and len(valid_messages) > 1 and valid_messages[1]["role"] == "system":
-                # 合并连续的 system 消息
-                system_content = valid_messages[0]["content"] + "\n\n" + valid_messages[1]["content"]
-                valid_messages[1]["content"] = system_content
-                valid_messages.pop(0)
-
-            print(f"DEBUG: Starting stream for model {model}")
-            print(f"DEBUG: Messages structure: {[ {'role': m['role'], 'len': len(m['content'])} for m in valid_messages ]}")
-            
-            stream = await self.client.chat.completions.create(
-                model=model,
-                messages=valid_messages,
-                temperature=temperature,
-                stream=True,
-                # 增加超时时间，防止长文本生成中断
-                timeout=120.0 
-            )
-            
-            async for chunk in stream:
-                    if chunk.choices and len(chunk.choices) > 0:
-                        delta = chunk.choices[0].delta
-                        if hasattr(delta, 'content') and delta.content:
-                            content = delta.content
-                            # print(content, end="", flush=True) # 调试：逐字打印到终端
-                            yield content
+            while True:
+                trial = self._check_breaker(breaker)
+                try:
+                    stream, iterator, first = await self._first_token(model, valid_messages, temperature, breaker)
+                    breaker.record_success()
+                    break
+                except Exception as e:
+                    print(f"DEBUG: LLM Stream Error (attempt {attempt + 1}): {e}")
+                    retryable = is_retryable(e)
+                    if not retryable or attempt >= settings.LLM_MAX_RETRIES:
+                        tracing.end_span(ttft_span, e, **{"llm.attempts": attempt + 1})
+                        raise LLMError(f"Error generating response: {str(e)}", retryable=retryable) from e
+                finally:
+                    if trial:
+                        breaker.release_trial()
+                await self._backoff(attempt)
+                attempt += 1
+        except BaseException as e:
+            tracing.end_span(ttft_span, e, **{"llm.attempts": attempt + 1})
+            raise
+        tracing.end_span(ttft_span, **{"llm.attempts": attempt + 1})
+
+        stream_span = tracing.start_span("llm.stream", kind=tracing.SPAN_KIND_CLIENT, **{"llm.model": model})
+        chunks = 1 if first else 0
+        chars = len(first)
+        error: Optional[BaseException] = None
+        try:
+            if first:
+                yield first
+            async for chunk in iterator:
+                content = self._chunk_content(chunk)
+                if content:
+                    chunks += 1
+                    chars += len(content)
+                    yield content
         except Exception as e:
-            print(f"DEBUG: LLM Stream Error: {e}")
-            import traceback
-            traceback.print_exc()
-            yield f"Error generating response: {str(e)}"
+            # 已经输出了部分内容，无法透明重试
+            error = e
+            print(f"DEBUG: LLM Stream interrupted: {e}")
+            if is_retryable(e):
+                breaker.record_failure()
+            raise LLMError(f"Error generating response: {str(e)}", retryable=is_retryable(e), started=True) from e
+        finally:
+            await stream.close()
+            tracing.end_span(stream_span, error, **{"llm.chunks": chunks, "llm.chars": chars})
 
 llm_service = LLMService()
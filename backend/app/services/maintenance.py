@@ -0,0 +1,361 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import delete, exists, or_
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.core.database import engine
+from app.core.shared_state import get_shared_state
+from app.models.models import (
+    ArtifactDigest, ChatMessage, ChatSummary, DemoData, FileUpload, KnowledgeChunk, KnowledgePosting, Project,
+    SimilarityBand, SimilaritySignature, UploadSession
+)
+from app.services import demo_snapshots, demo_store, digests, similarity
+from app.services.file_storage import session_path, tmp_dir
+
+LEASE_KEY = "maintenance:lease"
+REPORT_KEY = "maintenance:last_report"
+
+# 手动触发与定时任务不在同一进程内并发执行
+_running = False
+
+def _delete_in_batches(id_column, condition, before_delete: Optional[Callable[[Session, List], None]] = None) -> int:
+    """
+    按主键分批删除满足条件的行：每批单独提交，批之间短暂停顿让出写锁，
+    单次维护最多处理 MAINTENANCE_MAX_BATCHES 批，剩余的留到下一轮。
+    """
+    total = 0
+    for _ in range(settings.MAINTENANCE_MAX_BATCHES):
+        with Session(engine) as session:
+            ids = session.exec(select(id_column).where(condition).limit(settings.MAINTENANCE_BATCH_SIZE)).all()
+            if not ids:
+                break
+            if before_delete:
+                before_delete(session, ids)
+            session.exec(delete(id_column.table).where(id_column.in_(ids)))
+            session.commit()
+        total += len(ids)
+        if len(ids) < settings.MAINTENANCE_BATCH_SIZE:
+            break
+        time.sleep(settings.MAINTENANCE_BATCH_PAUSE)
+    return total
+
+def _project_missing(column):
+    return ~exists().where(Project.id == column)
+
+def _delete_postings(session: Session, chunk_ids: List[int]):
+    session.exec(delete(KnowledgePosting).where(KnowledgePosting.chunk_id.in_(chunk_ids)))
+
+def _sweep_demo_store() -> int:
+    """分片存储中已删除项目的数据（每个项目一个文件时直接删除文件）"""
+    store = demo_store.get_store()
+    ids = store.project_ids()
+    removed = 0
+    for start in range(0, len(ids), settings.MAINTENANCE_BATCH_SIZE):
+        batch = ids[start:start + settings.MAINTENANCE_BATCH_SIZE]
+        with Session(engine) as session:
+            existing = set(session.exec(select(Project.id).where(Project.id.in_(batch))).all())
+        removed += sum(store.drop_project(project_id) for project_id in batch if project_id not in existing)
+    return removed
+
+def sweep_orphan_rows() -> Dict[str, int]:
+    """已删除项目遗留的数据行，以及过期的分片上传会话"""
+    rows = {
+        "demo_data": _delete_in_batches(DemoData.id, _project_missing(DemoData.project_id)),
+        "demo_store": _sweep_demo_store(),
+        "chat_messages": _delete_in_batches(ChatMessage.id, _project_missing(ChatMessage.project_id)),
+        "chat_summaries": _delete_in_batches(ChatSummary.project_id, _project_missing(ChatSummary.project_id)),
+        "similarity_signatures": _delete_in_batches(
+            SimilaritySignature.project_id, _project_missing(SimilaritySignature.project_id)
+        ),
+        "similarity_bands": _delete_in_batches(SimilarityBand.project_id, _project_missing(SimilarityBand.project_id)),
+        "artifact_digests": _delete_in_batches(ArtifactDigest.project_id, _project_missing(ArtifactDigest.project_id)),
+        # 附件记录删除后，对应的文件在下面的文件清理中回收
+        "file_uploads": _delete_in_batches(
+            FileUpload.id, FileUpload.project_id.is_not(None) & _project_missing(FileUpload.project_id)
+        ),
+        "knowledge_chunks": _delete_in_batches(
+            KnowledgeChunk.id,
+            or_(_project_missing(KnowledgeChunk.project_id), ~exists().where(FileUpload.id == KnowledgeChunk.file_id)),
+            before_delete=_delete_postings,
+        ),
+    }
+    expired = datetime.utcnow() - timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS)
+
+    def _remove_parts(session: Session, upload_ids: List[str]):
+        for upload_id in upload_ids:
+            _remove(session_path(upload_id))
+
+    rows["upload_sessions"] = _delete_in_batches(UploadSession.id, UploadSession.updated_at < expired, _remove_parts)
+    return rows
+
+def expire_demo_data() -> int:
+    """DEMO_DATA_TTL_DAYS 天未写入的 Demo 业务数据（0 表示永不过期）"""
+    if settings.DEMO_DATA_TTL_DAYS <= 0:
+        return 0
+    cutoff = datetime.now() - timedelta(days=settings.DEMO_DATA_TTL_DAYS)
+    tokens = set()
+
+    def _collect_tokens(session: Session, ids: List[int]):
+        # 批量删除不触发 ORM 事件，已发布快照需要手动失效
+        tokens.update(session.exec(
+            select(Project.share_token).where(
+                Project.id.in_(select(DemoData.project_id).where(DemoData.id.in_(ids))),
+                Project.share_token.is_not(None),
+            )
+        ).all())
+
+    removed = _delete_in_batches(DemoData.id, DemoData.updated_at < cutoff, _collect_tokens)
+    expired = demo_store.get_store().expire(cutoff)
+    if expired:
+        removed += sum(expired.values())
+        with Session(engine) as session:
+            tokens.update(session.exec(
+                select(Project.share_token).where(Project.id.in_(list(expired)), Project.share_token.is_not(None))
+            ).all())
+    for token in tokens:
+        demo_snapshots.invalidate(token)
+    return removed
+
+def _remove(path: str) -> int:
+    """删除文件并返回释放的字节数；文件已不存在时返回 0"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+def _older_than_grace(path: str) -> bool:
+    try:
+        return os.path.getmtime(path) < time.time() - settings.MAINTENANCE_GRACE_SECONDS
+    except FileNotFoundError:
+        return False
+
+def _remove_unreferenced(candidates: List[str]) -> Tuple[int, int]:
+    """一批候选文件中没有任何 FileUpload 引用的部分（按路径或内容哈希）"""
+    names = [os.path.basename(path) for path in candidates]
+    with Session(engine) as session:
+        referenced = set(session.exec(select(FileUpload.file_path).where(FileUpload.file_path.in_(candidates))).all())
+        hashes = set(session.exec(select(FileUpload.content_hash).where(FileUpload.content_hash.in_(names))).all())
+    count = freed = 0
+    for path, name in zip(candidates, names):
+        # 再检查一次修改时间：去重命中时会刷新已有文件的 mtime，刚被引用的文件不会被误删
+        if path in referenced or name in hashes or not _older_than_grace(path):
+            continue
+        freed += _remove(path)
+        count += 1
+    return count, freed
+
+def sweep_upload_files() -> Dict[str, int]:
+    """uploads/ 下没有记录引用的文件，以及上传中断遗留的临时文件"""
+    count = freed = 0
+    temp = os.path.abspath(tmp_dir())
+    candidates: List[str] = []
+    for dirpath, dirnames, filenames in os.walk(settings.UPLOAD_DIR):
+        if os.path.abspath(dirpath) == temp:
+            dirnames[:] = []
+            continue
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if _older_than_grace(path):
+                candidates.append(path)
+            if len(candidates) >= settings.MAINTENANCE_BATCH_SIZE:
+                removed, size = _remove_unreferenced(candidates)
+                count, freed, candidates = count + removed, freed + size, []
+    if candidates:
+        removed, size = _remove_unreferenced(candidates)
+        count, freed = count + removed, freed + size
+
+    if os.path.isdir(temp):
+        parts = {}
+        for name in os.listdir(temp):
+            path = os.path.join(temp, name)
+            if not _older_than_grace(path):
+                continue
+            if name.endswith(".part"):
+                parts[name[:-len(".part")]] = path
+            else:
+                # 单次上传写入中的临时文件，进程退出后不会再被使用
+                freed += _remove(path)
+                count += 1
+        if parts:
+            with Session(engine) as session:
+                live = set(session.exec(select(UploadSession.id).where(UploadSession.id.in_(list(parts)))).all())
+            for upload_id, path in parts.items():
+                if upload_id not in live:
+                    freed += _remove(path)
+                    count += 1
+    return {"files": count, "bytes": freed}
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+def sweep_snapshots() -> Dict[str, int]:
+    """分享已撤销或项目已删除的 Demo 快照目录"""
+    count = freed = 0
+    if not os.path.isdir(settings.SNAPSHOT_DIR):
+        return {"dirs": 0, "bytes": 0}
+    tokens = [
+        name for name in os.listdir(settings.SNAPSHOT_DIR)
+        if demo_snapshots.TOKEN_PATTERN.match(name) and _older_than_grace(os.path.join(settings.SNAPSHOT_DIR, name))
+    ]
+    for start in range(0, len(tokens), settings.MAINTENANCE_BATCH_SIZE):
+        batch = tokens[start:start + settings.MAINTENANCE_BATCH_SIZE]
+        with Session(engine) as session:
+            live = set(session.exec(select(Project.share_token).where(Project.share_token.in_(batch))).all())
+        for token in batch:
+            if token in live:
+                continue
+            path = os.path.join(settings.SNAPSHOT_DIR, token)
+            freed += _tree_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            count += 1
+    return {"dirs": count, "bytes": freed}
+
+def sweep_compressed_cache() -> Dict[str, int]:
+    """静态资源的预压缩副本：源文件更新后旧副本不会再被访问，按最近访问时间清理"""
+    count = freed = 0
+    cutoff = time.time() - settings.COMPRESSED_CACHE_MAX_AGE_DAYS * 86400
+    for dirpath, _, filenames in os.walk(settings.COMPRESSED_CACHE_DIR):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if max(stat.st_atime, stat.st_mtime) < cutoff:
+                freed += _remove(path)
+                count += 1
+    return {"files": count, "bytes": freed}
+
+def _database_bytes(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+def compact_database(full_vacuum: bool = False) -> Dict[str, object]:
+    """
+    SQLite 空间回收：auto_vacuum 为 INCREMENTAL 时每轮只做有上限的 incremental_vacuum，再更新统计信息并截断 WAL。
+    切换到 INCREMENTAL 需要一次完整 VACUUM（重写整个库并长时间持有写锁），
+    只在管理员显式执行时进行（full_vacuum=True，见 /admin/maintenance/vacuum），定时任务不会做。
+    """
+    if engine.dialect.name != "sqlite":
+        return {"skipped": engine.dialect.name}
+    path = engine.url.database
+    before = _database_bytes(path)
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        incremental = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+        if full_vacuum:
+            if not incremental:
+                conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
+            mode = "full"
+        elif incremental:
+            conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(settings.MAINTENANCE_VACUUM_PAGES)})")
+            mode = "incremental"
+        else:
+            # 未开启增量回收：空闲页留待复用，由管理员择机执行一次完整 VACUUM
+            mode = "none"
+        # 限制每个索引的采样行数，大库上 ANALYZE 也很快
+        conn.exec_driver_sql("PRAGMA analysis_limit=1000")
+        conn.exec_driver_sql("ANALYZE")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    after = _database_bytes(path)
+    return {"vacuum": mode, "free_pages": free_pages, "bytes_before": before, "bytes_after": after}
+
+def _step(report: dict, name: str, func: Callable):
+    started = time.perf_counter()
+    try:
+        report[name] = func()
+    except Exception as e:
+        # 某一步失败不影响其余步骤，下一轮重试
+        print(f"DEBUG: Maintenance step {name} failed: {e}")
+        report[name] = {"error": str(e)}
+    report["durations_ms"][name] = round((time.perf_counter() - started) * 1000, 1)
+
+def _run() -> dict:
+    report = {"started_at": datetime.utcnow().isoformat(), "pid": os.getpid(), "durations_ms": {}}
+    _step(report, "rows", sweep_orphan_rows)
+    _step(report, "expired_demo_data", expire_demo_data)
+    _step(report, "demo_store_migration", demo_store.migrate_legacy)
+    _step(report, "uploads", sweep_upload_files)
+    _step(report, "snapshots", sweep_snapshots)
+    _step(report, "compressed_cache", sweep_compressed_cache)
+    _step(report, "similarity_index", similarity.backfill)
+    _step(report, "artifact_digests", digests.backfill)
+    _step(report, "database", compact_database)
+    reclaimed = sum(
+        report[name].get("bytes", 0) for name in ("uploads", "snapshots", "compressed_cache")
+        if isinstance(report[name], dict)
+    )
+    database = report["database"]
+    if isinstance(database, dict) and "bytes_before" in database:
+        reclaimed += max(0, database["bytes_before"] - database["bytes_after"])
+    report["reclaimed_bytes"] = reclaimed
+    return report
+
+def is_running() -> bool:
+    return _running
+
+async def run_maintenance() -> dict:
+    """执行一轮维护并记录报告（所有 worker 均可通过共享状态读取最近一次报告）"""
+    global _running
+    _running = True
+    try:
+        report = await run_in_threadpool(_run)
+    finally:
+        _running = False
+    get_shared_state().set(REPORT_KEY, json.dumps(report))
+    print(f"DEBUG: Maintenance finished, reclaimed {report['reclaimed_bytes']} bytes: "
+          f"rows={report['rows']} durations={report['durations_ms']}")
+    return report
+
+async def run_full_vacuum() -> Dict[str, object]:
+    """管理员执行：完整 VACUUM 并开启增量回收，期间数据库的写入会被阻塞"""
+    global _running
+    _running = True
+    try:
+        result = await run_in_threadpool(compact_database, True)
+    finally:
+        _running = False
+    print(f"DEBUG: Full VACUUM finished: {result}")
+    return result
+
+def last_report() -> Optional[dict]:
+    raw = get_shared_state().get(REPORT_KEY)
+    return json.loads(raw) if raw else None
+
+def _acquire_lease() -> bool:
+    """多 worker 时每个周期只有第一个到达的 worker 执行"""
+    ttl = max(1.0, settings.MAINTENANCE_INTERVAL_SECONDS * 0.9)
+    return get_shared_state().incr(LEASE_KEY, ttl=ttl) == 1
+
+async def maintenance_loop():
+    await asyncio.sleep(settings.MAINTENANCE_INITIAL_DELAY_SECONDS)
+    while True:
+        try:
+            if not _running and _acquire_lease():
+                await run_maintenance()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"DEBUG: Maintenance run failed: {e}")
+        await asyncio.sleep(settings.MAINTENANCE_INTERVAL_SECONDS)
+
+def start_worker() -> Optional[asyncio.Task]:
+    if not settings.MAINTENANCE_ENABLED:
+        return None
+    return asyncio.create_task(maintenance_loop())
@@ -0,0 +1,79 @@
+from typing import Dict, List, Optional, Tuple
+from app.core.prompt_builder import build_prompt
+
+# 文档流水线：需求 -> UI 设计 -> 技术方案 -> 原型
+STAGES = ("requirements", "product", "technical", "demo")
+
+NEXT_STAGE = {
+    "requirements": "product",
+    "product": "technical",
+    "technical": "demo",
+}
+
+# 每个阶段产出的文档字段
+STAGE_OUTPUT = {
+    "requirements": "requirements_doc",
+    "product": "product_doc",
+    "technical": "tech_doc",
+    "demo": "demo_code",
+}
+
+# 每个阶段（生成模式）所依赖的输入文档
+STAGE_INPUTS = {
+    "requirements": ("raw_requirement", "references"),
+    "product": ("requirements_doc",),
+    "technical": ("product_doc",),
+    "demo": ("requirements_doc", "product_doc", "tech_doc", "references"),
+}
+
+# 近似重复输入的热启动：以相似历史项目的产物为“当前文档”，本次输入作为修改意见
+WARM_START_FEEDBACK = (
+    "上面的内容来自一个输入高度相似的历史项目。本次的输入如下，请在其基础上修改，使结果完全符合本次输入："
+    "与本次输入不符的内容修改或删除，本次新增的内容补充完整，其余保持不变。\n\n【本次输入】：\n{source}"
+)
+
+def references_block(references: str) -> str:
+    """检索到的项目附件片段，作为需求的补充资料"""
+    return f"【参考资料（节选自项目附件，仅供参考）】：\n{references}\n\n---\n\n"
+
+def stage_inputs(stage: str, docs: Dict[str, Optional[str]]) -> Dict[str, str]:
+    """只保留该阶段真正使用的输入，并把 None 统一为空字符串"""
+    return {key: docs.get(key) or "" for key in STAGE_INPUTS[stage]}
+
+def build_generation_messages(stage: str, docs: Dict[str, Optional[str]]) -> Tuple[List[Dict[str, str]], dict]:
+    """构造各阶段生成模式下发送给 LLM 的消息，返回 (messages, prompt_stats)"""
+    docs = stage_inputs(stage, docs)
+    if stage == "demo":
+        # Construct a comprehensive prompt based on all available documents
+        context_parts = []
+        if docs["requirements_doc"]:
+            context_parts.append(f"【需求文档 (PRD 背景)】：\n{docs['requirements_doc']}")
+        if docs["product_doc"]:
+            context_parts.append(f"【UI/交互设计文档】：\n{docs['product_doc']}")
+        context_parts.append(f"【核心开发/技术文档】：\n{docs['tech_doc']}")
+        if docs["references"]:
+            context_parts.append(f"【参考资料（节选自项目附件）】：\n{docs['references']}")
+        return build_prompt("demo", full_context="\n\n---\n\n".join(context_parts))
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage: {stage}")
+    if stage == "requirements" and docs["references"]:
+        docs["references"] = references_block(docs["references"])
+    return build_prompt(stage, **docs)
+
+def build_partial_edit_messages(current_code: str, elements: List[Dict[str, Optional[str]]], user_feedback: str) -> Tuple[List[Dict[str, str]], dict]:
+    """局部修改：elements 为选中元素（traceId / selector / html）"""
+    selected_info = []
+    for el in elements:
+        info = []
+        if el.get("traceId"):
+            info.append(f"Trace ID: {el['traceId']}")
+        if el.get("selector"):
+            info.append(f"Selector: {el['selector']}")
+        info.append(f"Current HTML Snippet: {el.get('html') or ''}")
+        selected_info.append("\n".join(info))
+    return build_prompt(
+        "partial_edit",
+        current_code=current_code,
+        selected_elements_info="\n---\n".join(selected_info),
+        user_feedback=user_feedback
+    )
@@ -0,0 +1,41 @@
+from typing import Callable, Optional, Sequence
+from sqlalchemy import or_
+from sqlmodel import Session, select
+from app.core.config import settings
+from app.core.database import engine
+from app.models.models import Project
+
+def field_changed(state, field: str) -> bool:
+    """字段被写入且值确实变化；重新保存相同内容不必在 flush 中重新计算派生数据"""
+    history = state.attrs[field].history
+    if not history.has_changes():
+        return False
+    if history.added and history.deleted:
+        return history.added[0] != history.deleted[0]
+    return True
+
+def backfill_projects(
+    indexed,
+    fields: Sequence[str],
+    index: Callable[[object, Project], bool],
+    mark: Callable[[object, Project], None],
+    limit: Optional[int] = None
+) -> int:
+    """
+    为还没有派生数据的历史项目分批补建（由后台维护任务执行），返回处理的项目数。
+    indexed 为已有派生数据的 project_id 子查询；index 返回是否写入了数据，
+    没写入任何数据（内容无法提取）的项目由 mark 写入空标记，否则每轮都会被重新选中而挤占批次。
+    """
+    limit = limit or settings.MAINTENANCE_BATCH_SIZE
+    with Session(engine) as session:
+        projects = session.exec(
+            select(Project).where(
+                Project.id.not_in(indexed),
+                or_(*(getattr(Project, field) != "" for field in fields)),
+            ).order_by(Project.id).limit(limit)
+        ).all()
+    for project in projects:
+        with engine.begin() as connection:
+            if not index(connection, project):
+                mark(connection, project)
+    return len(projects)
@@ -0,0 +1,194 @@
+import html
+import re
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import event, inspect, text
+from sqlmodel import Session, select
+from app.core.database import engine
+from app.models.models import Project
+from app.services.knowledge import CJK_RUN, LATIN_TOKEN, tokenize
+
+# 参与检索的字段：(字段名, FTS 列)
+DOCUMENT_FIELDS = ("raw_requirement", "requirements_doc", "product_doc", "tech_doc", "demo_code", "report_content")
+INDEXED_FIELDS = ("name", "description", "user_id") + DOCUMENT_FIELDS
+
+# 列权重：名称 > 描述 > 文档正文（owner 仅用于按用户过滤）
+BM25_WEIGHTS = "0.0, 10.0, 5.0, 1.0"
+
+SNIPPET_RADIUS = 40
+
+TAG_PATTERN = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.S | re.I)
+
+# 索引表就绪后才做增量更新；之前的写入由启动时的全量重建补齐
+_index_ready = False
+
+def is_sqlite() -> bool:
+    return engine.dialect.name == "sqlite"
+
+def _indexing() -> bool:
+    return _index_ready and is_sqlite()
+
+def _index_text(value: Optional[str], is_html: bool = False) -> str:
+    """FTS5 的 unicode61 分词器不会切分中文，这里预先切成 bigram，以空格分隔后入库"""
+    if not value:
+        return ""
+    if is_html:
+        value = TAG_PATTERN.sub(" ", value)
+    return " ".join(tokenize(value))
+
+def _owner_token(user_id: Optional[int]) -> str:
+    # 用户过滤也走倒排索引，与关键词求交集，而不是匹配后逐行比对
+    return f"owner{user_id}"
+
+def _project_row(project) -> dict:
+    documents = [_index_text(getattr(project, field), is_html=(field == "demo_code")) for field in DOCUMENT_FIELDS]
+    return {
+        "rowid": project.id,
+        "owner": _owner_token(project.user_id),
+        "name": _index_text(project.name),
+        "description": _index_text(project.description),
+        "documents": " ".join(d for d in documents if d),
+    }
+
+def _upsert(connection, project):
+    connection.execute(text("DELETE FROM project_fts WHERE rowid = :rowid"), {"rowid": project.id})
+    connection.execute(
+        text("INSERT INTO project_fts (rowid, owner, name, description, documents) "
+             "VALUES (:rowid, :owner, :name, :description, :documents)"),
+        _project_row(project)
+    )
+
+def ensure_search_index():
+    """创建 FTS5 索引表；与项目表行数不一致时（首次启用或异常退出后）全量重建"""
+    global _index_ready
+    if not is_sqlite():
+        return
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS project_fts USING fts5("
+            "owner, name, description, documents, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        indexed = connection.execute(text("SELECT count(*) FROM project_fts")).scalar()
+        total = connection.execute(text("SELECT count(*) FROM project")).scalar()
+        _index_ready = True
+        if indexed == total:
+            return
+        print(f"--- 重建项目检索索引（{indexed} -> {total}） ---")
+        connection.execute(text("DELETE FROM project_fts"))
+    with Session(engine) as session:
+        offset = 0
+        while True:
+            batch = session.exec(select(Project).order_by(Project.id).offset(offset).limit(500)).all()
+            if not batch:
+                break
+            with engine.begin() as connection:
+                for project in batch:
+                    _upsert(connection, project)
+            offset += len(batch)
+            session.expunge_all()
+
+# 写入项目时在同一事务内增量更新索引
+@event.listens_for(Project, "after_insert")
+def _on_insert(mapper, connection, target):
+    if _indexing():
+        _upsert(connection, target)
+
+@event.listens_for(Project, "after_update")
+def _on_update(mapper, connection, target):
+    if not _indexing():
+        return
+    state = inspect(target)
+    # 仅保存聊天记录、分享 Token 等不影响检索的字段时跳过
+    if any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+        _upsert(connection, target)
+
+@event.listens_for(Project, "after_delete")
+def _on_delete(mapper, connection, target):
+    if _indexing():
+        connection.execute(text("DELETE FROM project_fts WHERE rowid = :rowid"), {"rowid": target.id})
+
+def build_match_query(query: str) -> Optional[str]:
+    """把用户输入转成 FTS5 MATCH 表达式：所有词元都需命中；英文词和单个汉字按前缀匹配"""
+    terms = []
+    lowered = query.lower()
+    for word in LATIN_TOKEN.findall(lowered):
+        terms.append(f'"{word}"*')
+    for run in CJK_RUN.findall(lowered):
+        if len(run) == 1:
+            terms.append(f'"{run}"*')
+        else:
+            terms.extend(f'"{run[i:i + 2]}"' for i in range(len(run) - 1))
+    return " ".join(terms) or None
+
+def highlight(value: Optional[str], query: str) -> Optional[str]:
+    """在原文中截取包含查询词的片段，命中处用 <mark> 包裹（其余内容已转义）"""
+    if not value:
+        return None
+    words = [w for w in re.split(r"\s+", query.strip()) if w]
+    if not words:
+        return None
+    pattern = re.compile("|".join(re.escape(w) for w in sorted(words, key=len, reverse=True)), re.I)
+    match = pattern.search(value)
+    if not match:
+        return None
+    start = max(0, match.start() - SNIPPET_RADIUS)
+    end = min(len(value), match.end() + SNIPPET_RADIUS)
+    window = value[start:end]
+    parts = []
+    pos = 0
+    for hit in pattern.finditer(window):
+        parts.append(html.escape(window[pos:hit.start()]))
+        parts.append(f"<mark>{html.escape(hit.group(0))}</mark>")
+        pos = hit.end()
+    parts.append(html.escape(window[pos:]))
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(value) else ""
+    return prefix + "".join(parts) + suffix
+
+def _highlights(project: Project, query: str) -> Dict[str, str]:
+    highlights = {}
+    for field in ("name", "description") + DOCUMENT_FIELDS:
+        value = getattr(project, field)
+        if field == "demo_code" and value:
+            value = TAG_PATTERN.sub(" ", value)
+        snippet = highlight(value, query)
+        if snippet:
+            highlights[field] = snippet
+    return highlights
+
+def search_projects(session: Session, user_id: int, query: str, offset: int = 0, limit: int = 20) -> Tuple[int, List[dict]]:
+    """
+    返回 (命中总数, 当前页结果)，结果按 BM25 相关度排序。
+    全文检索依赖 SQLite FTS5；其他数据库返回 501，而不是悄悄换成只匹配名称的模糊查询。
+    """
+    if not _indexing():
+        raise HTTPException(status_code=501, detail="项目全文检索依赖 SQLite FTS5，当前数据库不支持")
+    match = build_match_query(query)
+    if not match:
+        return 0, []
+
+    match = f'owner : "{_owner_token(user_id)}" AND {{name description documents}} : ({match})'
+    total = session.exec(text(
+        "SELECT count(*) FROM project_fts WHERE project_fts MATCH :match"
+    ).bindparams(match=match)).scalar()
+    rows = session.exec(text(
+        f"SELECT rowid, bm25(project_fts, {BM25_WEIGHTS}) AS score FROM project_fts "
+        "WHERE project_fts MATCH :match ORDER BY score LIMIT :limit OFFSET :offset"
+    ).bindparams(match=match, limit=limit, offset=offset)).all()
+    ranked = [(row[0], -row[1]) for row in rows]
+
+    projects = {p.id: p for p in session.exec(select(Project).where(Project.id.in_([pid for pid, _ in ranked]))).all()}
+    results = []
+    for project_id, score in ranked:
+        project = projects.get(project_id)
+        if not project:
+            continue
+        results.append({
+            "id": project.id,
+            "name": project.name,
+            "description": project.description,
+            "updated_at": project.updated_at,
+            "score": score,
+            "highlights": _highlights(project, query),
+        })
+    return total, results
@@ -0,0 +1,223 @@
+import hashlib
+import re
+import unicodedata
+from typing import Dict, List, Optional
+from sqlalchemy import delete, event, inspect, insert
+from sqlmodel import Session, select
+from app.core.config import settings
+from app.core.database import engine
+from app.core.shared_state import get_shared_state
+from app.models.models import Project, SimilarityBand, SimilaritySignature
+from app.services.pipeline import STAGE_OUTPUT
+from app.services.project_index import backfill_projects, field_changed
+
+# 各阶段用来判断“输入是否近似重复”的字段，命中后复用对应项目的 STAGE_OUTPUT
+STAGE_SOURCE = {
+    "requirements": "raw_requirement",
+    "product": "requirements_doc",
+    "technical": "product_doc",
+    "demo": "tech_doc",
+}
+SOURCE_FIELDS = tuple(STAGE_SOURCE.values())
+# 补建时没有任何可签名内容（如只有标点）的项目写入一条空签名作为标记，否则每轮都会被重新选中
+EMPTY_MARKER = ""
+
+# 只保留文字和数字：标点、空白和大小写差异不影响相似度
+NOISE = re.compile(r"[\W_]+", re.UNICODE)
+HASH_BITS = 64
+
+_metrics: Dict[str, Dict[str, int]] = {stage: {"lookups": 0, "hits": 0} for stage in STAGE_SOURCE}
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text[:settings.NEAR_DUP_MAX_CHARS]).lower()
+    return NOISE.sub("", text)
+
+def _shingles(text: str) -> set:
+    """字符 k-gram：不需要分词，中文同样适用"""
+    normalized = _normalize(text)
+    k = settings.NEAR_DUP_SHINGLE_CHARS
+    if len(normalized) <= k:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + k] for i in range(len(normalized) - k + 1)}
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+def signature(text: Optional[str]) -> Optional[List[int]]:
+    """
+    单次哈希 MinHash（one permutation hashing）：每个 shingle 只算一次哈希，按哈希值分到
+    NEAR_DUP_NUM_PERM 个桶中各取最小值，空桶借用右侧最近的非空桶（加偏移区分），
+    长文档的签名成本与 shingle 数线性相关，而不是乘以置换次数。
+    """
+    if not text:
+        return None
+    shingles = _shingles(text)
+    if not shingles:
+        return None
+    bins = settings.NEAR_DUP_NUM_PERM
+    empty = 1 << HASH_BITS
+    values = [empty] * bins
+    for shingle in shingles:
+        h = _hash(shingle)
+        index, value = h % bins, h // bins
+        if value < values[index]:
+            values[index] = value
+    if empty in values:
+        offset = empty // bins
+        filled = list(values)
+        for i in range(bins):
+            if values[i] != empty:
+                continue
+            for distance in range(1, bins):
+                borrowed = values[(i + distance) % bins]
+                if borrowed != empty:
+                    filled[i] = borrowed + distance * offset
+                    break
+        values = filled
+    return values
+
+def estimate(a: List[int], b: List[int]) -> float:
+    """两个签名中相同位置取值相等的比例即 Jaccard 相似度的估计"""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+def band_keys(field: str, values: List[int]) -> List[str]:
+    bands = settings.NEAR_DUP_BANDS
+    rows = len(values) // bands
+    keys = []
+    for band in range(bands):
+        chunk = ",".join(format(v, "x") for v in values[band * rows:(band + 1) * rows])
+        keys.append(f"{field}:{band}:{hashlib.blake2b(chunk.encode('ascii'), digest_size=8).hexdigest()}")
+    return keys
+
+def _encode(values: List[int]) -> str:
+    return ",".join(format(v, "x") for v in values)
+
+def _decode(raw: str) -> List[int]:
+    return [int(v, 16) for v in raw.split(",")]
+
+def _index_field(connection, project_id: int, user_id: Optional[int], field: str, text: Optional[str]) -> bool:
+    """在写入项目的同一事务中更新某个字段的签名和 LSH 分桶，返回是否写入了签名"""
+    connection.execute(delete(SimilaritySignature).where(
+        SimilaritySignature.project_id == project_id, SimilaritySignature.field == field
+    ))
+    connection.execute(delete(SimilarityBand).where(
+        SimilarityBand.project_id == project_id, SimilarityBand.band_key.startswith(f"{field}:", autoescape=True)
+    ))
+    values = signature(text)
+    if values is None:
+        return False
+    connection.execute(insert(SimilaritySignature).values(
+        project_id=project_id, field=field, user_id=user_id, signature=_encode(values)
+    ))
+    connection.execute(insert(SimilarityBand), [
+        {"band_key": key, "project_id": project_id} for key in band_keys(field, values)
+    ])
+    return True
+
+@event.listens_for(Project, "after_insert")
+def _on_insert(mapper, connection, target):
+    for field in SOURCE_FIELDS:
+        if getattr(target, field):
+            _index_field(connection, target.id, target.user_id, field, getattr(target, field))
+
+@event.listens_for(Project, "after_update")
+def _on_update(mapper, connection, target):
+    state = inspect(target)
+    for field in SOURCE_FIELDS:
+        if field_changed(state, field):
+            _index_field(connection, target.id, target.user_id, field, getattr(target, field))
+
+@event.listens_for(Project, "after_delete")
+def _on_delete(mapper, connection, target):
+    connection.execute(delete(SimilaritySignature).where(SimilaritySignature.project_id == target.id))
+    connection.execute(delete(SimilarityBand).where(SimilarityBand.project_id == target.id))
+
+def _record(stage: str, name: str):
+    _metrics[stage][name] += 1
+    state = get_shared_state()
+    if state.shared:
+        state.incr(f"neardup:{stage}:{name}")
+
+def find_similar(stage: str, text: Optional[str], user_id: int, exclude_project_id: Optional[int] = None) -> Optional[dict]:
+    """
+    查找该阶段输入最相似、且已有该阶段产物的历史项目。
+    LSH 分桶取候选（相似度远低于阈值的项目几乎不会进入候选），再用签名估计相似度精排。
+    """
+    values = signature(text)
+    if values is None or stage not in STAGE_SOURCE:
+        return None
+    _record(stage, "lookups")
+    field = STAGE_SOURCE[stage]
+    output_field = STAGE_OUTPUT[stage]
+    with Session(engine) as session:
+        candidates = select(SimilarityBand.project_id).where(
+            SimilarityBand.band_key.in_(band_keys(field, values))
+        ).distinct()
+        statement = select(SimilaritySignature).where(
+            SimilaritySignature.field == field,
+            SimilaritySignature.project_id.in_(candidates),
+        )
+        if settings.NEAR_DUP_SCOPE == "user":
+            statement = statement.where(SimilaritySignature.user_id == user_id)
+        if exclude_project_id:
+            statement = statement.where(SimilaritySignature.project_id != exclude_project_id)
+        rows = session.exec(
+            statement.order_by(SimilaritySignature.project_id.desc()).limit(settings.NEAR_DUP_MAX_CANDIDATES)
+        ).all()
+        scored = sorted(((estimate(values, _decode(row.signature)), row.project_id) for row in rows), reverse=True)
+        for similarity, project_id in scored:
+            if similarity < settings.NEAR_DUP_THRESHOLD:
+                break
+            project = session.get(Project, project_id)
+            output = getattr(project, output_field) if project else None
+            if output:
+                _record(stage, "hits")
+                return {
+                    "project_id": project_id,
+                    "name": project.name,
+                    "similarity": round(similarity, 3),
+                    "output": output,
+                }
+    return None
+
+def warm_start_enabled(requested: Optional[bool]) -> bool:
+    return settings.NEAR_DUP_ENABLED if requested is None else requested and settings.NEAR_DUP_ENABLED
+
+def _index_project(connection, project: Project) -> bool:
+    indexed = False
+    for field in SOURCE_FIELDS:
+        if getattr(project, field):
+            indexed = _index_field(connection, project.id, project.user_id, field, getattr(project, field)) or indexed
+    return indexed
+
+def _mark_empty(connection, project: Project):
+    # 字段名为空的行不会被 find_similar 匹配到
+    connection.execute(insert(SimilaritySignature).values(
+        project_id=project.id, field=EMPTY_MARKER, user_id=project.user_id, signature=""
+    ))
+
+def backfill(limit: Optional[int] = None) -> int:
+    """为尚未建立签名的历史项目补建索引（由后台维护任务分批执行），返回处理的项目数"""
+    return backfill_projects(select(SimilaritySignature.project_id), SOURCE_FIELDS, _index_project, _mark_empty, limit)
+
+def summary() -> dict:
+    """各阶段的查找次数、命中次数和命中率（多 worker 时汇总共享计数）"""
+    state = get_shared_state()
+    stages = {}
+    for stage, local in _metrics.items():
+        if state.shared:
+            counts = {name: int(state.get(f"neardup:{stage}:{name}") or 0) for name in local}
+        else:
+            counts = dict(local)
+        counts["hit_rate"] = round(counts["hits"] / counts["lookups"], 3) if counts["lookups"] else 0.0
+        stages[stage] = counts
+    lookups = sum(s["lookups"] for s in stages.values())
+    hits = sum(s["hits"] for s in stages.values())
+    return {
+        "enabled": settings.NEAR_DUP_ENABLED,
+        "threshold": settings.NEAR_DUP_THRESHOLD,
+        "lookups": lookups,
+        "hits": hits,
+        "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        "stages": stages,
+    }
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, List, Optional
+from app.core.config import settings
+from app.services.llm_service import llm_service
+from app.services.pipeline import (
+    NEXT_STAGE, STAGE_OUTPUT, STAGES, build_generation_messages, stage_inputs
+)
+
+def speculation_key(user_id: int, stage: str, model: Optional[str], docs: Dict[str, Optional[str]]) -> str:
+    """缓存 Key：用户 + 阶段 + 模型 + 该阶段的精确输入文档"""
+    payload = json.dumps(
+        [user_id, stage, model or settings.DEFAULT_MODEL, stage_inputs(stage, docs)],
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class Speculation:
+    """一次后台预测生成，可被一个后续请求认领并继续流式读取"""
+
+    def __init__(self, key: str, user_id: int, stage: str, model: Optional[str], docs: Dict[str, str]):
+        self.key = key
+        self.user_id = user_id
+        self.stage = stage
+        self.model = model
+        self.docs = docs
+        self.chunks: List[str] = []
+        self.done = False
+        self.failed = False
+        self.error: Optional[Exception] = None
+        self.created_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self._updated = asyncio.Event()
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() - self.created_at > settings.SPECULATION_TTL_SECONDS
+
+    def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+    async def run(self):
+        messages, _ = build_generation_messages(self.stage, self.docs)
+        stream = llm_service.chat_completion_stream(messages, model=self.model)
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._updated.set()
+        except asyncio.CancelledError:
+            self.failed = True
+            raise
+        except Exception as e:
+            print(f"DEBUG: Speculation failed for stage {self.stage}: {e}")
+            self.failed = True
+            self.error = e
+        finally:
+            await stream.aclose()
+            self.done = True
+            self._updated.set()
+
+    async def stream(self) -> AsyncGenerator[str, None]:
+        """先吐出已缓冲的内容，再跟随后台任务继续输出"""
+        index = 0
+        try:
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error:
+                        raise self.error
+                    return
+                self._updated.clear()
+                await self._updated.wait()
+        finally:
+            # 认领方已断开，后台生成没有继续的意义
+            self.cancel()
+
+class SpeculativePrefetcher:
+    """
+    预测式预取：用户接收某一阶段文档后，后台提前生成下一阶段。
+    结果按“阶段 + 模型 + 输入文档”精确匹配，仅在下一次请求完全一致时复用；
+    每个用户的并发预测数与缓存条数均受预算限制。
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, Speculation]" = OrderedDict()
+        # 每个用户最近一次完成的文档链路，用于补全后续阶段需要的上游文档
+        self._lineage: Dict[int, Dict[str, str]] = {}
+        self.stats = {"scheduled": 0, "hits": 0, "misses": 0, "discarded": 0}
+
+    def enabled(self, requested: Optional[bool] = None) -> bool:
+        return settings.SPECULATIVE_PREFETCH and requested is not False
+
+    def _user_entries(self, user_id: int) -> List[Speculation]:
+        return [s for s in self._entries.values() if s.user_id == user_id]
+
+    def _drop(self, spec: Speculation):
+        self._entries.pop(spec.key, None)
+        spec.cancel()
+        self.stats["discarded"] += 1
+
+    def _prune(self):
+        for spec in list(self._entries.values()):
+            if spec.expired or (spec.done and spec.failed):
+                self._drop(spec)
+
+    def claim(self, user_id: int, stage: str, model: Optional[str], docs: Dict[str, Optional[str]]) -> Optional[AsyncGenerator[str, None]]:
+        """认领与请求完全匹配的预测结果；不匹配的同阶段预测视为过期并丢弃"""
+        self._prune()
+        spec = self._entries.pop(speculation_key(user_id, stage, model, docs), None)
+        if spec:
+            self.stats["hits"] += 1
+            print(f"DEBUG: Speculation hit for user {user_id}, stage {stage}")
+            return spec.stream()
+        self.stats["misses"] += 1
+        # 用户修改了输入：同阶段的旧预测已经无用
+        for stale in self._user_entries(user_id):
+            if stale.stage == stage:
+                self._drop(stale)
+        return None
+
+    def discard_from(self, user_id: int, stage: str):
+        """丢弃某阶段及其下游的全部预测（用户修改了该阶段文档时调用）"""
+        downstream = STAGES[STAGES.index(stage):]
+        for spec in self._user_entries(user_id):
+            if spec.stage in downstream:
+                self._drop(spec)
+        self._lineage.pop(user_id, None)
+
+    def schedule(self, user_id: int, stage: str, model: Optional[str], docs: Dict[str, str]):
+        """在预算内启动后台预测"""
+        self._prune()
+        key = speculation_key(user_id, stage, model, docs)
+        if key in self._entries:
+            return
+
+        entries = self._user_entries(user_id)
+        inflight = [s for s in entries if not s.done]
+        if len(inflight) >= settings.SPECULATION_MAX_INFLIGHT_PER_USER:
+            return
+        while entries and len(entries) >= settings.SPECULATION_MAX_ENTRIES_PER_USER:
+            self._drop(entries.pop(0))
+
+        spec = Speculation(key, user_id, stage, model, stage_inputs(stage, docs))
+        spec.task = asyncio.create_task(spec.run())
+        self._entries[key] = spec
+        self.stats["scheduled"] += 1
+        print(f"DEBUG: Speculating stage {stage} for user {user_id}")
+
+    def on_stage_complete(self, user_id: int, stage: str, model: Optional[str], docs: Dict[str, Optional[str]], output: str):
+        """某阶段已完整交付给用户：记录链路并预测下一阶段"""
+        if not output:
+            return
+        lineage = self._lineage.get(user_id, {})
+        inputs = stage_inputs(stage, docs)
+        if all(lineage.get(k) == v for k, v in inputs.items()):
+            merged = {**lineage, **inputs}
+        else:
+            merged = dict(inputs)
+        merged[STAGE_OUTPUT[stage]] = output
+        # 参考资料按各阶段自己的查询检索，不沿链路传递
+        merged.pop("references", None)
+        self._lineage[user_id] = merged
+
+        next_stage = NEXT_STAGE.get(stage)
+        if next_stage:
+            self.schedule(user_id, next_stage, model, merged)
+
+    async def track(
+        self,
+        user_id: int,
+        stage: str,
+        model: Optional[str],
+        docs: Dict[str, Optional[str]],
+        source: AsyncGenerator[str, None]
+    ) -> AsyncGenerator[str, None]:
+        """透传流式输出，并在完整输出后触发下一阶段预测（客户端中途断开则不触发）"""
+        parts = []
+        try:
+            async for chunk in source:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            await source.aclose()
+        self.on_stage_complete(user_id, stage, model, docs, "".join(parts))
+
+speculator = SpeculativePrefetcher()
@@ -0,0 +1,167 @@
+import asyncio
+from typing import Any, AsyncGenerator, Optional
+import anyio
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.core import tracing
+from app.core.responses import dumps
+from app.core.shared_state import get_shared_state
+from app.services.generations import Generation, generation_registry
+from app.services.llm_service import LLMError
+
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+class StreamEvent:
+    """输出流中的结构化事件（非文档内容），仅下发给 SSE 客户端"""
+
+    def __init__(self, event: str, data: Any):
+        self.event = event
+        self.data = data
+
+class _Stopped(Exception):
+    """生成被取消或客户端已断开"""
+
+def wants_events(http_request: Request) -> bool:
+    """客户端声明 Accept: text/event-stream 时使用 SSE 事件格式，否则保持纯文本流"""
+    return "text/event-stream" in http_request.headers.get("accept", "")
+
+def format_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+async def _watch_disconnect(http_request: Request, generation: Generation):
+    """请求体已读完，之后 receive() 只会在客户端断开时返回 http.disconnect"""
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            generation.request_stop("disconnected")
+            return
+
+async def watch_remote_cancel(generation: Generation):
+    """多 worker 时取消请求可能由其他进程受理，定期检查共享状态中的取消标记"""
+    while True:
+        await asyncio.sleep(settings.GENERATION_SYNC_INTERVAL)
+        if await run_in_threadpool(generation_registry.cancel_requested, generation.id):
+            generation.request_stop("cancelled")
+            return
+
+class _GuardedSource:
+    """
+    逐个读取上游 Token，同时监听取消/断开信号。
+    一旦停止，立即取消正在等待的读取并关闭生成器，上游 HTTP 流随之关闭。
+    """
+
+    def __init__(self, source: AsyncGenerator[str, None], generation: Generation, http_request: Request):
+        self.source = source
+        self.generation = generation
+        self._watchers = [asyncio.ensure_future(_watch_disconnect(http_request, generation))]
+        if get_shared_state().shared:
+            self._watchers.append(asyncio.ensure_future(watch_remote_cancel(generation)))
+        self._stopped = asyncio.ensure_future(generation.stopped.wait())
+        self._step: Optional[asyncio.Future] = None
+
+    async def next(self) -> str:
+        """返回下一个片段；正常结束抛 StopAsyncIteration，被停止抛 _Stopped"""
+        self._step = asyncio.ensure_future(self.source.__anext__())
+        await asyncio.wait({self._step, self._stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if not self._step.done():
+            raise _Stopped()
+        step, self._step = self._step, None
+        return step.result()
+
+    async def close(self):
+        # 即使所在任务正被取消（例如 Starlette 检测到断开），也要完成上游流的关闭
+        with anyio.CancelScope(shield=True):
+            for watcher in self._watchers:
+                watcher.cancel()
+            self._stopped.cancel()
+            if self._step is not None and not self._step.done():
+                self._step.cancel()
+                await asyncio.wait({self._step})
+            await self.source.aclose()
+
+async def _encode(first: Optional[str], guarded: _GuardedSource, sse: bool) -> AsyncGenerator[str, None]:
+    generation = guarded.generation
+    try:
+        if sse:
+            yield format_event("start", {"generation_id": generation.id, "prompt": generation.prompt_stats})
+        chunk = first
+        while True:
+            if isinstance(chunk, StreamEvent):
+                if sse:
+                    yield format_event(chunk.event, chunk.data)
+            elif chunk:
+                generation.record(chunk)
+                generation_registry.sync(generation)
+                yield format_event("token", {"content": chunk}) if sse else chunk
+            try:
+                chunk = await guarded.next()
+            except StopAsyncIteration:
+                generation_registry.finish(generation, "completed")
+                break
+    except _Stopped:
+        pass
+    except LLMError as e:
+        # 流中途失败：SSE 客户端收到结构化错误事件，纯文本客户端的内容不会被错误文本污染
+        print(f"DEBUG: Stream aborted: {e.message}")
+        generation_registry.finish(generation, "failed", e.message)
+        if sse:
+            yield format_event("error", e.to_dict())
+        return
+    finally:
+        await guarded.close()
+        # 未正常结束又没有明确原因：客户端在发送过程中断开
+        generation_registry.finish(generation, generation.stop_reason or "disconnected")
+    if sse:
+        if generation.status == "cancelled":
+            yield format_event("cancelled", generation.snapshot())
+        else:
+            yield format_event("done", generation.snapshot())
+
+async def stream_response(
+    source: AsyncGenerator[str, None],
+    http_request: Request,
+    user_id: int,
+    stage: str,
+    prompt_stats: Optional[dict] = None
+) -> Response:
+    """
+    等到首个 Token 再开始响应：首 Token 前的失败（重试耗尽/熔断）以 HTTP 错误返回，
+    之后的失败以 error 事件结束流。生成过程登记在 generation_registry 中，
+    客户端断开或调用取消接口时立即关闭上游流。
+    """
+    generation = generation_registry.start(user_id, stage, prompt_stats)
+    tracing.annotate("generation.id", generation.id)
+    guarded = _GuardedSource(source, generation, http_request)
+    try:
+        first = await guarded.next()
+    except StopAsyncIteration:
+        first = None
+    except _Stopped:
+        await guarded.close()
+        generation_registry.finish(generation, generation.stop_reason)
+        # 客户端已离开（或已取消），响应内容不会被读取
+        return Response(status_code=499)
+    except LLMError as e:
+        await guarded.close()
+        generation_registry.finish(generation, "failed", e.message)
+        status_code = 503 if e.code == "circuit_open" else 502
+        if e.code == "invalid_request":
+            status_code = 400
+        raise HTTPException(status_code=status_code, detail=e.message)
+    except BaseException:
+        await guarded.close()
+        generation_registry.finish(generation, "disconnected")
+        raise
+
+    sse = wants_events(http_request)
+    return StreamingResponse(
+        _encode(first, guarded, sse),
+        media_type="text/event-stream",
+        headers={**STREAM_HEADERS, "X-Generation-Id": generation.id},
+    )
@@ -0,0 +1,120 @@
+"""
+冷启动导入耗时报告（基于 python -X importtime）
+
+用法（在 backend 目录下）：
+    python benchmarks/import_time.py                  # 默认分析 app.main
+    python benchmarks/import_time.py --top 30 --budget-ms 800
+    python benchmarks/import_time.py --module app.services.llm_service
+    python benchmarks/import_time.py --startup        # 另外测量 lifespan 初始化（会读写本地 database.db）
+
+输出：
+1. 进程冷启动导入总耗时（取多次运行的中位数）；
+2. 按累计耗时排序的顶层依赖（fastapi、sqlalchemy 等）；
+3. 项目自身模块（app.*）的累计耗时；
+4. 指定 --startup 时，导入后执行 startup.initialize() 的耗时（数据库已初始化、管理员已存在的常规重启场景）；
+5. 超出 --budget-ms 时以非零状态码退出，可接入 CI。
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def run_importtime(module: str) -> List[Tuple[str, int, int, int]]:
+    """返回 [(模块名, 自身耗时 us, 累计耗时 us, 嵌套深度)]"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr[-2000:])
+        raise SystemExit(f"导入 {module} 失败")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+def wall_time_ms(module: str) -> float:
+    """不带 -X importtime 的真实导入耗时（importtime 自身有额外开销）"""
+    code = f"import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr[-2000:])
+        raise SystemExit(f"导入 {module} 失败")
+    return float(result.stdout.strip().splitlines()[-1])
+
+def startup_time_ms() -> float:
+    code = (
+        "import time; import app.main; from app.core.startup import initialize; "
+        "t = time.perf_counter(); initialize(); print((time.perf_counter() - t) * 1000)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr[-2000:])
+        raise SystemExit("startup.initialize() 执行失败")
+    return float(result.stdout.strip().splitlines()[-1])
+
+def top_level(rows: List[Tuple[str, int, int, int]]) -> Dict[str, int]:
+    """按顶层包汇总累计耗时：同一个包只统计最先（最外层）导入的那一次"""
+    totals: Dict[str, int] = {}
+    for name, _, cumulative, _ in rows:
+        package = name.split(".")[0]
+        totals[package] = max(totals.get(package, 0), cumulative)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="python -X importtime 冷启动报告")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--startup", action="store_true", help="同时测量 startup.initialize() 耗时并计入预算")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1000")))
+    args = parser.parse_args()
+
+    # 先导入一次生成 .pyc，后面测的是部署后（已编译）的冷启动
+    wall_time_ms(args.module)
+    samples = [wall_time_ms(args.module) for _ in range(args.runs)]
+    median = statistics.median(samples)
+    rows = run_importtime(args.module)
+
+    print(f"== import {args.module}: median {median:.0f} ms over {args.runs} runs "
+          f"(min {min(samples):.0f} / max {max(samples):.0f}) ==")
+
+    print(f"\n-- top {args.top} packages by cumulative import time (importtime, ms) --")
+    packages = sorted(top_level(rows).items(), key=lambda item: item[1], reverse=True)
+    for package, cumulative in packages[:args.top]:
+        print(f"{cumulative / 1000:10.1f}  {package}")
+
+    print(f"\n-- app modules (self / cumulative, ms) --")
+    app_rows = sorted((r for r in rows if r[0].startswith("app.")), key=lambda r: r[2], reverse=True)
+    for name, self_us, cumulative, _ in app_rows[:args.top]:
+        print(f"{self_us / 1000:10.1f} {cumulative / 1000:10.1f}  {name}")
+
+    lazy = [name for name in ("openai", "pypdf", "brotli", "redis") if any(r[0] == name for r in rows)]
+    if lazy:
+        print(f"\n!! 以下依赖应当按需导入，却出现在启动路径中: {', '.join(lazy)}")
+
+    total = median
+    if args.startup:
+        # 第一次执行可能需要建表/创建管理员，不计入
+        startup_time_ms()
+        startup = statistics.median(startup_time_ms() for _ in range(args.runs))
+        total += startup
+        print(f"\n-- startup.initialize(): median {startup:.0f} ms, import + startup {total:.0f} ms --")
+
+    if total > args.budget_ms:
+        print(f"\nFAIL: {total:.0f} ms > budget {args.budget_ms:.0f} ms")
+        sys.exit(1)
+    print(f"\nOK: {total:.0f} ms <= budget {args.budget_ms:.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""
+可复现的压测：按权重混合调用 /stream/*、Demo 数据存取和项目增删改查，
+统计吞吐、首 Token 延迟（TTFT）、p50/p95/p99 与错误率，输出 JSON 报告并可与基线比较。
+被限流的请求（HTTP 429）单独计入 rate_limited，不算错误，也不计入吞吐。
+
+用法（在 backend 目录下）：
+    # 自动启动模拟 LLM 与后端（临时目录中的独立数据库），压测 60 秒
+    python benchmarks/load_test.py --spawn --duration 60 --concurrency 16 --output benchmarks/results/latest.json
+
+    # 保存为基线；之后的改动与基线比较，超出容差时以非零状态码退出
+    cp benchmarks/results/latest.json benchmarks/results/baseline.json
+    python benchmarks/load_test.py --spawn --baseline benchmarks/results/baseline.json
+
+    # 压测已运行的服务（后端需已指向模拟 LLM：OPENAI_BASE_URL=http://127.0.0.1:9100/v1）
+    python benchmarks/load_test.py --base-url http://127.0.0.1:8000
+
+    # 注入故障：10% 上游 503、5% 流中途断开
+    python benchmarks/load_test.py --spawn --mock-error-rate 0.1 --mock-disconnect-rate 0.05
+
+混合比例通过 --mix 调整，例如 --mix stream_demo=2,project_crud=1,demo_data=5
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API = "/api/v1"
+
+DOC = "# 需求文档\n\n" + "系统需要支持设备台账管理、告警处理与统计报表。\n" * 40
+HTML = "<!DOCTYPE html><html><body>" + "".join(
+    f'<div data-trace-id="t{i}"><h2>模块 {i}</h2><p>数据列表</p></div>' for i in range(40)
+) + "</body></html>"
+
+# 场景名 -> 默认权重
+DEFAULT_MIX = {
+    "stream_requirements": 2,
+    "stream_product": 1,
+    "stream_technical": 1,
+    "stream_demo": 1,
+    "stream_report": 1,
+    "stream_iterate": 1,
+    "stream_partial_edit": 1,
+    "project_crud": 3,
+    "project_list": 3,
+    "demo_data": 6,
+}
+
+STREAM_PAYLOADS = {
+    "stream_requirements": lambda: {"raw_requirement": "设计一个设备管理系统，支持台账、告警和报表", "speculate": False},
+    "stream_product": lambda: {"requirements_doc": DOC, "speculate": False},
+    "stream_technical": lambda: {"product_doc": DOC, "speculate": False},
+    "stream_demo": lambda: {"tech_doc": DOC, "requirements_doc": DOC, "speculate": False},
+    "stream_report": lambda: {"requirements_doc": DOC, "tech_doc": DOC, "demo_code": HTML},
+    "stream_iterate": lambda: {"current_code": HTML, "user_feedback": "把标题改成蓝色"},
+    "stream_partial_edit": lambda: {
+        "current_code": HTML,
+        "user_feedback": "增加一个按钮",
+        "selected_elements": [{"selector": "div[data-trace-id=t3]", "html": '<div data-trace-id="t3"></div>', "traceId": "t3"}],
+    },
+}
+
+class Recorder:
+    """按操作名收集每次请求的耗时、TTFT 和成败"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[dict]] = {}
+
+    def record(self, name: str, latency: float, ok: bool, ttft: Optional[float] = None, error: Optional[str] = None):
+        self.samples.setdefault(name, []).append({"latency": latency, "ok": ok, "ttft": ttft, "error": error})
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近秩法百分位"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def distribution(values: List[float]) -> Optional[dict]:
+    if not values:
+        return None
+    ms = [v * 1000 for v in values]
+    return {
+        "p50": round(percentile(ms, 50), 1),
+        "p95": round(percentile(ms, 95), 1),
+        "p99": round(percentile(ms, 99), 1),
+        "mean": round(sum(ms) / len(ms), 1),
+        "max": round(max(ms), 1),
+    }
+
+RATE_LIMITED = "HTTP 429"
+
+def summarize(samples: List[dict], elapsed: float) -> dict:
+    # 429 是限流策略生效而不是服务故障，单独统计，避免把限流次数当成错误率或吞吐回归
+    limited = [s for s in samples if s["error"] == RATE_LIMITED]
+    errors = [s for s in samples if not s["ok"] and s["error"] != RATE_LIMITED]
+    error_kinds: Dict[str, int] = {}
+    for s in errors:
+        error_kinds[s["error"]] = error_kinds.get(s["error"], 0) + 1
+    ok = [s for s in samples if s["ok"]]
+    return {
+        "count": len(samples),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 0.0,
+        "error_kinds": error_kinds,
+        "rate_limited": len(limited),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": distribution([s["latency"] for s in ok]),
+        "ttft_ms": distribution([s["ttft"] for s in ok if s["ttft"] is not None]),
+    }
+
+class Client:
+    def __init__(self, http: httpx.AsyncClient, recorder: Recorder, project_ids: List[int]):
+        self.http = http
+        self.recorder = recorder
+        # Demo 数据场景分散到多个项目，模拟多个 Demo 同时被访问，而不是压测单个项目的限流
+        self.project_ids = project_ids
+
+    async def call(self, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.record(name, time.perf_counter() - start, False, error=type(e).__name__)
+            return None
+        ok = response.status_code < 400
+        self.recorder.record(name, time.perf_counter() - start, ok, error=None if ok else f"HTTP {response.status_code}")
+        return response if ok else None
+
+    async def stream(self, name: str, payload: dict):
+        """SSE 流：TTFT 以收到第一个 token 事件计，error 事件或未收到 done 视为失败"""
+        path = f"{API}/generation/stream/{name[len('stream_'):]}"
+        start = time.perf_counter()
+        ttft = None
+        event = None
+        finished = None
+        try:
+            async with self.http.stream("POST", path, json=payload, headers={"Accept": "text/event-stream"}) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    self.recorder.record(name, time.perf_counter() - start, False, error=f"HTTP {response.status_code}")
+                    return
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                        if event == "token" and ttft is None:
+                            ttft = time.perf_counter() - start
+                        elif event in ("done", "error", "cancelled"):
+                            finished = event
+        except httpx.HTTPError as e:
+            self.recorder.record(name, time.perf_counter() - start, False, ttft, error=type(e).__name__)
+            return
+        ok = finished == "done"
+        self.recorder.record(name, time.perf_counter() - start, ok, ttft, error=None if ok else f"event {finished or 'missing'}")
+
+async def scenario_project_crud(client: Client):
+    response = await client.call("project_create", "POST", f"{API}/generation/projects/",
+                                 json={"name": f"压测项目 {random.randint(0, 1 << 30)}", "description": "benchmark"})
+    if response is None:
+        return
+    project_id = response.json()["id"]
+    await client.call("project_get", "GET", f"{API}/generation/projects/{project_id}")
+    await client.call("project_update", "PATCH", f"{API}/generation/projects/{project_id}", json={"requirements_doc": DOC})
+    await client.call("project_delete", "DELETE", f"{API}/generation/projects/{project_id}")
+
+async def scenario_project_list(client: Client):
+    response = await client.call("project_list", "GET", f"{API}/generation/projects/",
+                                 params={"limit": 20, "fields": "id,name,updated_at"})
+    cursor = response.headers.get("X-Next-Cursor") if response is not None else None
+    if cursor:
+        await client.call("project_list_next", "GET", f"{API}/generation/projects/",
+                          params={"limit": 20, "fields": "id,name,updated_at", "cursor": cursor})
+
+async def scenario_demo_data(client: Client):
+    key = f"bench_{random.randint(0, 19)}"
+    rows = [{"id": i, "name": f"设备{i}", "status": random.choice(["正常", "告警"])} for i in range(50)]
+    base = f"{API}/demo/{random.choice(client.project_ids)}/data/{key}"
+    await client.call("demo_data_save", "POST", base, json=rows)
+    await client.call("demo_data_get", "GET", base)
+    if random.random() < 0.1:
+        await client.call("demo_data_clear", "DELETE", base)
+
+def build_scenarios() -> Dict[str, Callable[[Client], Awaitable[None]]]:
+    scenarios: Dict[str, Callable[[Client], Awaitable[None]]] = {
+        "project_crud": scenario_project_crud,
+        "project_list": scenario_project_list,
+        "demo_data": scenario_demo_data,
+    }
+    for name, payload in STREAM_PAYLOADS.items():
+        scenarios[name] = lambda client, name=name, payload=payload: client.stream(name, payload())
+    return scenarios
+
+def parse_mix(value: Optional[str]) -> Dict[str, float]:
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"未知场景: {name}（可选: {', '.join(DEFAULT_MIX)}）")
+        mix[name] = float(weight or 1)
+    return mix
+
+async def setup(http: httpx.AsyncClient, username: str, password: str, demo_projects: int) -> List[int]:
+    response = await http.post(f"{API}/auth/login", data={"username": username, "password": password})
+    response.raise_for_status()
+    http.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    project_ids = []
+    for i in range(max(1, demo_projects)):
+        response = await http.post(f"{API}/generation/projects/", json={"name": f"压测 Demo 数据 {i}", "description": "benchmark"})
+        response.raise_for_status()
+        project_ids.append(response.json()["id"])
+    return project_ids
+
+async def run_load(args) -> dict:
+    mix = parse_mix(args.mix)
+    scenarios = build_scenarios()
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as http:
+        project_ids = await setup(http, args.username, args.password, args.demo_projects)
+        client = Client(http, recorder, project_ids)
+        issued = 0
+
+        async def worker():
+            # 场景序列由 seed 决定，相同参数下各次运行的请求组合一致
+            nonlocal issued
+            while (issued < args.requests) if args.requests else (time.perf_counter() < deadline):
+                issued += 1
+                await scenarios[rng.choices(names, weights=weights)[0]](client)
+
+        if args.warmup:
+            # 预热：各场景各执行一次，不计入结果
+            warm = Client(http, Recorder(), project_ids)
+            await asyncio.gather(*(scenarios[name](warm) for name in names))
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        for project_id in project_ids:
+            await http.delete(f"{API}/generation/projects/{project_id}")
+
+    all_samples = [s for samples in recorder.samples.values() for s in samples]
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_s": round(elapsed, 2),
+            "seed": args.seed,
+            "mix": mix,
+            "mock": _mock_settings(args),
+            "demo_rate_limit": getattr(args, "demo_rate_limit", None),
+        },
+        "overall": summarize(all_samples, elapsed),
+        "operations": {name: summarize(samples, elapsed) for name, samples in sorted(recorder.samples.items())},
+    }
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def _mock_settings(args) -> dict:
+    return {key[len("mock_"):]: value for key, value in vars(args).items() if key.startswith("mock_") and value is not None}
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """返回回归项：p95 延迟 / TTFT 变慢、吞吐下降超过容差，或错误率上升超过 1 个百分点"""
+    regressions = []
+    for name, current in report["operations"].items():
+        base = baseline.get("operations", {}).get(name)
+        if not base or not current["count"]:
+            continue
+        for metric in ("latency_ms", "ttft_ms"):
+            if current[metric] and base.get(metric):
+                now, before = current[metric]["p95"], base[metric]["p95"]
+                if before and now > before * (1 + tolerance):
+                    regressions.append(f"{name}: {metric} p95 {before} -> {now}")
+        if base["throughput_rps"] and current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {current['throughput_rps']} rps")
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name}: error_rate {base['error_rate']} -> {current['error_rate']}")
+        if current.get("rate_limited") and not base.get("rate_limited"):
+            regressions.append(f"{name}: {current['rate_limited']} 次请求被限流（HTTP 429），吞吐与基线不可比")
+    return regressions
+
+def print_report(report: dict):
+    print(f"\n{'operation':<24}{'count':>7}{'err%':>7}{'429':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'ttft50':>9}{'ttft95':>9}")
+    rows = list(report["operations"].items()) + [("OVERALL", report["overall"])]
+    for name, item in rows:
+        latency = item["latency_ms"] or {}
+        ttft = item["ttft_ms"] or {}
+        print(f"{name:<24}{item['count']:>7}{item['error_rate'] * 100:>7.1f}{item.get('rate_limited', 0):>7}{item['throughput_rps']:>8.1f}"
+              f"{latency.get('p50', '-'):>9}{latency.get('p95', '-'):>9}{latency.get('p99', '-'):>9}"
+              f"{ttft.get('p50', '-'):>9}{ttft.get('p95', '-'):>9}")
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"进程启动失败: {url}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"等待服务就绪超时: {url}")
+
+def spawn(args) -> List[subprocess.Popen]:
+    """在临时目录中启动模拟 LLM 和后端，数据库、上传目录都是全新的，结果可复现"""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    mock_port, app_port = _free_port(), _free_port()
+    mock_cmd = [sys.executable, os.path.join(BACKEND_DIR, "benchmarks", "mock_llm.py"), "--port", str(mock_port)]
+    for key, value in _mock_settings(args).items():
+        mock_cmd += [f"--{key.replace('_', '-')}", str(value)]
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+        "OPENAI_API_KEY": "mock",
+        "PYTHONPATH": BACKEND_DIR,
+    })
+    # 压测衡量的是服务本身的吞吐，Demo 数据的限流默认关闭（设置环境变量 DEMO_RATE_LIMIT_ENABLED=true 可单独压测限流）
+    env.setdefault("DEMO_RATE_LIMIT_ENABLED", "false")
+    args.demo_rate_limit = env["DEMO_RATE_LIMIT_ENABLED"]
+    if args.workers > 1:
+        env.setdefault("SHARED_STATE_BACKEND", "sqlite")
+    app_cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port),
+               "--workers", str(args.workers), "--log-level", "warning"]
+    log = open(os.path.join(workdir, "server.log"), "w")
+    processes = [
+        subprocess.Popen(mock_cmd, cwd=workdir, stdout=log, stderr=subprocess.STDOUT),
+        subprocess.Popen(app_cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT),
+    ]
+    _wait_ready(f"http://127.0.0.1:{mock_port}/mock/config", processes[0])
+    _wait_ready(f"http://127.0.0.1:{app_port}{API}/openapi.json", processes[1])
+    args.base_url = f"http://127.0.0.1:{app_port}"
+    args.workdir = workdir
+    print(f"已启动模拟 LLM :{mock_port} 与后端 :{app_port}（工作目录 {workdir}）")
+    return processes
+
+def main():
+    parser = argparse.ArgumentParser(description="后端压测与基线比较")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="压测时长（秒）")
+    parser.add_argument("--requests", type=int, default=0, help="改为固定场景次数（优先于 --duration）")
+    parser.add_argument("--mix", help="场景权重，如 stream_demo=2,demo_data=5")
+    parser.add_argument("--demo-projects", type=int, default=16, help="Demo 数据场景分散到的项目数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    parser.add_argument("--output", default=os.path.join(BACKEND_DIR, "benchmarks", "results", "latest.json"))
+    parser.add_argument("--baseline", help="基线报告，超出容差时以状态码 1 退出")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--spawn", action="store_true", help="自动启动模拟 LLM 与后端")
+    parser.add_argument("--workers", type=int, default=1, help="--spawn 时后端的 worker 数")
+    parser.add_argument("--keep", action="store_true", help="--spawn 时保留临时工作目录（含服务日志）")
+    for name in ("ttft-ms", "tokens-per-sec", "jitter", "error-rate", "disconnect-rate", "slow-rate", "slow-ttft-ms"):
+        parser.add_argument(f"--mock-{name}", type=float)
+    parser.add_argument("--mock-output-tokens", type=int)
+    args = parser.parse_args()
+
+    processes = spawn(args) if args.spawn else []
+    try:
+        report = asyncio.run(run_load(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        if processes and not args.keep:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    print_report(report)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n报告已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n与基线相比出现回归（容差 {args.tolerance:.0%}）：")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\n未发现超出 {args.tolerance:.0%} 容差的回归（基线 {baseline['meta'].get('git_commit')}）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+本地 OpenAI 兼容模拟服务，供压测使用（不消耗真实模型额度，延迟和故障可控）
+
+用法（在 backend 目录下）：
+    python benchmarks/mock_llm.py --port 9100 --ttft-ms 300 --tokens-per-sec 80
+    # 后端指向模拟服务
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=mock uvicorn app.main:app
+
+接口：
+    POST /v1/chat/completions   流式 / 非流式补全
+    GET  /mock/config           当前配置
+    POST /mock/config           运行中修改配置（JSON，字段同命令行参数，下划线形式）
+    GET  /mock/stats            请求计数（总数、注入的失败、中断、慢请求）
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import asdict, dataclass, fields
+from typing import AsyncGenerator, Dict, List
+import uvicorn
+from fastapi import Body, FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+@dataclass
+class MockConfig:
+    # 首 Token 延迟与输出速率
+    ttft_ms: float = 300.0
+    tokens_per_sec: float = 80.0
+    jitter: float = 0.2
+    output_tokens: int = 400
+    # 故障注入：请求直接返回错误状态码 / 流输出到一半断开 / 首 Token 特别慢
+    error_rate: float = 0.0
+    error_status: int = 503
+    disconnect_rate: float = 0.0
+    slow_rate: float = 0.0
+    slow_ttft_ms: float = 5000.0
+    seed: int = 0
+
+WORDS = [
+    "系统", "用户", "数据", "模块", "接口", "页面", "管理", "配置", "状态", "列表",
+    "查询", "统计", "权限", "流程", "任务", "设备", "告警", "日志", "报表", "审批",
+]
+
+config = MockConfig()
+stats: Dict[str, int] = {"requests": 0, "streams": 0, "errors": 0, "disconnects": 0, "slow": 0}
+rng = random.Random(config.seed)
+
+app = FastAPI(title="Mock LLM")
+
+def _tokens(count: int) -> List[str]:
+    """输出一段 HTML（生成原型的阶段会按 HTML 处理），正文由随机词组成"""
+    tokens = ["<!DOCTYPE html>", "\n<html><head><title>", "Mock", "</title></head>", "<body>\n", "<div>"]
+    while len(tokens) < count - 3:
+        tokens.append(rng.choice(WORDS))
+        if rng.random() < 0.08:
+            tokens.append("</div>\n<div>")
+    tokens += ["</div>", "\n</body>", "</html>"]
+    return tokens
+
+def _delay(base_ms: float) -> float:
+    return max(0.0, base_ms * (1 + rng.uniform(-config.jitter, config.jitter)) / 1000)
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+async def _stream(completion_id: str, model: str, ttft: float, disconnect: bool) -> AsyncGenerator[str, None]:
+    tokens = _tokens(config.output_tokens)
+    cut = len(tokens) // 2 if disconnect else None
+    await asyncio.sleep(ttft)
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+    interval = 1000.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+    for i, token in enumerate(tokens):
+        if i == cut:
+            # 不发送 [DONE] 直接断开，模拟上游流中途中断
+            raise ConnectionResetError("mock upstream disconnect")
+        if i:
+            await asyncio.sleep(_delay(interval))
+        yield _chunk(completion_id, model, {"content": token})
+    yield _chunk(completion_id, model, {}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model") or "mock"
+    stats["requests"] += 1
+    if rng.random() < config.error_rate:
+        stats["errors"] += 1
+        return JSONResponse(
+            status_code=config.error_status,
+            content={"error": {"message": "mock injected error", "type": "server_error"}}
+        )
+    ttft = _delay(config.ttft_ms)
+    if rng.random() < config.slow_rate:
+        stats["slow"] += 1
+        ttft = _delay(config.slow_ttft_ms)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    if body.get("stream"):
+        stats["streams"] += 1
+        disconnect = rng.random() < config.disconnect_rate
+        if disconnect:
+            stats["disconnects"] += 1
+        return StreamingResponse(_stream(completion_id, model, ttft, disconnect), media_type="text/event-stream")
+
+    await asyncio.sleep(ttft)
+    tokens = _tokens(config.output_tokens)
+    if config.tokens_per_sec > 0:
+        await asyncio.sleep(len(tokens) / config.tokens_per_sec)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+    }
+
+@app.get("/mock/config")
+def get_config():
+    return asdict(config)
+
+@app.post("/mock/config")
+def update_config(payload: dict = Body(...)):
+    names = {f.name for f in fields(MockConfig)}
+    for key, value in payload.items():
+        if key not in names:
+            return JSONResponse(status_code=400, content={"detail": f"未知配置项: {key}"})
+        setattr(config, key, type(getattr(config, key))(value))
+    if "seed" in payload:
+        rng.seed(config.seed)
+    return asdict(config)
+
+@app.get("/mock/stats")
+def get_stats():
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的模拟 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for f in fields(MockConfig):
+        parser.add_argument(f"--{f.name.replace('_', '-')}", type=type(f.default), default=f.default)
+    args = parser.parse_args()
+    for f in fields(MockConfig):
+        setattr(config, f.name, getattr(args, f.name))
+    rng.seed(config.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# 多进程部署配置：gunicorn -c gunicorn.conf.py app.main:app
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+# 默认每个 CPU 核一个 worker（每个 worker 是独立的事件循环）
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+try:
+    import uvicorn_worker  # noqa: F401  新版 uvicorn 把 worker 拆到了独立包
+    worker_class = "uvicorn_worker.UvicornWorker"
+except ImportError:
+    worker_class = "uvicorn.workers.UvicornWorker"
+
+# 事件循环被阻塞超过该时间才会被判定为卡死；流式响应本身不受影响
+timeout = int(os.getenv("WORKER_TIMEOUT", 120))
+# 重启/缩容（kill -TTOU）时给进行中的流式生成留出结束时间
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 120))
+keepalive = 5
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# 多个 worker 之间的限流计数、缓存和生成快照需要共享；未显式配置时使用本机 SQLite 文件
+if workers > 1:
+    os.environ.setdefault("SHARED_STATE_BACKEND", "sqlite")
+
+def on_starting(server):
+    """主进程在 fork worker 之前完成一次建表/迁移/初始化，worker 启动时这些步骤都是空操作"""
+    from app.core.startup import initialize
+    from app.core.database import engine
+    initialize()
+    # 不把主进程打开的数据库连接带进子进程
+    engine.dispose()
@@ -32,6 +32,7 @@ const fetchStream = async (url, body, onChunk, onDone, onError, signal) => {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
           'Authorization': `Bearer ${token}`
         },
         body: JSON.stringify(body),
@@ -104,14 +105,44 @@ const fetchStream = async (url, body, onChunk, onDone, onError, signal) => {
     // 启动打字机循环
     updateDisplay();
 
+    // SSE 解析：token 事件追加内容，error 事件为结构化的上游错误
+    let buffer = '';
+    let streamError = null;
+    const handleEvent = (raw) => {
+      let event = 'message';
+      let data = '';
+      raw.split('\n').forEach((line) => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      if (!data) return;
+      const payload = JSON.parse(data);
+      if (event === 'token') {
+        fullText += payload.content;
+      } else if (event === 'start' && payload.prompt && payload.prompt.warm_start) {
+        const { name, similarity } = payload.prompt.warm_start;
+        message.info(`输入与历史项目「${name}」高度相似（${Math.round(similarity * 100)}%），已在其基础上修改生成`);
+      } else if (event === 'error') {
+        streamError = new Error(payload.message || '生成中断');
+      }
+    };
+
     while (true) {
       const { done, value } = await reader.read();
       if (done) {
         isStreamDone = true;
         break;
       }
-      const chunk = decoder.decode(value, { stream: true });
-      fullText += chunk;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        handleEvent(buffer.slice(0, boundary));
+        buffer = buffer.slice(boundary + 2);
+      }
+    }
+    if (streamError) {
+      isAborted = true;
+      throw streamError;
     }
   } catch (error) {
     if (error.name === 'AbortError') return;
@@ -121,6 +152,74 @@ const fetchStream = async (url, body, onChunk, onDone, onError, signal) => {
   }
 };
 
+// --- Helper: 原型编辑会话（WebSocket） ---
+// 连接时认证一次并由服务端持有当前代码，之后每次修改只发送意见和选中元素的 data-trace-id
+const sha1Hex = async (text) => {
+  if (!window.crypto?.subtle) return null; // 非安全上下文（http 内网访问）不可用
+  const digest = await window.crypto.subtle.digest('SHA-1', new TextEncoder().encode(text));
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+};
+
+const openEditSession = (projectId, getLocalCode) => {
+  const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+  const socket = new WebSocket(`${protocol}//${window.location.host}/api/v1/editing/projects/${projectId}/ws`);
+  const session = { ready: false, serverCode: null, current: null };
+
+  const send = (payload) => socket.send(JSON.stringify(payload));
+
+  socket.onopen = () => send({ type: 'auth', token: localStorage.getItem('token') });
+  socket.onmessage = async (e) => {
+    const msg = JSON.parse(e.data);
+    if (msg.type === 'ready') {
+      // 服务端保存的代码与本地不一致（本地有未保存的手工修改）时上传一次
+      const local = getLocalCode();
+      if (local && (await sha1Hex(local)) !== msg.hash) send({ type: 'sync', code: local });
+      session.serverCode = local;
+      session.ready = true;
+      return;
+    }
+    const current = session.current;
+    if (!current) return;
+    if (msg.type === 'token') {
+      current.text += msg.content;
+      current.onChunk(current.text);
+    } else if (msg.type === 'done') {
+      session.current = null;
+      if (msg.saved) session.serverCode = current.text;
+      current.resolve({ text: current.text, saved: msg.saved });
+    } else if (msg.type === 'cancelled') {
+      session.current = null;
+      current.resolve(null);
+    } else if (msg.type === 'error') {
+      session.current = null;
+      current.reject(new Error(msg.message || '修改失败'));
+    }
+  };
+  socket.onclose = () => {
+    session.ready = false;
+    if (session.current) {
+      session.current.reject(new Error('编辑会话已断开'));
+      session.current = null;
+    }
+  };
+
+  // 返回 Promise：完成时为 { text, saved }，被取消时为 null
+  session.edit = (payload, onChunk, signal) => new Promise((resolve, reject) => {
+    const local = getLocalCode();
+    if (local !== session.serverCode) {
+      send({ type: 'sync', code: local });
+      session.serverCode = local;
+    }
+    session.current = { text: '', onChunk, resolve, reject };
+    signal?.addEventListener('abort', () => {
+      if (socket.readyState === WebSocket.OPEN) send({ type: 'cancel' });
+    });
+    send({ type: 'edit', ...payload });
+  });
+  session.close = () => socket.close();
+  return session;
+};
+
 const SingleEditor = ({ content, setContent, title, onSave }) => {
     // 默认开启预览模式，除非内容为空
     const [isPreview, setIsPreview] = useState(!!content);
@@ -231,28 +330,18 @@ const SingleEditor = ({ content, setContent, title, onSave }) => {
 };
 
 const App = () => {
-  const [isPublicPreview, setIsPublicPreview] = useState(window.location.pathname.startsWith('/preview/'));
-  const [publicData, setPublicData] = useState(null);
+  const isPublicPreview = window.location.pathname.startsWith('/preview/');
 
   useEffect(() => {
     if (isPublicPreview) {
+      // 旧分享链接：跳转到后端直接下发的 Demo 快照
       const token = window.location.pathname.split('/').pop();
-      axios.get(`/api/v1/generation/public/preview/${token}`)
-        .then(res => setPublicData(res.data))
-        .catch(() => message.error('预览链接无效或已过期'));
+      window.location.replace(`/api/v1/generation/public/demo/${token}`);
     }
   }, [isPublicPreview]);
 
   if (isPublicPreview) {
-    if (!publicData) return <div style={{ display: 'flex', height: '100vh', alignItems: 'center', justifyContent: 'center' }}><Spin size="large" tip="正在加载预览..." /></div>;
-    const injection = `<script>window.PROJECT_ID = ${publicData.project_id};</script>`;
-    return (
-      <iframe 
-        srcDoc={injection + publicData.demo_code} 
-        style={{ width: '100vw', height: '100vh', border: 'none' }}
-        title={publicData.name}
-      />
-    );
+    return <div style={{ display: 'flex', height: '100vh', alignItems: 'center', justifyContent: 'center' }}><Spin size="large" tip="正在加载预览..." /></div>;
   }
   // --- State ---
   const [loginForm] = Form.useForm();
@@ -266,6 +355,7 @@ const App = () => {
   const [isAdmin, setIsAdmin] = useState(localStorage.getItem('is_admin') === 'true');
   const [showAdmin, setShowAdmin] = useState(false);
   const [licenses, setLicenses] = useState([]);
+  const [licenseCursor, setLicenseCursor] = useState(null);
   const [shareUrl, setShareUrl] = useState('');
   const [showShareModal, setShowShareModal] = useState(false);
   const [previewScale, setPreviewScale] = useState(1);
@@ -349,7 +439,7 @@ const App = () => {
       const res = await axios.post(`/api/v1/generation/projects/${currentProjectId}/publish`, {}, {
         headers: { Authorization: `Bearer ${localStorage.getItem('token')}` }
       });
-      const fullUrl = `${window.location.origin}/preview/${res.data.share_token}`;
+      const fullUrl = `${window.location.origin}${res.data.url}`;
       setShareUrl(fullUrl);
       setShowShareModal(true);
     } catch (e) {
@@ -660,13 +750,15 @@ const App = () => {
       return normalizedCode + configScript + reportPrintStyle + selectionScript;
     }
   };
-  const fetchLicenses = async () => {
+  const fetchLicenses = async (cursor = null) => {
     setLicenseLoading(true);
     try {
       const res = await axios.get('/api/v1/admin/list', {
+        params: cursor ? { cursor } : {},
         headers: { Authorization: `Bearer ${localStorage.getItem('token')}` }
       });
-      setLicenses(res.data);
+      setLicenses(prev => cursor ? [...prev, ...res.data] : res.data);
+      setLicenseCursor(res.headers['x-next-cursor'] || null);
     } catch (e) {
       message.error('获取授权列表失败');
     } finally {
@@ -715,6 +807,18 @@ const App = () => {
     demoCodeRef.current = demoCode;
   }, [demoCode]);
 
+  // 原型页签打开且已有项目时保持一个编辑会话，迭代和局部修改都走该会话
+  const editSessionRef = useRef(null);
+  useEffect(() => {
+    if (activeTab !== 'demo' || !currentProjectId || !localStorage.getItem('token')) return;
+    const session = openEditSession(currentProjectId, () => demoCodeRef.current);
+    editSessionRef.current = session;
+    return () => {
+      session.close();
+      if (editSessionRef.current === session) editSessionRef.current = null;
+    };
+  }, [activeTab, currentProjectId]);
+
   /**
    * 自动滚动代码编辑器到指定的元素位置并实现亮黄色高亮
    * @param {string} traceId 元素的追踪ID
@@ -779,6 +883,8 @@ const App = () => {
     { role: 'assistant', content: '你好！我是你的智能开发助手。请告诉我你想做什么？' }
   ]);
   const messagesEndRef = useRef(null);
+  // 已保存到后端的消息条数：之后新增的消息逐条追加，不再整体回写（欢迎语等本地提示不保存）
+  const persistedMessageCountRef = useRef(1);
   const requirementsAutosaveTimerRef = useRef(null);
   const requirementsSaveInFlightRef = useRef(false);
 
@@ -877,6 +983,7 @@ const App = () => {
     
     try {
       const res = await axios.get('/api/v1/generation/projects/', {
+        params: { fields: 'id,name,updated_at' },
         headers: { 'Authorization': `Bearer ${token}` }
       });
       setProjects(res.data);
@@ -898,20 +1005,39 @@ const App = () => {
     }
   };
 
-  const saveProject = async (stepKey, content, chatHistory = null) => {
+  // 原型修改：编辑会话可用时通过 WebSocket 发送（只传意见和 data-trace-id，服务端修改完成后自行保存），
+  // 否则回退到 HTTP 流式接口。onFinal(text, saved) 中 saved 表示服务端已保存
+  const streamDemoEdit = async (payload, httpUrl, httpBody, onChunk, onFinal, onError) => {
+    const signal = abortControllerRef.current?.signal;
+    const session = editSessionRef.current;
+    if (session?.ready) {
+      try {
+        const result = await session.edit(payload, onChunk, signal);
+        if (result) onFinal(result.text, result.saved);
+      } catch (err) {
+        if (onError) onError(err);
+        else throw err;
+      }
+      return;
+    }
+    await fetchStream(httpUrl, httpBody, onChunk, (final) => onFinal(final, false), onError, signal);
+  };
+
+  const saveProject = async (stepKey, content, rawRequirement) => {
     const token = localStorage.getItem('token');
     if (!token) {
-        if (!chatHistory) message.warning('请先登录以保存项目'); // Only warn if explicit save
+        message.warning('请先登录以保存项目');
         return;
     }
 
     const data = {};
     if (stepKey === 'requirements') data.requirements_doc = content;
+    // 原始需求用于识别之后输入相似的新项目
+    if (rawRequirement) data.raw_requirement = rawRequirement;
     if (stepKey === 'product') data.product_doc = content;
     if (stepKey === 'tech') data.tech_doc = content;
     if (stepKey === 'demo') data.demo_code = content;
     if (stepKey === 'report') data.report_content = content;
-    if (chatHistory) data.chat_history = JSON.stringify(chatHistory);
     
     if (stepKey === 'requirements' && !currentProjectId) {
          data.name = content.substring(0, 20).trim() || '新项目';
@@ -922,7 +1048,7 @@ const App = () => {
         await axios.patch(`/api/v1/generation/projects/${currentProjectId}`, data, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
-      } else if (stepKey) { // Only create new project if saving content, not just chat
+      } else if (stepKey) {
         const res = await axios.post('/api/v1/generation/projects/', {
           name: data.name || '新项目', 
           ...data
@@ -954,19 +1080,21 @@ const App = () => {
       setDemoPreviewCode(p.demo_code || ''); // 初始化预览代码
       setReportContent(p.report_content || '');
       
-      // Reset Chat or Load History
-      if (p.chat_history && p.chat_history !== "[]") {
-          try {
-              setMessages(JSON.parse(p.chat_history));
-          } catch (e) {
-              console.error("Failed to parse chat history", e);
-              setMessages([{ role: 'assistant', content: `已加载项目: ${p.name}。我们可以继续完善它。` }]);
-          }
-      } else {
-          setMessages([
-            { role: 'assistant', content: `已加载项目: ${p.name}。我们可以继续完善它。` }
-          ]);
+      // Reset Chat or Load History（只加载最近一页）
+      let history = [];
+      try {
+          const historyRes = await axios.get(`/api/v1/generation/projects/${id}/messages`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+          });
+          history = historyRes.data.map(m => ({ role: m.role, content: m.content }));
+      } catch (e) {
+          console.error("Failed to load chat history", e);
       }
+      const loadedMessages = history.length > 0
+          ? history
+          : [{ role: 'assistant', content: `已加载项目: ${p.name}。我们可以继续完善它。` }];
+      persistedMessageCountRef.current = loadedMessages.length;
+      setMessages(loadedMessages);
       
       // Reset selection state when loading a project
       setIsSelectionMode(false);
@@ -998,6 +1126,7 @@ const App = () => {
     
     setReportContent('');
     setActiveTab('requirements');
+    persistedMessageCountRef.current = 1;
     setMessages([{ role: 'assistant', content: '新项目已创建。请告诉我你的想法！' }]);
     
     // Reset selection state when creating a new project
@@ -1105,10 +1234,10 @@ const App = () => {
         setMessages(prev => [...prev, { role: 'assistant', content: feedback ? '正在根据反馈优化 PRD 文档...' : '正在为您生成 PRD 文档...' }]);
         await fetchStream(
           '/api/v1/generation/stream/requirements',
-          { raw_requirement: feedback || requirementsDoc, current_content: feedback ? requirementsDoc : null },
+          { raw_requirement: feedback || requirementsDoc, current_content: feedback ? requirementsDoc : null, project_id: currentProjectId },
           (chunk) => setRequirementsDoc(chunk),
           (final) => {
-             saveProject('requirements', final);
+             saveProject('requirements', final, feedback ? null : requirementsDoc);
              setLoading(false);
              setMessages(prev => [...prev, { role: 'assistant', content: 'PRD 文档已就绪。' }]);
           },
@@ -1125,7 +1254,8 @@ const App = () => {
           { 
               requirements_doc: requirementsDoc,
               feedback: feedback || null,
-              current_content: feedback ? productDoc : null
+              current_content: feedback ? productDoc : null,
+              project_id: currentProjectId
           },
           (chunk) => setProductDoc(chunk),
           (final) => {
@@ -1146,7 +1276,8 @@ const App = () => {
           { 
               product_doc: productDoc,
               feedback: feedback || null,
-              current_content: feedback ? techDoc : null
+              current_content: feedback ? techDoc : null,
+              project_id: currentProjectId
           },
           (chunk) => setTechDoc(chunk),
           (final) => {
@@ -1170,7 +1301,8 @@ const App = () => {
               { 
                 tech_doc: techDoc,
                 requirements_doc: requirementsDoc,
-                product_doc: productDoc
+                product_doc: productDoc,
+                project_id: currentProjectId
               },
               (chunk) => {
                  setDemoCode(extractHtml(chunk));
@@ -1191,15 +1323,16 @@ const App = () => {
               abortControllerRef.current.signal
             );
         } else {
-            await fetchStream(
+            await streamDemoEdit(
+              { feedback },
               '/api/v1/generation/stream/iterate',
-              { current_code: demoCode, user_feedback: feedback },
+              { current_code: demoCode, user_feedback: feedback, project_id: currentProjectId },
               (chunk) => {
                  setDemoCode(extractHtml(chunk));
               },
-              (final) => {
+              (final, saved) => {
                  const code = extractHtml(final);
-                 saveProject('demo', code);
+                 if (!saved) saveProject('demo', code);
                  setDemoPreviewCode(code); // 生成完成后更新预览
                  setIsDemoLoading(false); // 关闭预览区加载动画
                  setLoading(false);
@@ -1209,8 +1342,7 @@ const App = () => {
                 message.error('迭代原型失败: ' + err.message);
                 setLoading(false);
                 setIsDemoLoading(false);
-              },
-              abortControllerRef.current.signal
+              }
             );
         }
       } else if (targetTab === 'report') {
@@ -1223,7 +1355,8 @@ const App = () => {
             product_doc: productDoc,
             tech_doc: techDoc,
             demo_code: demoCode,
-            feedback: feedback || null
+            feedback: feedback || null,
+            project_id: currentProjectId
           },
           (chunk) => {
              setReportContent(extractHtml(chunk));
@@ -1253,9 +1386,23 @@ const App = () => {
   };
 
   useEffect(() => {
-    if (currentProjectId && messages.length > 0) {
-        const timer = setTimeout(() => {
-            saveProject(null, null, messages);
+    const token = localStorage.getItem('token');
+    if (currentProjectId && token && messages.length > persistedMessageCountRef.current) {
+        const timer = setTimeout(async () => {
+            const start = persistedMessageCountRef.current;
+            const pending = messages.slice(start).filter(m => m.content);
+            persistedMessageCountRef.current = messages.length;
+            if (pending.length === 0) return;
+            try {
+              await axios.post(`/api/v1/generation/projects/${currentProjectId}/messages`,
+                { messages: pending.map(m => ({ role: m.role, content: m.content })) },
+                { headers: { 'Authorization': `Bearer ${token}` } }
+              );
+            } catch (e) {
+              // 下次有新消息时重试
+              if (persistedMessageCountRef.current === messages.length) persistedMessageCountRef.current = start;
+              console.error("Append chat messages failed", e);
+            }
         }, 2000);
         return () => clearTimeout(timer);
     }
@@ -1335,7 +1482,13 @@ const App = () => {
       abortControllerRef.current = new AbortController();
       
       try {
-        await fetchStream(
+        await streamDemoEdit(
+          {
+            feedback: userMsg,
+            // 有 data-trace-id 的元素由服务端从其持有的代码中取 HTML，其余的附带片段
+            trace_ids: selectedSnapshot.filter(el => el.traceId).map(el => el.traceId),
+            elements: selectedSnapshot.filter(el => !el.traceId)
+          },
           '/api/v1/generation/stream/partial_edit',
           { 
             current_code: demoCode, 
@@ -1347,10 +1500,10 @@ const App = () => {
              if (code.includes('```html')) code = code.split('```html')[1].split('```')[0];
              setDemoCode(code);
           },
-          (final) => {
+          (final, saved) => {
              let code = final;
              if (code.includes('```html')) code = code.split('```html')[1].split('```')[0];
-             saveProject('demo', code);
+             if (!saved) saveProject('demo', code);
              setDemoPreviewCode(code); // 生成完成后更新预览
              setIsDemoLoading(false); // 关闭预览区加载动画
              setLoading(false);
@@ -1359,8 +1512,7 @@ const App = () => {
              setSelectedElements([]);
              setMessages(prev => [...prev, { role: 'assistant', content: '局部修改已完成。' }]);
           },
-          null,
-          abortControllerRef.current.signal
+          null
         );
       } catch (e) {
         setLoading(false);
@@ -2133,6 +2285,9 @@ const App = () => {
                 dataSource={licenses}
                 loading={licenseLoading}
                 rowKey="id"
+                footer={licenseCursor ? () => (
+                  <Button block onClick={() => fetchLicenses(licenseCursor)} loading={licenseLoading}>加载更多</Button>
+                ) : undefined}
                 columns={[
                   { title: '客户', dataIndex: 'username', key: 'username' },
                   { title: '授权码', dataIndex: 'license_key', key: 'license_key', render: k => <Tag color="blue">{k}</Tag> },